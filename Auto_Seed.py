@@ -0,0 +1,267 @@
+import os
+import csv
+import glob
+import json
+import warnings
+import numpy as np
+import rasterio
+from rasterio.warp import transform as warp_transform
+from scipy import ndimage
+
+from Datacube import parse_date
+from Process_TIFF import BAND_ORDER
+from Region_Growing import crop_origin
+
+# NDVI decrease marking disturbed ground, as the high-risk zones of Arctic_Hillslope_Failures_Analysis.ipynb
+CHANGE_THRESHOLD = -0.2
+
+# Columns of the seeds report written by seed_sites
+REPORT_COLUMNS = ['ID', 'Seed1', 'Seed2', 'Seed3', 'Seed4', 'crop_size', 'center', 'component_pixels',
+                  'component_change', 'center_distance', 'first_year', 'last_year', 'scenes']
+
+def site_center(file_path, latitude, longitude):
+    """
+    Return the 0-based (row, column) pixel of a site's point in a scene, from the scene's transform.
+    """
+    with rasterio.open(file_path) as src:
+        xs, ys = warp_transform('EPSG:4326', src.crs, [longitude], [latitude])
+        return src.index(xs[0], ys[0])
+
+def ndvi_stack(files, mask=None):
+    """
+    Return the NDVI of every scene as a float32 (date, height, width) array.
+
+    Scenes of a site can differ by a row or column at the edge of the area of interest, so all
+    are cut to their common size from the top-left corner, where pixel (row, column) seeds are
+    anchored. Pixels with both bands zero, or invalid in the optional Quality_Mask.MaskStore,
+    are NaN.
+    """
+    ndvi = []
+    for file in files:
+        with rasterio.open(file) as src:
+            nir, red = src.read([BAND_ORDER['nir'], BAND_ORDER['red']], out_dtype=np.float32)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scene = (nir - red) / (nir + red)
+        if mask is not None:
+            scene[~mask.mask(file)] = np.nan
+        ndvi.append(scene)
+    height = min(values.shape[0] for values in ndvi)
+    width = min(values.shape[1] for values in ndvi)
+    return np.stack([values[:height, :width] for values in ndvi])
+
+def disturbance(ndvi, years, change_threshold=CHANGE_THRESHOLD):
+    """
+    Return the candidate disturbed pixels of a site, its NDVI change and its water.
+
+    The change is the median NDVI of the last year minus that of the first, so a single cloudy
+    or snowy date does not create a change. A pixel is a candidate where NDVI fell by more than
+    change_threshold, or where the last year's NDVI is that far below the site's median, which
+    also finds failures already bare at the first date. Water (median NDVI below zero) is
+    never a candidate.
+
+    Parameters:
+    - ndvi: float32 (date, height, width) NDVI, e.g. from ndvi_stack.
+    - years: Year of every date.
+    - change_threshold: Negative NDVI difference marking disturbance.
+
+    Returns:
+    - Boolean (height, width) candidates, the float (height, width) change, and the boolean
+      (height, width) water.
+    """
+    years = np.asarray(years)
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        # All-NaN pixels (never valid) stay NaN and are neither candidates nor water
+        warnings.simplefilter('ignore', RuntimeWarning)
+        early = np.nanmedian(ndvi[years == years.min()], axis=0)
+        late = np.nanmedian(ndvi[years == years.max()], axis=0)
+        water = np.nanmedian(ndvi, axis=0) < 0
+        change = late - early
+        candidates = ((change < change_threshold) | (late - np.nanmedian(late) < change_threshold)) & ~water
+    # Opening drops isolated pixels and one-pixel bridges between separate features
+    return ndimage.binary_opening(candidates), change, water
+
+def _interior(region):
+    # Pixel of a region farthest from its edge
+    distance = ndimage.distance_transform_edt(region)
+    return tuple(int(i) for i in np.unravel_index(np.argmax(distance), distance.shape))
+
+def _central(region, center, depth=4, weight=0.2):
+    # Pixel of a region near the site point yet depth pixels inside its edge: each pixel of
+    # depth is worth 1 / weight pixels of distance to the point
+    distance = np.minimum(ndimage.distance_transform_edt(region), depth)
+    rows, cols = np.indices(region.shape)
+    score = np.where(region, distance - weight * np.hypot(rows - center[0], cols - center[1]), -np.inf)
+    return tuple(int(i) for i in np.unravel_index(np.argmax(score), score.shape))
+
+def crop_window(component, shape, pixel_size, buffer_size=500, margin=10):
+    """
+    Return the crop_size centred on the scene that keeps a component and a margin around it.
+
+    The crop never extends past the buffer around the site point, whose radius in pixels comes
+    from the scene's pixel size. None is returned when the crop would cover the whole scene.
+    """
+    height, width = shape
+    rows, cols = np.nonzero(component)
+    # crop_center keeps rows height // 2 - 1 - half to height // 2 - 1 + half for a crop of 2 * half + 1
+    half = int(max(np.abs(rows - (height // 2 - 1)).max(), np.abs(cols - (width // 2 - 1)).max())) + margin
+    half = min(half, int(np.ceil(buffer_size / pixel_size)))
+    size = (min(2 * half + 1, height), min(2 * half + 1, width))
+    return None if size == (height, width) else size
+
+def place_seeds(folder, latitude, longitude, change_threshold=CHANGE_THRESHOLD, min_size=20, buffer_size=500, margin=10, crop=True, water_seed=False, mask=None):
+    """
+    Choose the seeds and crop of a site from its multi-date NDVI change.
+
+    Seed1 is a pixel of the disturbed component nearest the site's point, found with
+    disturbance, a few pixels inside its edge and otherwise as close to the point as possible.
+    It is taken from the part of the component inside the crop, or is the site point clipped
+    into the crop when the buffer cuts the component off. Seed2 is the stable, non-water pixel
+    farthest from that component inside the crop. With water_seed, Seed3 is the most interior pixel of the largest water body, so
+    water adjacent to a failure grows as its own region.
+
+    Parameters:
+    - folder: Site folder of Sentinel2_YYYY-MM-DD.tif scenes.
+    - latitude, longitude: Site point, the centre of the exported area of interest.
+    - change_threshold: See disturbance.
+    - min_size: Minimum size in pixels of a disturbed component or water body.
+    - buffer_size: Buffer in meters of the exported area of interest, bounding the crop.
+    - margin: Pixels kept around the component by the crop.
+    - crop: Whether to choose a crop_size; otherwise whole scenes are segmented, cut to their
+      common size when they differ.
+    - water_seed: Whether to seed water bodies as a separate region.
+    - mask: Optional Quality_Mask.MaskStore leaving invalid pixels out of the statistics.
+
+    Returns:
+    - Dictionary with 0-based Seed1 to Seed4 in the coordinates of the cropped image,
+      crop_size and mods (None) as in the batch config, and the statistics of the seeding for
+      the report.
+    """
+    files = sorted(glob.glob(os.path.join(folder, "*.tif")), key=parse_date)
+    if len(files) < 2:
+        raise ValueError(f"At least two scenes are needed to place seeds in {folder}.")
+    years = [parse_date(f).year for f in files]
+    ndvi = ndvi_stack(files, mask)
+    shape = ndvi.shape[1:]
+    candidates, change, water = disturbance(ndvi, years, change_threshold)
+    shapes = set()
+    for file in files:
+        with rasterio.open(file) as src:
+            shapes.add(src.shape)
+            pixel_size = abs(src.transform[0])
+    center = site_center(files[-1], latitude, longitude)
+    center = (min(max(center[0], 0), shape[0] - 1), min(max(center[1], 0), shape[1] - 1))
+
+    labels, count = ndimage.label(candidates, structure=np.ones((3, 3)))
+    sizes = np.bincount(labels.ravel(), minlength=count + 1)
+    sizes[0] = 0
+    large = sizes >= min_size
+    if large[1:].any():
+        labels[~large[labels]] = 0
+        # Component nearest the site point; the point itself when it lies inside one
+        distance, nearest = ndimage.distance_transform_edt(labels == 0, return_indices=True)
+        component = labels == labels[nearest[0][center], nearest[1][center]]
+        center_distance = float(distance[center])
+    else:
+        # No disturbance found: seed the site point itself
+        component = np.zeros(shape, dtype=bool)
+        component[center] = True
+        center_distance = 0.0
+
+    crop_size = crop_window(component, shape, pixel_size, buffer_size, margin) if crop else None
+    if crop_size is None and len(shapes) > 1:
+        # Masks are carried between dates, so scenes of different sizes are cut to their common size
+        crop_size = shape
+    if crop_size is None:
+        top = left = 0
+        window = (slice(None), slice(None))
+    else:
+        top, left = crop_origin(shape, crop_size)
+        window = (slice(top, top + crop_size[0]), slice(left, left + crop_size[1]))
+
+    # The buffer can cut the crop short of the component, so Seed1 is chosen inside the crop
+    cropped = np.zeros(shape, dtype=bool)
+    cropped[window] = component[window]
+    if cropped.any():
+        seed1 = _central(cropped, center)
+    else:
+        bottom, right = (shape[0], shape[1]) if crop_size is None else (top + crop_size[0], left + crop_size[1])
+        seed1 = (min(max(center[0], top), bottom - 1), min(max(center[1], left), right - 1))
+
+    stable = ~candidates & ~water & ~np.isnan(change)
+    distance = ndimage.distance_transform_edt(~component)
+    distance[~stable] = -1
+    seed2 = np.unravel_index(np.argmax(distance[window]), distance[window].shape)
+    seeds = {'Seed1': (seed1[0] - top, seed1[1] - left), 'Seed2': tuple(int(i) for i in seed2), 'Seed3': None, 'Seed4': None}
+
+    if water_seed:
+        water_labels, water_count = ndimage.label(water[window], structure=np.ones((3, 3)))
+        water_sizes = np.bincount(water_labels.ravel(), minlength=water_count + 1)
+        water_sizes[0] = 0
+        if water_sizes.max() >= min_size:
+            seeds['Seed3'] = _interior(water_labels == np.argmax(water_sizes))
+
+    return {
+        **{name: None if seed is None else [int(seed[0]), int(seed[1])] for name, seed in seeds.items()},
+        'crop_size': None if crop_size is None else list(crop_size),
+        'mods': None,
+        'center': [int(center[0]), int(center[1])],
+        'component_pixels': int(np.count_nonzero(component)),
+        'component_change': float(np.nanmean(change[component])) if np.isfinite(change[component]).any() else None,
+        'center_distance': center_distance,
+        'first_year': int(min(years)),
+        'last_year': int(max(years)),
+        'scenes': len(files),
+    }
+
+def is_auto(site):
+    """
+    Check whether a site of a batch config asks for automatic seeds, with Seed1 "auto" or missing.
+    """
+    return site.get('Seed1') in (None, 'auto')
+
+def seed_sites(config_path, output_path=None, report_path=None, overwrite=False, **options):
+    """
+    Place the seeds of every site of a batch config without any interactive preview.
+
+    Sites whose Seed1 is "auto" or missing get automatic seeds, crop_size and mods; with
+    overwrite, every site does. The other sites keep their hand-picked settings.
+
+    Parameters:
+    - config_path: Batch config, e.g. Data/segmentation_sites.json; folders are relative to it.
+    - output_path: Optional path to write the config with the chosen seeds to, for run_batch.
+    - report_path: Optional CSV path of the seeds report, one row per seeded site.
+    - overwrite: Whether to re-seed sites that already have seeds.
+    - options: Keyword arguments of place_seeds.
+
+    Returns:
+    - The updated config dictionary and the report rows.
+    """
+    with open(config_path) as f:
+        config = json.load(f)
+    root = os.path.dirname(os.path.abspath(config_path))
+    rows = []
+    for site in config['sites']:
+        if not overwrite and not is_auto(site):
+            continue
+        placed = place_seeds(os.path.join(root, site['folder']), site['Latitude'], site['Longitude'], **options)
+        for key in ('Seed1', 'Seed2', 'Seed3', 'Seed4', 'crop_size', 'mods'):
+            site[key] = placed[key]
+        rows.append({'ID': site['ID'], **{column: placed[column] for column in REPORT_COLUMNS[1:]}})
+        print(f"Seeded {site['ID']}: Seed1 {placed['Seed1']}, Seed2 {placed['Seed2']}, crop {placed['crop_size']}")
+
+    if output_path is not None:
+        # Keep folders relative to the written config, as load_config resolves them
+        output_root = os.path.dirname(os.path.abspath(output_path))
+        for site in config['sites']:
+            site['folder'] = os.path.relpath(os.path.join(root, site['folder']), output_root)
+        with open(output_path, 'w') as f:
+            json.dump(config, f, indent=2)
+    if report_path is not None:
+        with open(report_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    return config, rows
+
+if __name__ == "__main__":
+    seed_sites("Data/segmentation_sites.json", "Output/segmentation_sites_auto.json", "Output/Auto_Seeds.csv", overwrite=True)
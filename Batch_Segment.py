@@ -0,0 +1,302 @@
+import os
+import csv
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from Region_Growing import segment_mask, segment_ndvi, sweep_mask, sweep_ndvi
+from Results_Store import ResultsSink
+from Select_Bands import BandService
+from Normalization import Stretch
+from Quality_Mask import MaskStore
+from Auto_Seed import is_auto, place_seeds
+from Scene_Catalog import SceneCatalog
+
+# Result columns of each segmentation method, matching the existing Output/Threshold_*_Results.csv
+COLUMNS = {
+    'mask': ['Date', 'Pixels', 'Threshold', 'ID', 'Latitude', 'Longitude', 'Area_m2'],
+    'ndvi': ['Pixels', 'Date', 'Threshold', 'ID', 'Year', 'Month', 'Latitude', 'Longitude', 'Area_m2'],
+}
+
+def threshold_grid(thresholds):
+    """
+    Expand a threshold grid given as a list or as {'start', 'stop', 'step'} with stop included.
+    """
+    if isinstance(thresholds, dict):
+        count = int(round((thresholds['stop'] - thresholds['start']) / thresholds['step'])) + 1
+        thresholds = thresholds['start'] + thresholds['step'] * np.arange(count)
+    return [round(float(t), 6) for t in thresholds]
+
+SEED_KEYS = ('Seed1', 'Seed2', 'Seed3', 'Seed4', 'crop_size')
+
+def load_config(path):
+    """
+    Load a batch segmentation config, e.g. Data/segmentation_sites.json.
+
+    The config holds a default threshold grid and one entry per site with its ID, Latitude,
+    Longitude, folder, 0-based Seed1 to Seed4, and optionally crop_size, mods, ndwi_image,
+    ndwi_threshold, incremental (see Region_Growing.segment_window), stretch (the keyword
+    arguments of a Normalization.Stretch of the RGB composites), mask (true, or the keyword
+    arguments of a Quality_Mask.MaskStore, to count only valid pixels), min_valid (the
+    smallest valid fraction of a counted date) and its own thresholds. Relative folders are
+    resolved against the config's directory.
+
+    Loading only reads the config: sites with Seed1 "auto" or without seeds are seeded by
+    auto_seed, and pixel areas are added by catalog_sites, as run_batch does.
+
+    Returns:
+    - List of site dictionaries, each with its expanded threshold list.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    root = os.path.dirname(os.path.abspath(path))
+    sites = []
+    for site in config['sites']:
+        site = dict(site)
+        site['folder'] = os.path.join(root, site['folder'])
+        site['thresholds'] = threshold_grid(site.get('thresholds', config['thresholds']))
+        if not is_auto(site):
+            site.update({key: tuple(site[key]) for key in SEED_KEYS if site.get(key) is not None})
+        sites.append(site)
+    return sites
+
+def _place_seeds(site):
+    # Automatic seeds of one site, in a worker process
+    placed = place_seeds(site['folder'], site['Latitude'], site['Longitude'])
+    return {key: placed[key] for key in SEED_KEYS + ('mods',)}
+
+def auto_seed(sites, executor=None):
+    """
+    Give the sites of load_config with Seed1 "auto" or without seeds their seeds, crop_size
+    and mods from Auto_Seed.place_seeds, so new sites need no interactive tuning.
+
+    Parameters:
+    - sites: Site dictionaries of load_config, updated in place.
+    - executor: Optional executor seeding the sites in parallel, e.g. run_batch's process pool.
+
+    Returns:
+    - The sites.
+    """
+    pending = [site for site in sites if is_auto(site)]
+    placed = executor.map(_place_seeds, pending) if executor is not None else map(_place_seeds, pending)
+    for site, seeds in zip(pending, placed):
+        site.update({key: tuple(value) if key in SEED_KEYS and value is not None else value
+                     for key, value in seeds.items()})
+    return sites
+
+def catalog_sites(sites, catalogs=None):
+    """
+    Give every site the pixel area of its scenes from the Scene_Catalog of its data folder,
+    refreshed once per folder, so results carry areas in m².
+
+    A site whose scenes differ in size needs a crop_size, as masks are carried between dates,
+    so this runs after auto_seed; a ValueError is raised otherwise.
+
+    Parameters:
+    - sites: Site dictionaries of load_config, updated in place.
+    - catalogs: Optional {data folder: SceneCatalog} of already refreshed catalogs.
+
+    Returns:
+    - The sites.
+    """
+    catalogs = {} if catalogs is None else catalogs
+    for site in sites:
+        data_dir = os.path.dirname(site['folder'])
+        if data_dir not in catalogs:
+            catalogs[data_dir] = SceneCatalog(data_dir)
+            catalogs[data_dir].refresh()
+        site['pixel_areas'] = catalogs[data_dir].pixel_areas(site['ID'])
+        if site.get('crop_size') is None:
+            shapes = sorted({(record['height'], record['width']) for record in catalogs[data_dir].query(site['ID'])})
+            if len(shapes) > 1:
+                raise ValueError(f"Scenes of {site['ID']} have different shapes {shapes}; set a crop_size no "
+                                 f"larger than the smallest one.")
+    return sites
+
+def _rows(site, threshold, series):
+    # Result rows of one (site, threshold) cell; Area_m2 is None for scenes missing from the catalog
+    rows = []
+    pixel_areas = site.get('pixel_areas', {})
+    for date, pixels in series:
+        pixel_area = pixel_areas.get(date.isoformat())
+        rows.append({'Date': date, 'Pixels': pixels, 'Threshold': threshold, 'ID': site['ID'],
+                     'Year': date.year, 'Month': date.month,
+                     'Latitude': site['Latitude'], 'Longitude': site['Longitude'],
+                     'Area_m2': None if pixel_area is None else pixels * pixel_area})
+    return rows
+
+def _service(site):
+    # Band service of a site, stretching its composites and masking invalid pixels as configured
+    mask = site.get('mask')
+    if mask:
+        mask = MaskStore(**mask) if isinstance(mask, dict) else MaskStore()
+    return BandService(Stretch(**site['stretch']) if site.get('stretch') else None, mask or None)
+
+def mask_options(site):
+    """
+    Keyword arguments of Region_Growing.segment_mask and sweep_mask configured by a site entry
+    of load_config, besides its folder, seeds and thresholds.
+    """
+    return {'ndwi_threshold': site.get('ndwi_threshold', 0.65), 'ndwi_image': site.get('ndwi_image'),
+            'crop_size': site.get('crop_size'), 'mods': site.get('mods'),
+            'incremental': site.get('incremental', False), 'service': _service(site),
+            'min_valid': site.get('min_valid', 0.0)}
+
+def _segment_cell(site, threshold, method):
+    # Segment one (site, threshold) cell in a worker process and return its result rows
+    seeds = (site['Seed1'], site['Seed2'], site.get('Seed3'), site.get('Seed4'))
+    if method == 'mask':
+        series = segment_mask(site['folder'], *seeds, ndvi_threshold=threshold, **mask_options(site))
+    else:
+        series = segment_ndvi(site['folder'], *seeds, ndvi_threshold=threshold, crop_size=site.get('crop_size'),
+                              service=_service(site), min_valid=site.get('min_valid', 0.0))
+    return {threshold: _rows(site, threshold, series)}
+
+def _sweep_site(site, thresholds, method):
+    # Segment every pending threshold of a site together and return the rows of each cell
+    seeds = (site['Seed1'], site['Seed2'], site.get('Seed3'), site.get('Seed4'))
+    if method == 'mask':
+        sweep = sweep_mask(site['folder'], *seeds, thresholds=thresholds, **mask_options(site))
+    else:
+        sweep = sweep_ndvi(site['folder'], *seeds, thresholds=thresholds, crop_size=site.get('crop_size'),
+                           service=_service(site), min_valid=site.get('min_valid', 0.0))
+    return {threshold: _rows(site, threshold, sweep[threshold]) for threshold in thresholds}
+
+class CsvSink:
+    """
+    Results CSV with the same interface as Results_Store.ResultsSink.
+
+    Rows are appended and flushed per write, and each completed cell is then recorded in a
+    ledger next to the CSV (path + '.done'). Rows of cells missing from the ledger are left
+    over from an interrupted run and are dropped when the sink is opened. A CSV without a
+    ledger, e.g. one written before this sink, is kept whole and its cells are recorded as
+    completed. A CSV written with fewer columns, e.g. before Area_m2, is rewritten with the
+    new columns left empty.
+    """
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.completed = set()
+        has_ledger = os.path.exists(path + '.done')
+        if has_ledger:
+            with open(path + '.done') as f:
+                for line in f:
+                    if line.strip():
+                        cell = json.loads(line)
+                        self.completed.add((cell['ID'], cell['Threshold']))
+
+        if os.path.exists(path):
+            with open(path, newline='') as f:
+                reader = csv.DictReader(f)
+                rows = list(reader)
+            if has_ledger:
+                kept = [row for row in rows if (row['ID'], float(row['Threshold'])) in self.completed]
+            else:
+                # No ledger to tell finished cells from interrupted ones: keep every row
+                kept = rows
+                cells = {(row['ID'], float(row['Threshold'])) for row in rows}
+                with open(path + '.done', 'w') as f:
+                    for site_id, threshold in sorted(cells):
+                        f.write(json.dumps({'ID': site_id, 'Threshold': threshold}) + '\n')
+                self.completed = cells
+            if len(kept) < len(rows) or reader.fieldnames != list(columns):
+                with open(path + '.tmp', 'w', newline='') as f:
+                    writer = csv.DictWriter(f, columns, extrasaction='ignore')
+                    writer.writeheader()
+                    writer.writerows(kept)
+                os.replace(path + '.tmp', path)
+
+        write_header = not os.path.exists(path)
+        self.results = open(path, 'a', newline='')
+        self.ledger = open(path + '.done', 'a')
+        self.writer = csv.DictWriter(self.results, columns, extrasaction='ignore')
+        if write_header:
+            self.writer.writeheader()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.results.close()
+        self.ledger.close()
+
+    def write(self, rows, cells=()):
+        rows = [dict(row, Date=row['Date'].isoformat()) for row in rows]
+        self.writer.writerows(rows)
+        self.results.flush()
+        for site_id, threshold in cells:
+            self.ledger.write(json.dumps({'ID': site_id, 'Threshold': threshold}) + '\n')
+            self.completed.add((site_id, threshold))
+        self.ledger.flush()
+
+    def flush(self):
+        pass
+
+def run_batch(config_path, output_path, method='mask', workers=4, sweep=True):
+    """
+    Segment every site of a config at every threshold of its grid on a process pool, streaming
+    the results to a CSV or to a partitioned Parquet dataset (see Results_Store.ResultsSink).
+
+    Sites with unfinished cells are first seeded with auto_seed on the same pool and given
+    their pixel areas with catalog_sites.
+
+    With sweep, each site is one task evaluating all its pending thresholds together (see
+    Region_Growing.sweep_mask); otherwise each (site, threshold) cell is one task. Rows are
+    handed to the sink as soon as their task finishes, and each cell is recorded as completed
+    once its rows are written, so an interrupted run restarts with only the unfinished cells.
+
+    Parameters:
+    - config_path: Config file, see load_config.
+    - output_path: Results CSV, e.g. Output/Threshold_Segmentation_Results.csv, or a Parquet
+      dataset folder for any path not ending in .csv.
+    - method: 'mask' for segment_mask with the threshold as ndvi_threshold, or 'ndvi' for
+      segmentation of the NDVI binarized at the threshold.
+    - workers: Number of worker processes.
+    - sweep: Whether to share the threshold-independent work of a site across its thresholds.
+
+    Returns:
+    - Dictionary of errors by (site, threshold).
+    """
+    if method not in COLUMNS:
+        raise ValueError(f"method must be one of {tuple(COLUMNS)}, not {method}.")
+    if output_path.endswith('.csv'):
+        sink = CsvSink(output_path, COLUMNS[method])
+    else:
+        sink = ResultsSink(output_path)
+    sites = load_config(config_path)
+
+    errors = {}
+    with sink, ProcessPoolExecutor(max_workers=workers) as executor:
+        unfinished = [site for site in sites if any((site['ID'], threshold) not in sink.completed
+                                                    for threshold in site['thresholds'])]
+        catalog_sites(auto_seed(unfinished, executor))
+        cells = [(site, threshold) for site in unfinished for threshold in site['thresholds']
+                 if (site['ID'], threshold) not in sink.completed]
+        print(f"{len(sink.completed)} cells already completed, {len(cells)} to run")
+        if sweep:
+            pending = {}
+            for site, threshold in cells:
+                pending.setdefault(site['ID'], (site, []))[1].append(threshold)
+            futures = {executor.submit(_sweep_site, site, thresholds, method): (site['ID'], thresholds)
+                       for site, thresholds in pending.values()}
+        else:
+            futures = {executor.submit(_segment_cell, site, threshold, method): (site['ID'], [threshold])
+                       for site, threshold in cells}
+        for i, future in enumerate(as_completed(futures), 1):
+            site_id, thresholds = futures[future]
+            try:
+                rows = future.result()
+            except Exception as e:
+                for threshold in thresholds:
+                    errors[(site_id, threshold)] = str(e)
+                print(f"[{i}/{len(futures)}] Failed {site_id} at {len(thresholds)} thresholds: {e}")
+                continue
+            sink.write([row for threshold in thresholds for row in rows[threshold]],
+                       [(site_id, threshold) for threshold in thresholds])
+            print(f"[{i}/{len(futures)}] Segmented {site_id} at {len(thresholds)} thresholds")
+    return errors
+
+if __name__ == "__main__":
+    root = os.path.dirname(os.path.abspath(__file__))
+    run_batch(os.path.join(root, "Data", "segmentation_sites.json"),
+              os.path.join(root, "Output", "Batch_Segmentation_Results.csv"))
@@ -0,0 +1,695 @@
+import os
+import glob
+import time
+import shutil
+import tempfile
+import contextlib
+import io
+import re
+import csv
+import json
+import subprocess
+import datetime
+import threading
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.transform import from_origin
+from PIL import Image
+from matplotlib.path import Path
+
+from Process_TIFF import calculate_ndvi, calculate_products, ProductEngine, process_folder, DEFAULT_INDICES
+from Region_Growing import seeded_region_growing, build_seeds, sweep_mask
+from Instrumentation import Profiler
+from Select_Bands import select_bands_array
+from Sentinel_Export import ExportOrchestrator, COLLECTION
+import Threshold_Analysis
+from Datacube import SiteCube
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(ROOT_DIR, "Data")
+OUTPUT_DIR = os.path.join(ROOT_DIR, "Output")
+
+def _site_files(pattern="Sentinel-s00*"):
+    # Collect the GeoTIFFs of every matching site folder
+    files = []
+    for folder in sorted(glob.glob(os.path.join(DATA_DIR, pattern))):
+        files.extend(sorted(glob.glob(os.path.join(folder, "*.tif"))))
+    return files
+
+def _copy_files(files, destination):
+    # Products are written next to each GeoTIFF, so benchmark on copies to keep Data/ untouched
+    copies = []
+    for file in files:
+        folder = os.path.join(destination, os.path.basename(os.path.dirname(file)))
+        os.makedirs(folder, exist_ok=True)
+        copies.append(shutil.copy(file, folder))
+    return copies
+
+def _time_run(function, files):
+    # Time a product function over every file with progress printing silenced
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for file in files:
+            function(file)
+    return time.perf_counter() - start
+
+def benchmark_products(pattern="Sentinel-s00*", repeat=3, threshold=False, verify=True):
+    """
+    Compare calculate_ndvi with the single-read ProductEngine on the site GeoTIFFs.
+
+    Parameters:
+    - pattern: Glob pattern of site folders inside Data/.
+    - repeat: Number of timed runs per implementation; the fastest is reported.
+    - threshold: Optional NDVI threshold passed to both implementations.
+    - verify: Whether to check that both implementations write identical images.
+
+    Returns:
+    - Dictionary with the scene count, best times in seconds and the speedup.
+    """
+    files = _site_files(pattern)
+    if not files:
+        raise FileNotFoundError(f"No GeoTIFFs found in {DATA_DIR} for pattern {pattern}")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        legacy_files = _copy_files(files, os.path.join(temp_dir, "legacy"))
+        engine_files = _copy_files(files, os.path.join(temp_dir, "engine"))
+        engine = ProductEngine(threshold=threshold)
+
+        legacy = min(_time_run(lambda f: calculate_ndvi(f, threshold=threshold), legacy_files) for _ in range(repeat))
+        fused = min(_time_run(lambda f: calculate_products(f, threshold=threshold, engine=engine), engine_files) for _ in range(repeat))
+
+        if verify:
+            for legacy_file, engine_file in zip(legacy_files, engine_files):
+                for product in ("RGB", "NDVI", "NDWI", "RGBA"):
+                    extension = "png" if product == "RGBA" else "jpg"
+                    name = f"{product}_{os.path.splitext(os.path.basename(legacy_file))[0][-10:]}.{extension}"
+                    a = np.asarray(Image.open(os.path.join(os.path.dirname(legacy_file), product, name)))
+                    b = np.asarray(Image.open(os.path.join(os.path.dirname(engine_file), product, name)))
+                    if not np.array_equal(a, b):
+                        raise AssertionError(f"{product} differs for {legacy_file}")
+
+    result = {'scenes': len(files), 'calculate_ndvi': legacy, 'ProductEngine': fused, 'speedup': legacy / fused}
+    print(f"{len(files)} scenes: calculate_ndvi {legacy:.2f} s, ProductEngine {fused:.2f} s ({legacy / fused:.2f}x)")
+    return result
+
+def manual_seeds(csv_path, shape=(101, 101)):
+    """
+    Derive (row, column) seeds from the first outline of a manual segmentation CSV.
+
+    Seed1 is the outline vertex closest to the outline's centroid that lies inside it, or the
+    centroid itself when it is inside; Seed2 is the image corner farthest from the centroid.
+    """
+    with open(csv_path, newline='') as f:
+        points = np.array(json.loads(next(csv.DictReader(f))['Clicked Points']))
+    # Clicked points are (x, y) = (column, row)
+    outline = Path(points)
+    centroid = points.mean(axis=0)
+    if outline.contains_point(centroid):
+        inside = centroid
+    else:
+        inside = points[np.argmin(np.hypot(*(points - centroid).T))]
+    seed1 = (int(round(inside[1])), int(round(inside[0])))
+    corners = [(0, 0), (0, shape[1] - 1), (shape[0] - 1, 0), (shape[0] - 1, shape[1] - 1)]
+    seed2 = max(corners, key=lambda c: (c[0] - seed1[0]) ** 2 + (c[1] - seed1[1]) ** 2)
+    return seed1, seed2
+
+def _time_julia(files, seeds, repeat):
+    # Time count_pixels through Julia_Segment.jl, or return None when Julia is not installed
+    julia = shutil.which("julia")
+    if julia is None:
+        return None
+    (r1, c1), (r2, c2) = seeds
+    script = f"""
+include({json.dumps(os.path.join(ROOT_DIR, "Julia_Segment.jl"))})
+files = {json.dumps(files)}
+run() = for file in files
+    redirect_stdout(devnull) do
+        count_pixels(select_bands(file, 1, 2, 3), ({r1 + 1}, {c1 + 1}), ({r2 + 1}, {c2 + 1}))
+    end
+end
+run()
+println(minimum([@elapsed(run()) for _ in 1:{repeat}]))
+"""
+    output = subprocess.run([julia, "-e", script], capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+def benchmark_region_growing(repeat=3, connectivity=8):
+    """
+    Time the Python seeded region growing against the Julia/PyCall path on the sites with a
+    Output/Manual_Segmentation_sXXX.csv, using seeds derived from the manual outlines.
+
+    Julia compilation is excluded by a warm-up run. When Julia is not installed only the Python
+    timings are reported.
+
+    Returns:
+    - Dictionary per site with the scene count, seeds and best times in seconds.
+    """
+    results = {}
+    for csv_path in sorted(glob.glob(os.path.join(OUTPUT_DIR, "Manual_Segmentation_s*.csv"))):
+        site = re.search(r'(s\d+)', os.path.basename(csv_path)).group(1)
+        files = sorted(glob.glob(os.path.join(DATA_DIR, f"Sentinel-{site}", "*.tif")))
+        if not files:
+            continue
+        # Scenes of a site can differ by a pixel, so keep the corner seed inside all of them
+        shapes = [select_bands_array(file, 1, 2, 3).shape[:2] for file in files]
+        seeds = manual_seeds(csv_path, shape=tuple(int(n) for n in np.min(shapes, axis=0)))
+
+        def run():
+            for file in files:
+                seeded_region_growing(select_bands_array(file, 1, 2, 3), build_seeds(*seeds), connectivity)
+
+        python = min(_time_run(lambda f: f(), [run]) for _ in range(repeat))
+        julia = _time_julia(files, seeds, repeat)
+        results[site] = {'scenes': len(files), 'seeds': seeds, 'Python': python, 'Julia': julia}
+
+        julia_text = "Julia not installed" if julia is None else f"Julia {julia:.2f} s"
+        print(f"{site}: {len(files)} scenes, seeds {seeds}: Python {python:.2f} s, {julia_text}")
+    return results
+
+def _naive_best_subset(X, y):
+    # Best RSS of every subset size by a separate least-squares fit per subset, as without caching.
+    # Columns are standardized, since raw powers of year are rank-deficient to lstsq's tolerance.
+    X = np.asarray(X, dtype=np.float64)
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    y = np.asarray(y, dtype=np.float64)
+    p = X.shape[1]
+    best = np.full(p + 1, np.inf)
+    for subset in range(1, 2 ** p):
+        columns = [j for j in range(p) if subset >> j & 1]
+        design = np.column_stack([np.ones(len(y)), X[:, columns]])
+        residual = y - design @ np.linalg.lstsq(design, y, rcond=None)[0]
+        best[len(columns)] = min(best[len(columns)], residual @ residual)
+    return best[1:]
+
+def benchmark_analysis(results_path=None, degrees=(2, 3), repeat=3, verify=True):
+    """
+    Time the Threshold_Analysis growth rates and model selection on the combined manual and
+    threshold result tables.
+
+    Growth rates of every (site, threshold, year) are compared with a pandas groupby-apply of
+    np.polyfit. Subset selection of Area on polynomial terms of month, year and threshold plus
+    latitude is compared with one least-squares fit per subset, for each degree without and
+    with site indicator columns.
+
+    Returns:
+    - Dictionary with the growth-rate timings and, per predictor count, the degree and timings.
+    """
+    results_path = results_path or os.path.join(OUTPUT_DIR, "Threshold_Segmentation_Results.csv")
+    manual = Threshold_Analysis.load_manual(OUTPUT_DIR)
+    table = Threshold_Analysis.load_results(results_path)
+    combined = Threshold_Analysis.combine(table, manual).merge(manual[['ID', 'Date', 'year', 'month']], on=['ID', 'Date'])
+
+    def grouped_polyfit():
+        groups = table.assign(year=table['Date'].dt.year).groupby(['ID', 'Threshold', 'year'])
+        return groups.apply(lambda group: np.polyfit(group['Date'].dt.dayofyear, group['Area'], 1)[0]
+                            if group['Date'].nunique() > 1 else np.nan)
+
+    def timed(function):
+        best = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            value = function()
+            best = min(best, time.perf_counter() - start)
+        return best, value
+
+    vectorized, rates = timed(lambda: Threshold_Analysis.growth_rates(table))
+    looped, slopes = timed(grouped_polyfit)
+    if verify and not np.allclose(rates['Rate'].to_numpy(), slopes.to_numpy(), equal_nan=True, atol=1e-12):
+        raise AssertionError("Grouped growth rates differ from np.polyfit")
+    result = {'groups': len(rates), 'growth_rates': vectorized, 'polyfit': looped}
+    print(f"Growth rates of {len(rates)} groups: vectorized {vectorized:.3f} s, polyfit {looped:.3f} s ({looped / vectorized:.1f}x)")
+
+    sites = pd.get_dummies(combined['ID'], prefix='ID', drop_first=True, dtype=np.float64)
+    for degree, with_sites in ((degree, with_sites) for degree in degrees for with_sites in (False, True)):
+        features = Threshold_Analysis.polynomial_features(combined, ('month', 'year', 'Threshold'), degree)
+        if with_sites:
+            features = features.join(sites)
+        cached, subsets = timed(lambda: Threshold_Analysis.best_subset(features, combined['Area']))
+        step, _ = timed(lambda: Threshold_Analysis.stepwise(features, combined['Area']))
+        naive, rss = timed(lambda: _naive_best_subset(features, combined['Area']))
+        if verify and not np.allclose(subsets['RSS'].to_numpy(), rss, rtol=1e-6):
+            raise AssertionError(f"Best subsets differ from per-subset fits with {features.shape[1]} predictors")
+        result[features.shape[1]] = {'degree': degree, 'best_subset': cached, 'stepwise': step, 'lstsq': naive}
+        print(f"Degree {degree}, {features.shape[1]} predictors, {len(combined)} rows: best_subset {cached:.3f} s, "
+              f"stepwise {step:.4f} s, per-subset lstsq {naive:.2f} s ({naive / cached:.1f}x)")
+    return result
+
+def check_datacube(site="s004", name='NDVI'):
+    """
+    Check SiteCube on a real site whose scenes differ in size, against per-scene reductions.
+
+    The mean index of every date is recomputed from each scene read on its own and cut to the
+    cube's common size, and the change between the first and last dates must have that size.
+
+    Returns:
+    - Dictionary with the scene sizes found and the cube's common size.
+    """
+    cube = SiteCube(os.path.join(DATA_DIR, f"Sentinel-{site}"))
+    if not len(cube):
+        raise FileNotFoundError(f"No scenes found for {site} in {DATA_DIR}")
+    means = cube.mean_index(name)
+    band_a, band_b = DEFAULT_INDICES[name]
+    height, width = cube.size()
+    shapes = set()
+    for file, mean in zip(cube.files, means):
+        with rasterio.open(file) as src:
+            a, b = src.read([band_a, band_b], out_dtype=np.float32)
+        shapes.add(a.shape)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            index = (a - b) / (a + b)
+        expected = np.nanmean(index[:height, :width])
+        if not np.isclose(mean, expected, equal_nan=True):
+            raise AssertionError(f"Mean {name} of {os.path.basename(file)} is {mean}, not {expected}")
+    change = cube.change(name)
+    if change.shape != (height, width):
+        raise AssertionError(f"Change has shape {change.shape}, not {(height, width)}")
+    print(f"{site}: {len(cube)} scenes of sizes {sorted(shapes)}, cube size {(height, width)}")
+    return {'shapes': sorted(shapes), 'size': (height, width)}
+
+def _resolve(value):
+    # Client value of a fake Earth Engine object, resolving nested containers
+    if isinstance(value, _FakeObject):
+        return _resolve(value.value)
+    if isinstance(value, dict):
+        return {key: _resolve(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_resolve(item) for item in value]
+    return value
+
+class _FakeObject:
+    # Server-side value of FakeEarthEngine; only getInfo is a round-trip
+    def __init__(self, ee, value):
+        self.ee = ee
+        self.value = value
+
+    def getInfo(self):
+        with self.ee.lock:
+            self.ee.round_trips += 1
+        return _resolve(self.value)
+
+class _FakeDate(_FakeObject):
+    def advance(self, delta, unit):
+        if unit != 'day':
+            raise ValueError(f"Unsupported unit {unit}.")
+        return _FakeDate(self.ee, self.value + datetime.timedelta(days=delta))
+
+class _FakeList(_FakeObject):
+    def map(self, function):
+        return _FakeList(self.ee, [function(item) for item in self.value])
+
+class _FakeGeometry(_FakeObject):
+    def buffer(self, distance):
+        # Square of the buffer's size in degrees, enough to tell sites apart
+        lon, lat = self.value['center']
+        d = distance / 111320
+        ring = [[lon - d, lat - d], [lon + d, lat - d], [lon + d, lat + d], [lon - d, lat + d], [lon - d, lat - d]]
+        return _FakeGeometry(self.ee, {'type': 'Polygon', 'coordinates': [ring], 'center': [lon, lat]})
+
+    def coordinates(self):
+        return _FakeObject(self.ee, self.value['coordinates'])
+
+    def getInfo(self):
+        info = super().getInfo()
+        return {key: item for key, item in info.items() if key != 'center'}
+
+def _milliseconds(date):
+    # system:time_start of a YYYY-MM-DD string or a fake ee.Date
+    if isinstance(date, _FakeDate):
+        date = date.value
+    elif isinstance(date, str):
+        date = datetime.datetime.strptime(date, '%Y-%m-%d')
+    return date.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000
+
+class _FakeCollection(_FakeObject):
+    def filterBounds(self, region):
+        return _FakeCollection(self.ee, [image for image in self.value if image['center'] == region.value['center']])
+
+    def filterDate(self, start, end):
+        low, high = _milliseconds(start), _milliseconds(end)
+        return _FakeCollection(self.ee, [image for image in self.value if low <= image['system:time_start'] < high])
+
+    def filter(self, condition):
+        operator, name, bound = condition
+        if operator != 'lt':
+            raise ValueError(f"Unsupported filter {operator}.")
+        return _FakeCollection(self.ee, [image for image in self.value if image[name] < bound])
+
+    def sort(self, name):
+        return _FakeCollection(self.ee, sorted(self.value, key=lambda image: image[name]))
+
+    def limit(self, count):
+        return _FakeCollection(self.ee, self.value[:count])
+
+    def aggregate_array(self, name):
+        return _FakeList(self.ee, [image[name] for image in self.value])
+
+class _FakeImage(_FakeObject):
+    def select(self, bands):
+        return self
+
+    def toUint16(self):
+        return self
+
+class _FakeTask:
+    # Export task of FakeEarthEngine, RUNNING at its first status call and then done
+    def __init__(self, ee, name):
+        self.ee = ee
+        self.name = name
+        self.polls = 0
+
+    def _consume(self, failures):
+        # Whether this call is one of the failures planned for the task's export
+        with self.ee.lock:
+            if failures.get(self.name, 0) > 0:
+                failures[self.name] -= 1
+                return True
+            return False
+
+    def start(self):
+        if self._consume(self.ee.start_failures):
+            raise RuntimeError(f"Could not start {self.name}")
+        with self.ee.lock:
+            self.ee.started.append(self.name)
+
+    def status(self):
+        if self.name in self.ee.status_failures:
+            raise RuntimeError(f"Status of {self.name} unavailable")
+        self.polls += 1
+        if self.polls == 1:
+            return {'state': 'RUNNING'}
+        return {'state': 'FAILED' if self._consume(self.ee.task_failures) else 'COMPLETED'}
+
+class FakeEarthEngine:
+    """
+    Offline stand-in for the ee module covering what ExportOrchestrator plans, submits and
+    polls with.
+
+    Server objects are evaluated eagerly in Python, and every getInfo is counted as a
+    round-trip in round_trips. The collection holds one image every revisit_days days at every
+    site, with a reproducible random CLOUDY_PIXEL_PERCENTAGE. Export tasks run for one polling
+    round and then complete, unless a failure is planned for them. Exports are named by their
+    'folder/description'.
+
+    Parameters:
+    - sites: Site dictionaries with Latitude and Longitude.
+    - years: Years to generate images for, June to September.
+    - revisit_days: Days between images of a site.
+    - seed: Random seed of the cloud cover.
+    - start_failures: Optional {export: n}; the first n starts of the export raise.
+    - task_failures: Optional {export: n}; the first n tasks of the export end FAILED.
+    - status_failures: Optional exports whose status calls always raise.
+    """
+    def __init__(self, sites, years, revisit_days=2, seed=0, start_failures=None, task_failures=None, status_failures=()):
+        rng = np.random.default_rng(seed)
+        self.images = []
+        for site in sites:
+            for year in years:
+                date = datetime.datetime(year, 6, 1, 19, 30)
+                while date < datetime.datetime(year, 10, 1):
+                    self.images.append({
+                        'system:time_start': _milliseconds(date),
+                        'CLOUDY_PIXEL_PERCENTAGE': float(rng.uniform(0, 30)),
+                        'system:index': f"{date:%Y%m%dT%H%M%S}_{site['ID']}",
+                        'center': [site['Longitude'], site['Latitude']],
+                    })
+                    date += datetime.timedelta(days=revisit_days)
+        self.round_trips = 0
+        self.lock = threading.Lock()
+        self.Filter = SimpleNamespace(lt=lambda name, bound: ('lt', name, bound))
+        self.Geometry = SimpleNamespace(Point=lambda coordinates: _FakeGeometry(self, {'center': list(coordinates)}))
+        self.start_failures = dict(start_failures or {})
+        self.task_failures = dict(task_failures or {})
+        self.status_failures = set(status_failures)
+        self.started = []
+        export = lambda image, description, folder, **options: _FakeTask(self, f"{folder}/{description}")
+        self.batch = SimpleNamespace(Export=SimpleNamespace(image=SimpleNamespace(toDrive=export)))
+
+    def Image(self, image_id):
+        return _FakeImage(self, image_id)
+
+    def ImageCollection(self, name):
+        if name != COLLECTION:
+            raise ValueError(f"Unknown collection {name}.")
+        return _FakeCollection(self, self.images)
+
+    def Dictionary(self, value):
+        return _FakeObject(self, value)
+
+    def List(self, value):
+        return _FakeList(self, value)
+
+    def Date(self, value):
+        return _FakeDate(self, datetime.datetime.strptime(value, '%Y-%m-%d'))
+
+def benchmark_export_planning(sites=8, years=(2020, 2021), verify=True, seed=0):
+    """
+    Count the getInfo round-trips of ExportOrchestrator.plan and plan_batched on FakeEarthEngine.
+
+    plan makes one round-trip per site for its region and one per site-year for the collection
+    metadata; plan_batched resolves everything in one.
+
+    Parameters:
+    - sites: Number of synthetic sites.
+    - years: Seasons to plan.
+    - verify: Whether to check that both plans give identical jobs and that plan_batched makes
+      a single round-trip.
+    - seed: Random seed of the cloud cover.
+
+    Returns:
+    - Dictionary with the job count and the round-trips of each plan.
+    """
+    sites = [{'ID': f"s{i:03d}", 'Latitude': 68 + i / 10, 'Longitude': -131 - i / 10} for i in range(1, sites + 1)]
+    plans, result = {}, {}
+    for method in ('plan', 'plan_batched'):
+        ee = FakeEarthEngine(sites, years, seed=seed)
+        orchestrator = ExportOrchestrator(ee_module=ee, sleep=lambda seconds: None)
+        plans[method] = getattr(orchestrator, method)(sites, list(years))
+        result[method] = ee.round_trips
+    result['jobs'] = len(plans['plan_batched'])
+
+    if verify:
+        key = lambda job: (job['site'], job['date'])
+        if sorted(plans['plan'], key=key) != sorted(plans['plan_batched'], key=key):
+            raise AssertionError("plan_batched jobs differ from plan")
+        if result['plan_batched'] != 1:
+            raise AssertionError(f"plan_batched made {result['plan_batched']} round-trips instead of 1")
+        if result['plan'] != len(sites) * (len(years) + 1):
+            raise AssertionError(f"plan made {result['plan']} round-trips instead of {len(sites) * (len(years) + 1)}")
+    print(f"{len(sites)} sites x {len(years)} years, {result['jobs']} jobs: plan {result['plan']} getInfo round-trips, "
+          f"plan_batched {result['plan_batched']}")
+    return result
+
+class _FakeClock:
+    # Clock advanced only by sleep, so polling runs instantly and its waits can be measured
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def _run_exports(sites, years, retries, backoff, interval, **failures):
+    # Submit and poll every planned export on a FakeEarthEngine with the given failures
+    clock = _FakeClock()
+    ee = FakeEarthEngine(sites, years, **failures)
+    orchestrator = ExportOrchestrator(ee_module=ee, retries=retries, backoff=backoff, sleep=clock.sleep, clock=clock)
+    jobs = orchestrator.plan_batched(sites, list(years))
+    with contextlib.redirect_stdout(io.StringIO()):
+        orchestrator.submit(jobs)
+        summary = orchestrator.poll(jobs, interval=interval)
+    return {f"{job['folder']}/{job['description']}": job for job in jobs}, summary, clock.now
+
+def check_export_tasks(sites=4, years=(2021,), failures=5, interval=30, backoff=600, retries=2):
+    """
+    Submit and poll the planned exports on FakeEarthEngine with failing starts, tasks and status
+    calls, on a fake clock.
+
+    In a first run one export never starts, one starts only on its second attempt, one task
+    fails once and one export's status can never be read; every other export must complete. In
+    a second run failures tasks fail once at the same time, and must all be resubmitted after
+    one backoff in total rather than one per failure.
+
+    Returns:
+    - Dictionary with the final state counts and simulated seconds of the second run.
+    """
+    sites = [{'ID': f"s{i:03d}", 'Latitude': 68 + i / 10, 'Longitude': -131 - i / 10} for i in range(1, sites + 1)]
+    planner = ExportOrchestrator(ee_module=FakeEarthEngine(sites, years), sleep=lambda seconds: None)
+    names = [f"{job['folder']}/{job['description']}" for job in planner.plan_batched(sites, list(years))]
+    if len(names) < max(failures, 4):
+        raise ValueError(f"Only {len(names)} exports planned; plan more sites or years.")
+
+    # Every attempt calls start up to retries + 1 times before giving up
+    never, late, failing, unknown = names[:4]
+    jobs, _, _ = _run_exports(sites, years, retries, backoff, interval,
+                              start_failures={never: 10 ** 6, late: retries + 1},
+                              task_failures={failing: 1}, status_failures=[unknown])
+    expected = {never: ('FAILED', retries + 1), late: ('COMPLETED', 2), failing: ('COMPLETED', 2),
+                unknown: ('UNKNOWN', 1)}
+    for name, job in jobs.items():
+        state, attempts = expected.get(name, ('COMPLETED', 1))
+        if (job['state'], job['attempts']) != (state, attempts):
+            raise AssertionError(f"{name} ended {job['state']} after {job['attempts']} attempts, not {state} after {attempts}")
+    if jobs[never]['error'] is None or jobs[unknown]['error'] is None:
+        raise AssertionError("Failed jobs carry no error")
+
+    jobs, summary, seconds = _run_exports(sites, years, retries, backoff, interval,
+                                          task_failures={name: 1 for name in names[:failures]})
+    if summary != {'COMPLETED': len(names)}:
+        raise AssertionError(f"Not every export completed after one task failure: {summary}")
+    if seconds >= 2 * backoff:
+        raise AssertionError(f"Polling took {seconds} simulated seconds; backoffs were not concurrent")
+    print(f"{len(names)} exports, {failures} failing once: {summary} in {seconds:.0f} simulated seconds")
+    return {'summary': summary, 'seconds': seconds}
+
+def synthetic_scenes(folder, scenes=10, height=512, width=512, seed=0, start="2021-06-01", step_days=7):
+    """
+    Write a synthetic stack of 5-band uint16 GeoTIFFs shaped like the Sentinel-2 exports.
+
+    Every scene is vegetation with a bare, low-NDVI disturbance at its center that grows from
+    date to date, and a water strip along its left edge, with reproducible noise. Files are
+    named Sentinel2_YYYY-MM-DD.tif on a 10 m UTM grid.
+
+    Parameters:
+    - folder: Folder to write the scenes to.
+    - scenes: Number of dates.
+    - height, width: Scene size in pixels.
+    - seed: Random seed of the noise.
+    - start: Date of the first scene; later scenes follow every step_days days.
+
+    Returns:
+    - List of written paths, and the (row, column) center of the disturbance.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    rows, cols = np.mgrid[0:height, 0:width]
+    center = (height // 2, width // 2)
+    distance = np.hypot(rows - center[0], cols - center[1])
+    water = cols < max(width // 20, 1)
+
+    # Red, green, blue, NIR, SWIR reflectances (x 10000) of each surface
+    vegetation = np.array([400, 700, 450, 3200, 1800])
+    bare = np.array([1500, 1400, 1200, 1900, 2600])
+    open_water = np.array([300, 500, 600, 200, 100])
+
+    profile = {'driver': 'GTiff', 'dtype': 'uint16', 'count': 5, 'height': height, 'width': width,
+               'crs': 'EPSG:32608', 'transform': from_origin(500000, 7600000, 10, 10)}
+    first = datetime.date.fromisoformat(start)
+    paths = []
+    for scene in range(scenes):
+        radius = min(height, width) * (0.08 + 0.12 * scene / max(scenes - 1, 1))
+        disturbed = distance < radius
+        surface = np.where(disturbed[..., np.newaxis], bare, vegetation)
+        surface[water] = open_water
+        bands = surface.transpose(2, 0, 1) * rng.normal(1, 0.05, (5, height, width))
+        date = first + datetime.timedelta(days=step_days * scene)
+        path = os.path.join(folder, f"Sentinel2_{date.isoformat()}.tif")
+        with rasterio.open(path, 'w', **profile) as dst:
+            dst.write(np.clip(bands, 0, 65535).astype(np.uint16))
+        paths.append(path)
+    return paths, center
+
+def _per_call(stages):
+    # Seconds per call of every stage
+    return {name: stage['seconds'] / stage['calls'] for name, stage in stages.items() if stage['calls']}
+
+def compare_reports(baseline, current, tolerance=0.25, min_seconds=0.05):
+    """
+    List the throughput and memory regressions of a benchmark report against a baseline.
+
+    Parameters:
+    - baseline, current: Reports of benchmark_pipeline, or paths of their JSON files.
+    - tolerance: Relative increase of a stage's seconds per call, or of the traced peak memory
+      of reports run with trace_memory, that counts as a regression.
+    - min_seconds: Stages that took less time in total in the baseline are too noisy to compare.
+
+    Returns:
+    - List of (metric, baseline value, current value) that regressed.
+    """
+    reports = []
+    for report in (baseline, current):
+        if isinstance(report, str):
+            with open(report) as f:
+                report = json.load(f)
+        reports.append(report)
+    baseline, current = reports
+
+    regressions = []
+    before, after = _per_call(baseline['stages']), _per_call(current['stages'])
+    for name in sorted(before.keys() & after.keys()):
+        if baseline['stages'][name]['seconds'] < min_seconds:
+            continue
+        if after[name] > before[name] * (1 + tolerance):
+            regressions.append((f"{name} seconds per call", before[name], after[name]))
+    # peak_rss_bytes is the high-water mark of the whole process, including anything run before
+    # the benchmark, so only the traced peak of the profiled run is compared
+    key = 'peak_traced_bytes'
+    if baseline.get(key) and current.get(key) and current[key] > baseline[key] * (1 + tolerance):
+        regressions.append((key, baseline[key], current[key]))
+    return regressions
+
+def benchmark_pipeline(scenes=10, size=(512, 512), workers=1, crop_size=(128, 128), thresholds=(0.3, 0.5, 0.7),
+                       trace_memory=False, report_path=None, baseline=None, tolerance=0.25, seed=0):
+    """
+    Run product processing and the threshold sweep on a synthetic stack under a Profiler.
+
+    The stack is written by synthetic_scenes to a temporary folder, so the run is reproducible
+    offline and needs no site data.
+
+    Parameters:
+    - scenes, size, seed: Stack to build; see synthetic_scenes.
+    - workers: Worker processes of process_folder.
+    - crop_size: Center crop segmented by sweep_mask, or None for whole scenes.
+    - thresholds: NDVI thresholds of the sweep.
+    - trace_memory: Whether to trace per-stage peak memory; slows the run.
+    - report_path: Optional path to save the JSON report to.
+    - baseline: Optional earlier report or its path to check for regressions.
+    - tolerance: Relative slowdown or memory growth reported as a regression.
+
+    Returns:
+    - The report, with scene throughput and any regressions added.
+    """
+    height, width = size
+    meta = {'scenes': scenes, 'height': height, 'width': width, 'workers': workers,
+            'crop_size': crop_size, 'thresholds': list(thresholds), 'seed': seed}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        folder = os.path.join(temp_dir, "Sentinel-synthetic")
+        files, center = synthetic_scenes(folder, scenes, height, width, seed)
+        if crop_size is not None:
+            # Seeds are given in the cropped frame
+            center = (crop_size[0] // 2, crop_size[1] // 2)
+
+        with Profiler("synthetic", trace_memory=trace_memory, meta=meta) as profiler:
+            with contextlib.redirect_stdout(io.StringIO()):
+                errors = process_folder(folder, workers=workers, store='float32')
+                sweep_mask(folder, center, (0, 0), thresholds=thresholds, crop_size=crop_size)
+        if errors:
+            raise RuntimeError(f"Processing failed: {errors}")
+
+    report = profiler.report()
+    report['scenes_per_second'] = scenes / profiler.seconds
+    read = profiler.stages.get('read', {}).get('bytes_read', 0)
+    report['read_MB_per_second'] = read / 1e6 / profiler.stages['read']['seconds'] if read else None
+    if baseline is not None:
+        report['regressions'] = compare_reports(baseline, report, tolerance)
+    if report_path is not None:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    print(profiler.summary())
+    print(f"{scenes} scenes of {height}x{width}: {report['scenes_per_second']:.2f} scenes/s")
+    for metric, before, after in report.get('regressions', []):
+        print(f"Regression in {metric}: {before:.4g} -> {after:.4g}")
+    return report
+
+if __name__ == "__main__":
+    benchmark_products()
+    benchmark_region_growing()
+    benchmark_analysis()
+    benchmark_export_planning()
+    check_export_tasks()
+    check_datacube()
+    benchmark_pipeline(report_path=os.path.join(OUTPUT_DIR, "Benchmark_Pipeline.json"))
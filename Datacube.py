@@ -0,0 +1,155 @@
+import os
+import re
+import glob
+import datetime
+import numpy as np
+import rasterio
+
+from Process_TIFF import BAND_ORDER
+from Product_Store import DEFAULT_INDICES
+
+# Acquisition date in file names such as Sentinel2_2021-07-21.tif or RGB_2021-07-21.jpg
+DATE_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2})')
+
+def parse_date(file_path):
+    """
+    Return the acquisition date in a file name as a datetime.date.
+    """
+    match = DATE_PATTERN.search(os.path.basename(file_path))
+    if match is None:
+        raise ValueError(f"No YYYY-MM-DD date in file name {file_path}")
+    return datetime.date.fromisoformat(match.group(1))
+
+def _to_date(value):
+    # Accept dates, datetimes and ISO strings for date-range selection
+    if value is None or isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return datetime.date.fromisoformat(str(value))
+
+def _band_number(band):
+    # Bands can be given as 1-based numbers or by name, e.g. 'nir'
+    return BAND_ORDER[band] if isinstance(band, str) else int(band)
+
+class SiteCube:
+    """
+    Lazy (time, band, y, x) datacube of a site folder of Sentinel2_YYYY-MM-DD.tif scenes.
+
+    The folder is indexed once by file name; rasters are only read when data is requested,
+    each band of each scene at most once, and kept for later requests. Date-range
+    selections share the cache of the cube they were selected from.
+
+    Parameters:
+    - folder: Site folder, e.g. Data/Sentinel-s003.
+    - pattern: Glob pattern of the scene files.
+    """
+    def __init__(self, folder, pattern="Sentinel2_*.tif", _files=None, _cache=None):
+        self.folder = folder
+        if _files is None:
+            _files = glob.glob(os.path.join(folder, pattern))
+            _files = sorted(_files, key=parse_date)
+        self.files = list(_files)
+        self.dates = [parse_date(f) for f in self.files]
+        self._cache = {} if _cache is None else _cache
+
+    def __len__(self):
+        return len(self.files)
+
+    def __repr__(self):
+        if not self.files:
+            return f"SiteCube({self.folder!r}, empty)"
+        return f"SiteCube({self.folder!r}, {len(self)} scenes, {self.dates[0]} to {self.dates[-1]})"
+
+    def sel(self, start=None, end=None):
+        """
+        Return the cube restricted to dates between start and end, both inclusive.
+        """
+        start, end = _to_date(start), _to_date(end)
+        files = [f for f, d in zip(self.files, self.dates)
+                 if (start is None or d >= start) and (end is None or d <= end)]
+        return SiteCube(self.folder, _files=files, _cache=self._cache)
+
+    def load(self, bands=None):
+        """
+        Return the selected bands of every scene as a float32 (time, band, y, x) array.
+
+        Scenes of a site can differ by a row or column at the edge of the area of interest, so
+        all are cut to their common size from the top-left corner, as in Auto_Seed.ndvi_stack.
+        For scenes one pixel apart this is the window Region_Growing.crop_center keeps.
+
+        Parameters:
+        - bands: Band numbers or names (see Process_TIFF.BAND_ORDER). Defaults to every band.
+        """
+        if not self.files:
+            raise ValueError("The cube has no scenes.")
+        if bands is None:
+            bands = sorted(BAND_ORDER.values())
+        bands = [_band_number(b) for b in bands]
+
+        # Read the bands not seen before, one call per scene
+        for file in self.files:
+            scene = self._cache.setdefault(file, {})
+            missing = [b for b in bands if b not in scene]
+            if missing:
+                with rasterio.open(file) as src:
+                    data = src.read(missing)
+                for b, values in zip(missing, data):
+                    scene[b] = values
+
+        shapes = [self._cache[file][bands[0]].shape for file in self.files]
+        height = min(shape[0] for shape in shapes)
+        width = min(shape[1] for shape in shapes)
+        cube = np.empty((len(self.files), len(bands), height, width), dtype=np.float32)
+        for t, file in enumerate(self.files):
+            for i, b in enumerate(bands):
+                cube[t, i] = self._cache[file][b][:height, :width]
+        return cube
+
+    def index(self, name='NDVI', bands=None):
+        """
+        Return a normalized difference for every scene as a float32 (time, y, x) array.
+
+        Parameters:
+        - name: Name of an index in Product_Store.DEFAULT_INDICES, used when bands is None.
+        - bands: Optional (bandA, bandB) pair computing (A - B) / (A + B).
+
+        Pixels where both bands are zero are NaN, so nan-aware reductions skip them.
+        """
+        band_a, band_b = DEFAULT_INDICES[name] if bands is None else bands
+        pair = self.load([band_a, band_b])
+        a, b = pair[:, 0], pair[:, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (a - b) / (a + b)
+
+    def mean_index(self, name='NDVI', bands=None):
+        """
+        Return the mean of an index per date, aligned with self.dates.
+        """
+        return np.nanmean(self.index(name, bands).reshape(len(self), -1), axis=1)
+
+    def change(self, name='NDVI', bands=None):
+        """
+        Return the change of an index between the earliest and latest dates of the cube.
+        """
+        if len(self) < 2:
+            raise ValueError("At least two scenes are needed to compute a change.")
+        first_and_last = SiteCube(self.folder, _files=[self.files[0], self.files[-1]], _cache=self._cache)
+        values = first_and_last.index(name, bands)
+        # Cut to the size of the whole cube, so the change lines up with its other arrays
+        height, width = self.size()
+        return values[1, :height, :width] - values[0, :height, :width]
+
+    def size(self):
+        """
+        Return the (height, width) common to every scene, to which load cuts them.
+        """
+        sizes = []
+        for file in self.files:
+            scene = self._cache.get(file)
+            if scene:
+                sizes.append(next(iter(scene.values())).shape)
+            else:
+                with rasterio.open(file) as src:
+                    sizes.append((src.height, src.width))
+        return min(size[0] for size in sizes), min(size[1] for size in sizes)
@@ -0,0 +1,197 @@
+import os
+import sys
+import json
+import time
+import datetime
+import platform
+import contextlib
+import tracemalloc
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then not reported
+    resource = None
+
+# Profiler that stage() and count() report to, set while a Profiler is entered
+_active = None
+
+def _empty_stage():
+    return {'calls': 0, 'seconds': 0.0, 'bytes_read': 0, 'bytes_written': 0, 'items': 0, 'peak_bytes': 0}
+
+def _peak_rss(who):
+    # Peak resident set size in bytes; ru_maxrss is in kilobytes on Linux and bytes on macOS
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class Profiler:
+    """
+    Stage timings and counters of one pipeline run.
+
+    While a profiler is entered, the pipeline's instrumented sections report to it: 'read' and
+    'hash' of GeoTIFFs, 'index' computation, 'encode' and 'write' of products, 'segmentation'
+    and 'mask update'. Each stage records its calls, seconds, bytes read and written and items;
+    with trace_memory, also the peak traced memory reached inside it. tracemalloc tracks
+    NumPy buffers but slows allocation-heavy code, so it is off by default, and the process
+    peak RSS is always reported instead.
+
+    Parameters:
+    - name: Run name stored in the report.
+    - trace_memory: Whether to trace per-stage peak memory with tracemalloc.
+    - meta: Optional dictionary of run parameters stored in the report.
+
+    Example:
+        with Profiler("s003") as profiler:
+            process_folder("Data/Sentinel-s003")
+        profiler.save("Output/profile_s003.json")
+    """
+    def __init__(self, name="run", trace_memory=False, meta=None):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.meta = dict(meta or {})
+        self.stages = {}
+        self.started = None
+        self.seconds = 0.0
+        self.peak_traced = 0
+        self._peaks = []
+        self._previous = None
+        self._start = None
+        self._started_tracing = False
+
+    def __enter__(self):
+        global _active
+        self._previous, _active = _active, self
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        self.seconds += time.perf_counter() - self._start
+        if tracemalloc.is_tracing():
+            self.peak_traced = max(self.peak_traced, tracemalloc.get_traced_memory()[1])
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+        _active = self._previous
+
+    def count(self, name, bytes_read=0, bytes_written=0, items=0):
+        """
+        Add to the counters of a stage without timing anything.
+        """
+        stage = self.stages.setdefault(name, _empty_stage())
+        stage['bytes_read'] += int(bytes_read)
+        stage['bytes_written'] += int(bytes_written)
+        stage['items'] += int(items)
+
+    @contextlib.contextmanager
+    def stage(self, name, bytes_read=0, bytes_written=0, items=0):
+        """
+        Time a section as one call of a stage, adding the given counters.
+        """
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            # Fold the peak so far into the enclosing stage before resetting it for this one
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self._peaks.append(0)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - start
+            stage = self.stages.setdefault(name, _empty_stage())
+            stage['calls'] += 1
+            stage['seconds'] += elapsed
+            self.count(name, bytes_read, bytes_written, items)
+            if tracing:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                stage['peak_bytes'] = max(stage['peak_bytes'], peak)
+                self.peak_traced = max(self.peak_traced, peak)
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+                tracemalloc.reset_peak()
+
+    def merge(self, stages):
+        """
+        Add the stages of another run, e.g. of a worker process, to this one.
+        """
+        for name, other in stages.items():
+            stage = self.stages.setdefault(name, _empty_stage())
+            for key in ('calls', 'seconds', 'bytes_read', 'bytes_written', 'items'):
+                stage[key] += other[key]
+            stage['peak_bytes'] = max(stage['peak_bytes'], other['peak_bytes'])
+            self.peak_traced = max(self.peak_traced, other['peak_bytes'])
+
+    def report(self):
+        """
+        Return the run as a JSON-serializable dictionary.
+        """
+        return {
+            'name': self.name,
+            'started': self.started,
+            'seconds': self.seconds,
+            'meta': self.meta,
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'peak_rss_bytes': _peak_rss(resource.RUSAGE_SELF) if resource else None,
+            'peak_rss_children_bytes': _peak_rss(resource.RUSAGE_CHILDREN) if resource else None,
+            'peak_traced_bytes': self.peak_traced if self.trace_memory else None,
+            'stages': {name: dict(stage) for name, stage in self.stages.items()},
+        }
+
+    def save(self, path):
+        """
+        Write the report as JSON.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+        return path
+
+    def summary(self):
+        """
+        Return a table of the stages as text, slowest first.
+        """
+        lines = [f"{self.name}: {self.seconds:.2f} s"]
+        for name, stage in sorted(self.stages.items(), key=lambda item: -item[1]['seconds']):
+            line = f"  {name:<14}{stage['calls']:>7} calls {stage['seconds']:>9.3f} s"
+            if stage['bytes_read']:
+                line += f"  read {stage['bytes_read'] / 1e6:.1f} MB"
+            if stage['bytes_written']:
+                line += f"  written {stage['bytes_written'] / 1e6:.1f} MB"
+            if stage['peak_bytes']:
+                line += f"  peak {stage['peak_bytes'] / 1e6:.1f} MB"
+            lines.append(line)
+        return "\n".join(lines)
+
+def active():
+    """
+    Return the profiler currently entered, or None.
+    """
+    return _active
+
+def stage(name, bytes_read=0, bytes_written=0, items=0):
+    """
+    Time a section as a stage of the active profiler, or do nothing when none is entered.
+    """
+    if _active is None:
+        return contextlib.nullcontext()
+    return _active.stage(name, bytes_read, bytes_written, items)
+
+def count(name, bytes_read=0, bytes_written=0, items=0):
+    """
+    Add to the counters of a stage of the active profiler, if any.
+    """
+    if _active is not None:
+        _active.count(name, bytes_read, bytes_written, items)
@@ -7,6 +7,34 @@ function select_bands(file::String, bandA::Int, bandB::Int, bandC::Union{Nothing
     py"select_bands"(file,bandA,bandB,bandC,output)
 end
 
+# Persistent Python band service, imported once per Julia session
+const band_service_py = PyNULL()
+
+function band_service()
+    if ispynull(band_service_py)
+        pushfirst!(PyVector(pyimport("sys")."path"), @__DIR__)
+        copy!(band_service_py, pyimport("Select_Bands").BandService())
+    end
+    return band_service_py
+end
+
+# Function for band selection returned as an image array, skipping the temporary JPEG
+# With lossless=true, two-band indices are Float32 values from the product store instead of 8-bit
+function select_bands(file::String, bandA::Int, bandB::Int, bandC::Union{Nothing, Int}; lossless::Bool=false)
+    # PyArray wraps the NumPy buffer without copying
+    values = PyArray(pycall(band_service().select, PyObject, file, bandA, bandB, bandC, lossless))
+    if bandC == nothing && lossless
+        return colorview(Gray, values)
+    end
+
+    pixels = reinterpret(N0f8, values)
+    if bandC == nothing
+        return colorview(Gray, pixels)
+    else
+        return colorview(RGB, PermutedDimsArray(pixels, (3, 1, 2)))
+    end
+end
+
 # Function for cropping image for dimensional consistency
 function crop_center(img::AbstractArray, crop_size::Tuple{Int, Int})
     img_height, img_width = size(img)
@@ -53,78 +81,102 @@ function display_segments(segments, file_path::String)
     display(plot)
 end
 
+# Function to build the seed list from two to four seeds
+function build_seeds(Seed1::Tuple{Int64,Int64}, Seed2::Tuple{Int64,Int64}, Seed3::Union{Nothing, Tuple{Int64,Int64}}, Seed4::Union{Nothing, Tuple{Int64,Int64}})
+    if Seed3 == nothing && Seed4 == nothing
+        seeds = [(CartesianIndex(Seed1),1), (CartesianIndex(Seed2),2)]
+    elseif Seed3 != nothing && Seed4 == nothing
+        seeds = [(CartesianIndex(Seed1),1), (CartesianIndex(Seed2),2), (CartesianIndex(Seed3),3)]
+    else
+        seeds = [(CartesianIndex(Seed1),1), (CartesianIndex(Seed2),2), (CartesianIndex(Seed3),3), (CartesianIndex(Seed4),4)]
+    end
+    return seeds
+end
+
 # Function to get pixel count of segmented area
-function count_pixels(file_path::String, Seed1::Tuple{Int64,Int64}, Seed2::Tuple{Int64,Int64}; Seed3::Union{Nothing, Tuple{Int64,Int64}} = nothing, Seed4::Union{Nothing, Tuple{Int64,Int64}} = nothing, Display::Bool = false, crop_size::Union{Nothing, Tuple{Int, Int}}=nothing, mods::Union{Nothing, Vector{Tuple{Real, Real, Vararg{Float64}}}}=nothing, water_mask::Union{Nothing, BitMatrix}=nothing, ndvi_threshold::Union{Nothing, Float64}=nothing)
+function count_pixels(file_path::String, Seed1::Tuple{Int64,Int64}, Seed2::Tuple{Int64,Int64}; kwargs...)
     if endswith(file_path, ".jpg")
-        img = load(file_path)
-        if crop_size != nothing
-            img = crop_center(img, crop_size)
-        end
+        return count_pixels(load(file_path), Seed1, Seed2; name=file_path, kwargs...)
+    else
+        println("File is not a .jpg: $file_path")
+        return nothing
+    end
+end
 
-        if mods != nothing
-            img = draw_line(img, mods)
-        end
+# Result of one seeded segmentation: pixel count, label map and mask of the region grown from Seed1
+struct SegmentationResult
+    count::Int
+    labels::Matrix{Int}
+    mask::BitMatrix
+    segments
+end
 
-        if water_mask != nothing
-            img = img .* water_mask
-        end
+# Function to segment an image once, returning the pixel count, label map and mask together
+function segment_image(img::AbstractArray, Seed1::Tuple{Int64,Int64}, Seed2::Tuple{Int64,Int64}; Seed3::Union{Nothing, Tuple{Int64,Int64}} = nothing, Seed4::Union{Nothing, Tuple{Int64,Int64}} = nothing, crop_size::Union{Nothing, Tuple{Int, Int}}=nothing, mods::Union{Nothing, Vector{Tuple{Real, Real, Vararg{Float64}}}}=nothing, water_mask::Union{Nothing, BitMatrix}=nothing, ndvi_threshold::Union{Nothing, Float64}=nothing)
+    if crop_size != nothing
+        img = crop_center(img, crop_size)
+    end
 
-        if ndvi_threshold != nothing
-            img = img .< ndvi_threshold
-        end
-        
-        if Seed3 == nothing && Seed4 == nothing
-            seeds = [(CartesianIndex(Seed1),1), (CartesianIndex(Seed2),2)]
-        elseif Seed3 != nothing && Seed4 == nothing
-            seeds = [(CartesianIndex(Seed1),1), (CartesianIndex(Seed2),2), (CartesianIndex(Seed3),3)]
-        else
-            seeds = [(CartesianIndex(Seed1),1), (CartesianIndex(Seed2),2), (CartesianIndex(Seed3),3), (CartesianIndex(Seed4),4)]
-        end
-        
-        segments = seeded_region_growing(img, seeds)    
-        pixel_dict = segment_pixel_count(segments)
-        pixel_count = pixel_dict[:1]
-        
-        if Display
-            display_segments(segments,file_path)
-        end
+    if mods != nothing
+        img = draw_line(img, mods)
+    end
 
-        println("The segemented region contains $pixel_count pixels.")
-        return pixel_count
-    else
-        println("File is not a .jpg: $file_path")
-        return nothing
+    if water_mask != nothing
+        img = img .* water_mask
+    end
+
+    if ndvi_threshold != nothing
+        img = img .< ndvi_threshold
+    end
+
+    seeds = build_seeds(Seed1, Seed2, Seed3, Seed4)
+
+    segments = seeded_region_growing(img, seeds)
+    labels = labels_map(segments)
+    pixel_count = get(segment_pixel_count(segments), 1, 0)
+
+    return SegmentationResult(pixel_count, labels, labels .== 1, segments)
+end
+
+# Function to get pixel count of segmented area from an image array
+function count_pixels(img::AbstractArray, Seed1::Tuple{Int64,Int64}, Seed2::Tuple{Int64,Int64}; Seed3::Union{Nothing, Tuple{Int64,Int64}} = nothing, Seed4::Union{Nothing, Tuple{Int64,Int64}} = nothing, Display::Bool = false, crop_size::Union{Nothing, Tuple{Int, Int}}=nothing, mods::Union{Nothing, Vector{Tuple{Real, Real, Vararg{Float64}}}}=nothing, water_mask::Union{Nothing, BitMatrix}=nothing, ndvi_threshold::Union{Nothing, Float64}=nothing, name::String="")
+    result = segment_image(img, Seed1, Seed2, Seed3=Seed3, Seed4=Seed4, crop_size=crop_size, mods=mods, water_mask=water_mask, ndvi_threshold=ndvi_threshold)
+    pixel_count = result.count
+
+    if Display
+        display_segments(result.segments, name)
     end
+
+    println("The segemented region contains $pixel_count pixels.")
+    return pixel_count
 end
 
 # Function for returning segmented object
-function segmented_object(file_path::String, Seed1::Tuple{Int64,Int64}, Seed2::Tuple{Int64,Int64}; Seed3::Union{Nothing, Tuple{Int64,Int64}} = nothing, Seed4::Union{Nothing, Tuple{Int64,Int64}} = nothing, crop_size::Union{Nothing, Tuple{Int, Int}}=nothing, mods::Union{Nothing, Vector{Tuple{Real, Real, Vararg{Float64}}}}=nothing, water_mask::Union{Nothing, BitMatrix}=nothing)
+function segmented_object(file_path::String, Seed1::Tuple{Int64,Int64}, Seed2::Tuple{Int64,Int64}; kwargs...)
     if endswith(file_path, ".jpg")
-        img = load(file_path)
-        if crop_size != nothing
-            img = crop_center(img, crop_size)
-        end
+        return segmented_object(load(file_path), Seed1, Seed2; kwargs...)
+    end
+end
 
-        if mods != nothing
-            img = draw_line(img, mods)
-        end
+# Function for returning segmented object from an image array
+function segmented_object(img::AbstractArray, Seed1::Tuple{Int64,Int64}, Seed2::Tuple{Int64,Int64}; Seed3::Union{Nothing, Tuple{Int64,Int64}} = nothing, Seed4::Union{Nothing, Tuple{Int64,Int64}} = nothing, crop_size::Union{Nothing, Tuple{Int, Int}}=nothing, mods::Union{Nothing, Vector{Tuple{Real, Real, Vararg{Float64}}}}=nothing, water_mask::Union{Nothing, BitMatrix}=nothing)
+    if crop_size != nothing
+        img = crop_center(img, crop_size)
+    end
 
-        if water_mask != nothing
-            img .* water_mask
-        end
-        
-        if Seed3 == nothing && Seed4 == nothing
-            seeds = [(CartesianIndex(Seed1),1), (CartesianIndex(Seed2),2)]
-        elseif Seed3 != nothing && Seed4 == nothing
-            seeds = [(CartesianIndex(Seed1),1), (CartesianIndex(Seed2),2), (CartesianIndex(Seed3),3)]
-        else
-            seeds = [(CartesianIndex(Seed1),1), (CartesianIndex(Seed2),2), (CartesianIndex(Seed3),3), (CartesianIndex(Seed4),4)]
-        end
-        
-        segments = seeded_region_growing(img, seeds)    
-        
-        return segments
+    if mods != nothing
+        img = draw_line(img, mods)
+    end
+
+    if water_mask != nothing
+        img .* water_mask
     end
+
+    seeds = build_seeds(Seed1, Seed2, Seed3, Seed4)
+
+    segments = seeded_region_growing(img, seeds)
+
+    return segments
 end
 
 function segment_mask(folder::String, Seed1::Tuple{Int64,Int64}, Seed2::Tuple{Int64,Int64}; Seed3::Union{Nothing, Tuple{Int64,Int64}} = nothing, Seed4::Union{Nothing, Tuple{Int64,Int64}} = nothing, Display::Bool = false, ndvi_threshold::Float64 = 1.0, ndwi_threshold::Float64 = 0.65, ndwi_image::Union{Nothing, String}=nothing, crop_size::Union{Nothing, Tuple{Int, Int}}=nothing, mods::Union{Nothing, Vector{Tuple{Real, Real, Vararg{Float64}}}}=nothing)
@@ -151,22 +203,19 @@ function segment_mask(folder::String, Seed1::Tuple{Int64,Int64}, Seed2::Tuple{In
 
     file_count = length(sorted)
 
-    # Initialize result storage
-    results = DataFrame()
+    # Initialize result storage; columns are filled in place and framed once at the end
+    dates = Date[]
+    pixels = Int[]
     mask = nothing
-    outlines = heatmap(framestyle=:none)
-    masks = 0
-
-    # Create a temporary directory
-    temp_dir = mktempdir()
+    # Heatmap counts are accumulated in place and drawn once after the loop
+    masks = nothing
 
     # NDWI Water Mask
     if ndwi_image != nothing
         selected_image = filter(s -> occursin(ndwi_image, s), files)
         if length(selected_image) == 1
             selected_image = first(selected_image) # Convert from :Vector{String} to ::String
-            ndwi_path = select_bands(selected_image, 5,4,nothing, joinpath(temp_dir, "ndwi.jpg"))
-            ndwi = load(ndwi_path)
+            ndwi = select_bands(selected_image, 5,4,nothing, lossless=true)
             binary_ndwi = ndwi .> ndwi_threshold
             water_mask = .!dilate(binary_ndwi)
             if crop_size != nothing
@@ -184,83 +233,61 @@ function segment_mask(folder::String, Seed1::Tuple{Int64,Int64}, Seed2::Tuple{In
 
     # Main Segmentation
     for i in [1:1:file_count;]
-        rgb_path = select_bands(sorted[i], 1,2,3, joinpath(temp_dir, "rgb.jpg"))
-        ndvi_path = select_bands(sorted[i], 4,1,nothing, joinpath(temp_dir, "ndvi.jpg"))
+        rgb = select_bands(sorted[i], 1,2,3)
 
         date = extract_date(sorted[i])
 
-        if i == 1
-            pixel_count = count_pixels(rgb_path, Seed1, Seed2, Seed3=Seed3, Seed4=Seed4, Display=false, crop_size=crop_size, mods=mods) 
-            
-            row = DataFrame(Date=date, Pixels=pixel_count)
-            append!(results, row)
-            segments = segmented_object(rgb_path, Seed1, Seed2, Seed3=Seed3, crop_size=crop_size, mods=mods)
-            mask = labels_map(segments) .== 1
+        # Segment once; the same result gives both the pixel count and the mask
+        result = segment_image(rgb, Seed1, Seed2, Seed3=Seed3, Seed4=Seed4, crop_size=crop_size, mods=mods)
+        println("The segemented region contains $(result.count) pixels.")
+
+        if Display && masks === nothing
+            masks = zeros(Int, size(result.mask))
+        end
+
+        if i == 1 || result.count <= pixels[end]
+            push!(dates, date)
+            push!(pixels, result.count)
+            mask = result.mask
             mask = mask .* water_mask
 
             if Display
-                masks = masks .+ mask
-                outlines = heatmap!(reverse(masks, dims=1))
+                masks .+= mask .!= 0
             end
-        end
+        else
+            # Get NDVI of current image; the band service reuses the stack read for RGB
+            NDVI = select_bands(sorted[i], 4,1,nothing, lossless=true)
 
-        if i > 1
-            constraint = results[i-1, "Pixels"]
-            tentative = count_pixels(rgb_path, Seed1, Seed2, Seed3=Seed3, Seed4=Seed4, Display=false, crop_size=crop_size, mods=mods) 
-            
-            if tentative <= constraint
-              row = DataFrame(Date=date, Pixels=tentative)
-              append!(results, row)
-              segments = segmented_object(rgb_path, Seed1, Seed2, Seed3=Seed3, crop_size=crop_size, mods=mods)
-              mask = labels_map(segments) .== 1
-              mask = mask .* water_mask
-                
-              if Display
-                masks = masks .+ mask
-                outlines = heatmap!(reverse(masks, dims=1))
-              end
+            if ndvi_threshold < 1.0
+                # Binarize
+                NDVI = (NDVI .> ndvi_threshold)
             end
 
-            if tentative > constraint
-                # Get NDVI of current image
-                NDVI = load(ndvi_path)
-
-                if ndvi_threshold < 1.0
-                    # Binarize
-                    NDVI = (NDVI .> ndvi_threshold)
-                end
-
-                if crop_size != nothing
-                    NDVI = crop_center(NDVI, crop_size)
-                end
-                
-                # Mask NDVI of current image by area of previous image
-                Masked_NDVI = mask .* NDVI .* water_mask
-                
-                # Tally pixels meeting criterion within masked area
-                pixel_count = count(x -> x != 0, Masked_NDVI)
-
-                # Add to table and update mask
-                row = DataFrame(Date=date, Pixels=pixel_count)
-                append!(results, row)
-
-                if Display
-                    # Convert Masked_NDVI to binary values
-                    binary_Masked_NDVI = Masked_NDVI .> 0
-                    masks = masks .+ binary_Masked_NDVI
-                    outlines = heatmap!(reverse(masks, dims=1))
-                end
+            if crop_size != nothing
+                NDVI = crop_center(NDVI, crop_size)
+            end
+            
+            # Mask NDVI of current image by area of previous image
+            Masked_NDVI = mask .* NDVI .* water_mask
+            
+            # Tally pixels meeting criterion within masked area
+            pixel_count = count(x -> x != 0, Masked_NDVI)
+
+            # Add to table and update mask
+            push!(dates, date)
+            push!(pixels, pixel_count)
+
+            if Display
+                # Convert Masked_NDVI to binary values
+                masks .+= Masked_NDVI .> 0
             end
         end
     end
 
-    # Clean up by deleting the temporary directory and its contents
-    rm(temp_dir, recursive=true)
-
     if Display
-        display(outlines)
+        display(heatmap(reverse(masks, dims=1), framestyle=:none))
     end
     
-    #results.Date = Date.(results.Date, "yyyy-mm-dd")
+    results = DataFrame(Date=dates, Pixels=pixels)
     results = sort!(results, :Date)
 end
\ No newline at end of file
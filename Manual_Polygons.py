@@ -0,0 +1,202 @@
+import os
+import re
+import csv
+import glob
+import json
+import numpy as np
+import rasterio
+from scipy.interpolate import splprep, splev
+
+from Datacube import DATE_PATTERN
+
+# Site ID in paths such as .../Data/Sentinel-s003/RGB/RGB_2021-07-21.jpg
+SITE_PATTERN = re.compile(r'(s\d{3})')
+
+# Number of points the clicked outline is resampled to, as in Manual_Segmentation.ipynb
+SPLINE_POINTS = 1000
+
+def smooth_outline(points, spline_points=SPLINE_POINTS):
+    """
+    Close a clicked outline and resample it along a periodic interpolating spline, as
+    Manual_Segmentation.ipynb does before filling it.
+
+    Parameters:
+    - points: Array of (x, y) = (column, row) clicked points.
+
+    Returns:
+    - int32 array of shape (spline_points, 2) of (x, y) vertices.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if not np.array_equal(points[0], points[-1]):
+        points = np.vstack([points, points[:1]])
+    tck, _ = splprep([points[:, 0], points[:, 1]], s=0, per=True)
+    x, y = splev(np.linspace(0, 1, spline_points), tck)
+    return np.vstack([x, y]).T.astype(np.int32)
+
+def rasterize(vertices, shape):
+    """
+    Fill a closed polygon on a pixel grid, including the pixels its outline passes through.
+
+    Pixel centers are at integer (x, y) = (column, row) coordinates. Every edge is intersected
+    with every row at once, each crossing is added at the first column to its right, and a
+    cumulative sum along the rows gives the even-odd inside test for all pixels together.
+
+    Parameters:
+    - vertices: Array of (x, y) polygon vertices; the last vertex connects to the first.
+    - shape: (height, width) of the grid.
+
+    Returns:
+    - Boolean mask of the given shape.
+    """
+    height, width = shape
+    vertices = np.asarray(vertices, dtype=np.float64)
+    x0, y0 = vertices[:, 0], vertices[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+
+    rows = np.arange(height, dtype=np.float64)[:, np.newaxis]
+    # Half-open rule so a vertex on a row is counted once
+    crossing = ((y0 <= rows) & (rows < y1)) | ((y1 <= rows) & (rows < y0))
+    row_index, edge = np.nonzero(crossing)
+    x = x0[edge] + (row_index - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+    column = np.clip(np.floor(x).astype(np.int64) + 1, 0, width)
+
+    counts = np.zeros((height, width + 1), dtype=np.int32)
+    np.add.at(counts, (row_index, column), 1)
+    mask = (np.cumsum(counts[:, :width], axis=1) % 2).astype(bool)
+
+    # Outline pixels are part of the region, as with cv2.fillPoly
+    outline = np.rint(vertices).astype(np.int64)
+    inside = (outline[:, 0] >= 0) & (outline[:, 0] < width) & (outline[:, 1] >= 0) & (outline[:, 1] < height)
+    mask[outline[inside, 1], outline[inside, 0]] = True
+    return mask
+
+class PolygonStore:
+    """
+    Manual segmentation outlines of every site, parsed once from the Manual_Segmentation CSVs.
+
+    Outlines are kept as one float32 (x, y) vertex array with offsets, the layout of a ragged
+    array, next to per-polygon site, date and estimated area arrays. The store is saved as a
+    single .npz, so the JSON strings of the CSVs are only parsed once.
+    """
+    def __init__(self, vertices, offsets, sites, dates, estimated_areas):
+        self.vertices = np.asarray(vertices, dtype=np.float32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.sites = np.asarray(sites, dtype='U4')
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.estimated_areas = np.asarray(estimated_areas, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.sites)
+
+    def __repr__(self):
+        return f"PolygonStore({len(self)} polygons, {len(np.unique(self.sites))} sites)"
+
+    @classmethod
+    def from_csvs(cls, paths):
+        """
+        Parse Manual_Segmentation_sXXX.csv files, keeping the last outline of each site and date.
+        """
+        if isinstance(paths, str):
+            paths = sorted(glob.glob(paths))
+        outlines = {}
+        for path in paths:
+            with open(path, newline='') as f:
+                for row in csv.DictReader(f):
+                    name = row['File Name']
+                    site = SITE_PATTERN.search(name) or SITE_PATTERN.search(os.path.basename(path))
+                    date = DATE_PATTERN.search(os.path.basename(name.replace('\\', '/')))
+                    points = json.loads(row['Clicked Points'])
+                    if date is None or len(points) < 3:
+                        continue
+                    outlines[(site.group(1), date.group(1))] = (points, float(row['Estimated Area']))
+
+        keys = sorted(outlines)
+        lengths = [len(outlines[key][0]) for key in keys]
+        vertices = np.concatenate([np.asarray(outlines[key][0]) for key in keys]) if keys else np.empty((0, 2))
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        return cls(vertices, offsets, [key[0] for key in keys], [key[1] for key in keys],
+                   [outlines[key][1] for key in keys])
+
+    def save(self, path):
+        np.savez(path, vertices=self.vertices, offsets=self.offsets, sites=self.sites,
+                 dates=self.dates, estimated_areas=self.estimated_areas)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['vertices'], data['offsets'], data['sites'], data['dates'], data['estimated_areas'])
+
+    def points(self, i):
+        """
+        Return the clicked (x, y) points of polygon i.
+        """
+        return self.vertices[self.offsets[i]:self.offsets[i + 1]]
+
+    def mask(self, i, shape):
+        """
+        Return the filled, spline-smoothed outline of polygon i as a boolean mask.
+        """
+        return rasterize(smooth_outline(self.points(i)), shape)
+
+    def masks(self, shape, indices=None):
+        """
+        Return the masks of several polygons on one grid as a (polygon, height, width) array.
+        """
+        indices = range(len(self)) if indices is None else indices
+        stack = np.zeros((len(indices), *shape), dtype=bool)
+        for n, i in enumerate(indices):
+            stack[n] = self.mask(i, shape)
+        return stack
+
+def scene_grid(data_dir, site, date, catalog=None):
+    """
+    Return the (height, width) and pixel area in m² of a site's scene on a date, from the
+    optional Scene_Catalog.SceneCatalog without opening the scene.
+    """
+    record = None if catalog is None else catalog.scene(site, date)
+    if record is not None:
+        return (record['height'], record['width']), record['pixel_area']
+    with rasterio.open(os.path.join(data_dir, f"Sentinel-{site}", f"Sentinel2_{date}.tif")) as src:
+        return (src.height, src.width), abs(src.transform.a * src.transform.e)
+
+def iou(manual, automatic):
+    """
+    Intersection over union of two masks, or of two (n, height, width) mask stacks pairwise.
+    """
+    manual, automatic = np.asarray(manual, dtype=bool), np.asarray(automatic, dtype=bool)
+    axes = (-2, -1)
+    intersection = np.count_nonzero(manual & automatic, axis=axes)
+    union = np.count_nonzero(manual | automatic, axis=axes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, intersection / union, np.nan)
+
+def manual_areas(store, data_dir="Data", automatic=None, catalog=None):
+    """
+    Rasterize every polygon on its scene grid and measure it.
+
+    Parameters:
+    - store: PolygonStore.
+    - data_dir: Folder containing the Sentinel-sXXX site folders.
+    - automatic: Optional {(site, 'YYYY-MM-DD'): mask} of automatic segmentations to compare.
+    - catalog: Optional Scene_Catalog.SceneCatalog of data_dir to read scene grids from.
+
+    Returns:
+    - List of {'ID', 'Date', 'Pixels', 'Area_m2', 'EstimatedArea', 'IoU'} dictionaries; IoU is
+      None without an automatic mask for the scene.
+    """
+    rows = []
+    grids = {}
+    for i in range(len(store)):
+        site, date = str(store.sites[i]), str(store.dates[i])
+        if (site, date) not in grids:
+            grids[(site, date)] = scene_grid(data_dir, site, date, catalog)
+        shape, pixel_area = grids[(site, date)]
+        mask = store.mask(i, shape)
+        pixels = int(np.count_nonzero(mask))
+
+        overlap = None
+        if automatic is not None and (site, date) in automatic:
+            overlap = float(iou(mask, automatic[(site, date)]))
+        rows.append({'ID': site, 'Date': date, 'Pixels': pixels, 'Area_m2': pixels * pixel_area,
+                     'EstimatedArea': float(store.estimated_areas[i]), 'IoU': overlap})
+    return rows
@@ -0,0 +1,145 @@
+import os
+import json
+import numpy as np
+from rasterio import features
+from rasterio.transform import Affine
+from rasterio.warp import transform_geom
+
+from Scene_Catalog import SceneCatalog
+from Region_Growing import sweep_mask, crop_origin
+from Batch_Segment import mask_options
+
+def crop_transform(transform, shape, crop_size=None):
+    """
+    Return the geotransform of a scene cropped with Region_Growing.crop_center.
+
+    Parameters:
+    - transform: Geotransform of the whole scene, as an Affine or its six coefficients.
+    - shape: (height, width) of the whole scene.
+    - crop_size: Optional (height, width) of the centre crop.
+    """
+    transform = Affine(*transform[:6])
+    if crop_size is None:
+        return transform
+    top, left = crop_origin(shape, crop_size)
+    return transform * Affine.translation(left, top)
+
+def ring_area(ring):
+    """
+    Return the area enclosed by a closed ring of (x, y) points, with the shoelace formula.
+    """
+    x, y = np.asarray(ring, dtype=np.float64).T
+    return abs(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])) / 2
+
+def polygon_area(geometry):
+    """
+    Return the area of a GeoJSON Polygon, its outer ring minus its holes, in squared CRS units.
+    """
+    outer, *holes = geometry['coordinates']
+    return ring_area(outer) - sum(ring_area(hole) for hole in holes)
+
+def mask_polygons(mask, transform, connectivity=8):
+    """
+    Trace the connected regions of a boolean mask as polygons in the coordinates of transform.
+
+    Polygon edges follow pixel edges, so each area is exactly its pixel count times the pixel
+    area.
+
+    Parameters:
+    - mask: Boolean (height, width) array.
+    - transform: Geotransform of the mask, e.g. from crop_transform.
+    - connectivity: 4 or 8, as in the segmentation.
+
+    Returns:
+    - List of (GeoJSON Polygon, area) pairs, area in squared CRS units.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    shapes = features.shapes(mask.astype(np.uint8), mask=mask, transform=Affine(*transform[:6]), connectivity=connectivity)
+    return [(geometry, polygon_area(geometry)) for geometry, _ in shapes]
+
+def sweep_features(site_id, dates, masks, thresholds, catalog, crop_size=None, connectivity=8):
+    """
+    Return GeoJSON features of the masks of a sweep, one per polygon, in each scene's CRS.
+
+    Parameters:
+    - site_id: Site ID, e.g. s003.
+    - dates: Date of every mask, in the order of masks.
+    - masks: Boolean (date, threshold, height, width) array, as from sweep_mask(return_masks=True).
+    - thresholds: Threshold of every mask along the second axis.
+    - catalog: SceneCatalog holding the site's scenes.
+    - crop_size: crop_size the masks were segmented with.
+
+    Returns:
+    - List of features with ID, Date, Threshold, Pixels and Area_m2 properties and the CRS of
+      their scene under 'crs'.
+    """
+    result = []
+    for d, date in enumerate(dates):
+        record = catalog.scene(site_id, date)
+        if record is None:
+            raise KeyError(f"No cataloged scene of {site_id} on {date}; refresh the catalog.")
+        transform = crop_transform(record['transform'], (record['height'], record['width']), crop_size)
+        for t, threshold in enumerate(thresholds):
+            for geometry, area in mask_polygons(masks[d, t], transform, connectivity):
+                result.append({
+                    'type': 'Feature',
+                    'geometry': geometry,
+                    'properties': {
+                        'ID': site_id,
+                        'Date': str(date),
+                        'Threshold': float(threshold),
+                        'Pixels': int(round(area / record['pixel_area'])),
+                        'Area_m2': area,
+                    },
+                    'crs': record['crs'],
+                })
+    return result
+
+def write_geojson(path, polygon_features, to_wgs84=True):
+    """
+    Write features from sweep_features as a GeoJSON FeatureCollection.
+
+    GeoJSON coordinates are longitude and latitude, so features are reprojected from their
+    scenes' CRS unless to_wgs84 is False, in which case all features must share one CRS, which
+    is named in the collection. Areas stay those computed in the scenes' CRS.
+    """
+    crss = {feature['crs'] for feature in polygon_features}
+    collection = {'type': 'FeatureCollection', 'features': []}
+    if not to_wgs84:
+        if len(crss) > 1:
+            raise ValueError(f"Features are in several CRSs {sorted(crss)}; write them with to_wgs84=True.")
+        if crss:
+            collection['crs'] = {'type': 'name', 'properties': {'name': crss.pop()}}
+    for feature in polygon_features:
+        geometry = transform_geom(feature['crs'], 'EPSG:4326', feature['geometry']) if to_wgs84 else feature['geometry']
+        collection['features'].append({'type': 'Feature', 'geometry': geometry, 'properties': feature['properties']})
+    with open(path + '.tmp', 'w') as f:
+        json.dump(collection, f)
+    os.replace(path + '.tmp', path)
+    return path
+
+def export_site(site, path, thresholds=None, catalog=None, to_wgs84=True):
+    """
+    Segment a site with sweep_mask, configured as in Batch_Segment.run_batch, and write the
+    masks of every date and threshold as polygons.
+
+    Parameters:
+    - site: Site entry of Batch_Segment.load_config, seeded with auto_seed.
+    - path: GeoJSON file to write.
+    - thresholds: Thresholds to export; defaults to the site's grid.
+    - catalog: Optional SceneCatalog of the site's data folder; by default the catalog of the
+      folder containing the site folder is refreshed and used.
+    - to_wgs84: See write_geojson.
+
+    Returns:
+    - The written path.
+    """
+    if catalog is None:
+        catalog = SceneCatalog(os.path.dirname(site['folder']))
+        catalog.refresh()
+    thresholds = site['thresholds'] if thresholds is None else thresholds
+    seeds = (site['Seed1'], site['Seed2'], site.get('Seed3'), site.get('Seed4'))
+    sweep, masks = sweep_mask(site['folder'], *seeds, thresholds=thresholds, return_masks=True, **mask_options(site))
+    dates = [date for date, _ in sweep[float(thresholds[0])]]
+    polygon_features = sweep_features(site['ID'], dates, masks, thresholds, catalog, site.get('crop_size'))
+    return write_geojson(path, polygon_features, to_wgs84)
@@ -0,0 +1,207 @@
+import os
+import glob
+import numpy as np
+import rasterio
+
+# One histogram bin per uint16 value
+HISTOGRAM_BINS = 65536
+
+# Folder next to a site's scenes holding their cached histograms
+STATS_FOLDER = "Stats"
+
+def band_histograms(stack):
+    """
+    Count the values of every band of a (band, height, width) stack with one bincount per band.
+
+    Float stacks read from uint16 data (e.g. with out_dtype=np.float32) are rounded back to
+    uint16 first.
+
+    Returns:
+    - int64 array of shape (band, 65536).
+    """
+    stack = np.asarray(stack)
+    if stack.dtype != np.uint16:
+        stack = np.clip(np.rint(stack), 0, HISTOGRAM_BINS - 1).astype(np.uint16)
+    return np.stack([np.bincount(band.ravel(), minlength=HISTOGRAM_BINS) for band in stack])
+
+def histogram_percentiles(histograms, percentiles):
+    """
+    Return percentiles of the values counted in histograms, equal to np.percentile of the values.
+
+    The value of any rank is the first bin whose cumulative count exceeds it, so the two ranks
+    around each percentile are found by a search of the cumulative counts and interpolated
+    linearly, as np.percentile does, without sorting or copying the data.
+
+    Parameters:
+    - histograms: Array of shape (..., 65536), e.g. from band_histograms.
+    - percentiles: Sequence of percentiles in [0, 100].
+
+    Returns:
+    - float64 array of shape (..., len(percentiles)).
+    """
+    histograms = np.asarray(histograms)
+    percentiles = np.asarray(percentiles, dtype=np.float64)
+    cumulative = np.cumsum(histograms.reshape(-1, histograms.shape[-1]), axis=-1)
+    result = np.empty((len(cumulative), len(percentiles)))
+    for i, counts in enumerate(cumulative):
+        total = counts[-1]
+        if total == 0:
+            result[i] = np.nan
+            continue
+        rank = percentiles / 100 * (total - 1)
+        below = np.floor(rank)
+        low = np.searchsorted(counts, below, side='right')
+        high = np.searchsorted(counts, np.minimum(below + 1, total - 1), side='right')
+        result[i] = low + (rank - below) * (high - low)
+    return result.reshape(*histograms.shape[:-1], len(percentiles))
+
+class Stretch:
+    """
+    Percentile stretch of uint16 bands to [0, 1].
+
+    Parameters:
+    - low, high: Percentiles mapped to 0 and 1; values outside are clipped.
+    - mode: 'band' for limits per band, or 'global' for the limits of all bands together,
+      which keeps their ratios (colour balance).
+    - scope: 'scene' for limits from each scene alone, or 'site' for limits from every scene
+      of the site folder, so one stretch applies to the whole time series.
+    """
+    def __init__(self, low=2, high=98, mode='band', scope='scene'):
+        if mode not in ('band', 'global'):
+            raise ValueError(f"mode must be 'band' or 'global', not {mode}.")
+        if scope not in ('scene', 'site'):
+            raise ValueError(f"scope must be 'scene' or 'site', not {scope}.")
+        if not 0 <= low < high <= 100:
+            raise ValueError("Percentiles must satisfy 0 <= low < high <= 100.")
+        self.low = low
+        self.high = high
+        self.mode = mode
+        self.scope = scope
+
+    def __repr__(self):
+        return f"Stretch(low={self.low}, high={self.high}, mode='{self.mode}', scope='{self.scope}')"
+
+    def parameters(self):
+        # JSON-comparable form for build manifests
+        return {'method': 'percentile', 'low': self.low, 'high': self.high, 'mode': self.mode, 'scope': self.scope}
+
+    def limits(self, histograms):
+        """
+        Return the (low, high) limits of each band from its histogram.
+
+        Returns:
+        - Two float64 arrays of shape (band,).
+        """
+        histograms = np.asarray(histograms)
+        if self.mode == 'global':
+            histograms = np.broadcast_to(histograms.sum(axis=0), histograms.shape)
+        limits = histogram_percentiles(histograms, [self.low, self.high])
+        return limits[:, 0], limits[:, 1]
+
+def apply_stretch(bands, low, high, axis=0, out=None):
+    """
+    Stretch band values to [0, 1] with per-band limits.
+
+    Parameters:
+    - bands: Array of band values, e.g. (band, height, width).
+    - low, high: Limits of every band, e.g. from Stretch.limits.
+    - axis: Band axis of bands; -1 for (height, width, band) images.
+    - out: Optional float32 array of the same shape to write the result into; may be bands.
+
+    Returns:
+    - float32 array with the shape of bands.
+    """
+    shape = [1] * np.ndim(bands)
+    shape[axis] = -1
+    low = np.asarray(low, dtype=np.float32)
+    high = np.asarray(high, dtype=np.float32)
+    # A constant band maps to 0 rather than dividing by zero
+    low, span = low.reshape(shape), np.maximum(high - low, np.finfo(np.float32).tiny).reshape(shape)
+    out = np.empty(np.shape(bands), dtype=np.float32) if out is None else out
+    np.subtract(bands, low, out=out)
+    np.divide(out, span, out=out)
+    return np.clip(out, 0, 1, out=out)
+
+class StretchCache:
+    """
+    Band histograms of scenes, cached per scene and summed per site.
+
+    Each scene's histograms are saved as Stats/Stats_YYYY-MM-DD.npz next to its GeoTIFF, with
+    the GeoTIFF's size and modification time, so they are computed once and recomputed only
+    when the scene changes. A site's histogram is the sum of its scenes', kept in memory until
+    a scene of the folder changes.
+    """
+    def __init__(self):
+        self.scenes = {}
+        self.sites = {}
+
+    @staticmethod
+    def path(file_path):
+        """
+        Return the path of a scene's cached histograms.
+        """
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        return os.path.join(os.path.dirname(file_path), STATS_FOLDER, f"Stats_{name[-10:]}.npz")
+
+    def scene(self, file_path, stack=None):
+        """
+        Return the (band, 65536) histograms of a scene, from the cache when it is current.
+
+        Parameters:
+        - file_path: Path to the GeoTIFF.
+        - stack: Optional (band, height, width) values of the scene, already read, to avoid a read.
+        """
+        stat = os.stat(file_path)
+        key = (stat.st_size, stat.st_mtime_ns)
+        if self.scenes.get(file_path, (None,))[0] == key:
+            return self.scenes[file_path][1]
+
+        path = self.path(file_path)
+        histograms = None
+        if os.path.exists(path):
+            with np.load(path) as data:
+                if tuple(data['key']) == key:
+                    histograms = data['histograms'].astype(np.int64)
+        if histograms is None:
+            if stack is None:
+                with rasterio.open(file_path) as src:
+                    stack = src.read()
+            histograms = band_histograms(stack)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Most bins are empty, so compressed histograms take a few kilobytes
+            np.savez_compressed(path + '.tmp.npz', key=np.array(key, dtype=np.int64),
+                                histograms=histograms.astype(np.int32))
+            os.replace(path + '.tmp.npz', path)
+        self.scenes[file_path] = (key, histograms)
+        return histograms
+
+    def site(self, folder):
+        """
+        Return the summed histograms of every GeoTIFF in a site folder.
+        """
+        files = sorted(glob.glob(os.path.join(folder, "*.tif")))
+        if not files:
+            raise FileNotFoundError(f"No GeoTIFFs found in {folder}.")
+        key = tuple((os.path.basename(f), os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in files)
+        if self.sites.get(folder, (None,))[0] != key:
+            self.sites[folder] = (key, sum(self.scene(f) for f in files))
+        return self.sites[folder][1]
+
+    def limits(self, file_path, stretch, bands=None, stack=None):
+        """
+        Return the (low, high) limits of a scene's bands under a Stretch.
+
+        Parameters:
+        - file_path: Path to the GeoTIFF.
+        - stretch: Stretch; with site scope the limits come from every scene of its folder.
+        - bands: Optional 1-based band numbers to stretch, e.g. (1, 2, 3); global mode then
+          pools only these bands.
+        - stack: Optional (band, height, width) values of the whole scene, already read.
+        """
+        if stretch.scope == 'site':
+            histograms = self.site(os.path.dirname(file_path))
+        else:
+            histograms = self.scene(file_path, stack)
+        if bands is not None:
+            histograms = histograms[np.asarray(bands) - 1]
+        return stretch.limits(histograms)
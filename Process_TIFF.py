@@ -4,6 +4,16 @@ import matplotlib.pyplot as plt
 from PIL import Image
 import os
 import glob
+import io
+import json
+import hashlib
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from Product_Store import save_product, DEFAULT_INDICES
+from Normalization import StretchCache, band_histograms, apply_stretch
+from Instrumentation import Profiler, active, stage, count
 
 def calculate_ndvi(file_path, threshold=False, display=False, metadata_list=None):
     # Extract the base name and last 10 digits before the file extension
@@ -141,19 +151,387 @@ def calculate_ndvi(file_path, threshold=False, display=False, metadata_list=None
     print(f"NDVI image saved as {ndvi_name}")
     print(f"RGBA image saved as {rgba_name}")
 
-def process_folder(path, threshold=False):
-    metadata_list = []
-    # Find all TIFF files in the input directory
-    tiff_files = glob.glob(os.path.join(path, "*.tif"))
+# Band numbers (1-based, as in rasterio) of the exported stack: Red, Green, Blue, NIR, SWIR
+BAND_ORDER = {'red': 1, 'green': 2, 'blue': 3, 'nir': 4, 'swir': 5}
 
-    # Loop over each file and process it
-    for tiff_file in tiff_files:
-        print(f"Processing {tiff_file}")
-        calculate_ndvi(tiff_file, threshold=threshold, metadata_list=metadata_list)
+# Band numbers of the red, green and blue channels of RGB products
+RGB_BANDS = (BAND_ORDER['red'], BAND_ORDER['green'], BAND_ORDER['blue'])
+
+class ProductEngine:
+    """
+    Compute RGB, RGBA and normalized difference products from a single read of the band stack.
+
+    Parameters:
+    - products: Products to compute. Any of 'RGB', 'RGBA' and the keys of indices.
+    - indices: Dictionary of normalized differences {name: (bandA, bandB)} using 1-based band numbers.
+    - threshold: Optional NDVI threshold, as in calculate_ndvi.
+    - store: Optional dtype ('float32' or 'float16') in which calculate_products stores the
+      unscaled normalized differences as .npy arrays.
+    - preview: Whether calculate_products writes the JPEG/PNG images.
+    - stretch: Optional Normalization.Stretch of the RGB bands. By default RGB is divided by
+      its maximum, as in calculate_ndvi, so a single saturated pixel sets the scale.
+    - site_limits: Optional {folder: (low, high)} RGB limits of site-scope stretches, computed
+      once by the build rather than by every worker.
+    - mask: Optional Quality_Mask.MaskStore. calculate_products then zeroes the pixels that are
+      cloud, shadow or no data in every image, stores them as NaN in the .npy arrays, makes
+      them transparent in RGBA, leaves them out of the stretch statistics, and writes nothing
+      for scenes without a valid pixel.
+
+    Buffers are allocated on the first scene and reused for every later scene of the same size,
+    so an engine should be kept for a whole folder rather than built per file. The buffers of
+    the BUFFER_SETS most recently used shapes are kept, enough for the full, right, bottom and
+    corner windows of a windowed read, so a folder of scenes of varying sizes does not
+    accumulate them.
+    """
+    BUFFER_SETS = 4
+
+    def __init__(self, products=('RGB', 'NDVI', 'NDWI', 'RGBA'), indices=None, threshold=False, store=None, preview=True, stretch=None, site_limits=None, mask=None):
+        self.indices = dict(DEFAULT_INDICES)
+        if indices is not None:
+            self.indices.update(indices)
+
+        for product in products:
+            if product not in ('RGB', 'RGBA') and product not in self.indices:
+                raise ValueError(f"Unknown product {product}. Add it to indices as (bandA, bandB).")
+
+        self.products = tuple(products)
+        self.threshold = threshold
+        self.store = store
+        self.preview = preview
+        self.stretch = stretch
+        self.site_limits = dict(site_limits or {})
+        self.mask = mask
+        self.buffers = {}
+        self._buffer_sets = OrderedDict()
+
+    def _allocate(self, shape):
+        # Keep one set of buffers per recent array shape, so edge tiles of a windowed read don't reallocate
+        if shape in self._buffer_sets:
+            self._buffer_sets.move_to_end(shape)
+        else:
+            if len(self._buffer_sets) >= self.BUFFER_SETS:
+                self._buffer_sets.popitem(last=False)
+            bands, height, width = shape
+            buffers = {
+                'stack': np.empty(shape, dtype=np.float32),
+                'scratch': np.empty((height, width), dtype=np.float32),
+                'rgb': np.empty((height, width, 3), dtype=np.float32),
+                'rgba': np.empty((height, width, 4), dtype=np.uint8),
+            }
+            for name in self.indices:
+                buffers[name] = np.empty((height, width), dtype=np.float32)
+                buffers[name + '_uint8'] = np.empty((height, width), dtype=np.uint8)
+            self._buffer_sets[shape] = buffers
+        self.buffers = self._buffer_sets[shape]
+
+    def read(self, src, window=None):
+        """
+        Read every band of an open rasterio dataset, or of one window of it, into the float32
+        stack buffer with one call.
+        """
+        if window is None:
+            shape = (src.count, src.height, src.width)
+        else:
+            shape = (src.count, int(window.height), int(window.width))
+        self._allocate(shape)
+        with stage('read', bytes_read=self.buffers['stack'].nbytes):
+            return src.read(out=self.buffers['stack'], window=window)
+
+    def _needed_indices(self):
+        # Normalized differences to compute; NDVI is always needed for the RGBA alpha channel
+        wanted = set(self.products)
+        needed = [name for name in self.indices if name in wanted]
+        if 'RGBA' in wanted and 'NDVI' not in needed:
+            needed.append('NDVI')
+        return needed
+
+    def _normalized_difference(self, stack, name, threshold=True):
+        # (A - B) / (A + B) written straight into the product buffer
+        band_a, band_b = self.indices[name]
+        a = stack[band_a - 1]
+        b = stack[band_b - 1]
+        index = self.buffers[name]
+        scratch = self.buffers['scratch']
+        np.subtract(a, b, out=index)
+        np.add(a, b, out=scratch)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(index, scratch, out=index)
+
+        # Handle NaNs and Infs
+        np.nan_to_num(index, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+
+        # Apply threshold if provided
+        if threshold and name == 'NDVI' and self.threshold is not False:
+            np.less(index, self.threshold, out=index, casting='unsafe')
+        return index
+
+    def _scale_uint8(self, values, name, low, high):
+        # Min-max stretch to [0, 255] for saving as an image
+        scaled = self.buffers['scratch']
+        np.subtract(values, low, out=scaled)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(scaled, high - low, out=scaled)
+        np.multiply(scaled, 255, out=scaled)
+
+        out = self.buffers[name + '_uint8']
+        with np.errstate(invalid='ignore'):
+            out[...] = scaled
+        return out
+
+    def normalized_differences(self, stack):
+        """
+        Return the unscaled, unthresholded normalized difference products of a stack.
+
+        Returns:
+        - Dictionary of float32 arrays keyed by product name. Arrays are engine buffers and are
+          overwritten by the next call.
+        """
+        self._allocate(stack.shape)
+        return {name: self._normalized_difference(stack, name, threshold=False)
+                for name in self.indices if name in self.products}
+
+    @staticmethod
+    def _rgb_histogram(stack, valid=None):
+        # RGB histograms of the valid pixels; invalid pixels are zeroed, so they only fill bin 0
+        histograms = band_histograms(stack[[band - 1 for band in RGB_BANDS]])
+        if valid is not None:
+            histograms[:, 0] -= valid.size - np.count_nonzero(valid)
+        return histograms
+
+    def rgb_limits(self, file_path, stack=None, statistics=None, valid=None):
+        """
+        Return the (low, high) limits of the red, green and blue bands under the engine's stretch.
+
+        Scene-scope limits come from the histograms in statistics, or of the stack; site-scope
+        limits from site_limits, or from the cached histograms of the scene's folder.
+        """
+        if self.stretch.scope == 'site':
+            folder = os.path.dirname(file_path)
+            if folder not in self.site_limits:
+                self.site_limits[folder] = StretchCache().limits(file_path, self.stretch, RGB_BANDS)
+            return self.site_limits[folder]
+        if statistics is not None:
+            return self.stretch.limits(statistics['rgb_histogram'])
+        return self.stretch.limits(self._rgb_histogram(stack, valid))
+
+    def _index_range(self, index, valid=None):
+        # (min, max) of a normalized difference over the valid pixels; (inf, -inf) without any,
+        # so windows without valid pixels leave merged statistics unchanged
+        if valid is None:
+            return np.min(index), np.max(index)
+        return np.min(index, where=valid, initial=np.inf), np.max(index, where=valid, initial=-np.inf)
+
+    def statistics(self, stack, valid=None):
+        """
+        Return the stretch statistics of a stack: the RGB maximum, or the RGB histograms with a
+        scene-scope percentile stretch, and the (min, max) of every normalized difference
+        product. Statistics of several windows combine with merge_statistics.
+
+        With a boolean valid mask, from the engine's mask store, only valid pixels count.
+        """
+        self._allocate(stack.shape)
+        stats = {}
+        if 'RGB' in self.products or 'RGBA' in self.products:
+            if self.stretch is None:
+                stats['rgb_max'] = max(np.max(stack[band - 1]) for band in RGB_BANDS)
+            elif self.stretch.scope == 'scene':
+                stats['rgb_histogram'] = self._rgb_histogram(stack, valid)
+        for name in self._needed_indices():
+            index = self._normalized_difference(stack, name)
+            stats[name] = self._index_range(index, valid)
+        return stats
+
+    def compute(self, stack, statistics=None, file_path=None, valid=None):
+        """
+        Compute the selected products from a (band, height, width) float32 stack.
+
+        Parameters:
+        - stack: Band stack as returned by read.
+        - statistics: Optional stretch statistics from statistics. By default they are taken from
+          the stack itself; pass scene-wide statistics when the stack is one window of a scene.
+        - file_path: Path of the scene, needed for site-scope stretches.
+        - valid: Optional boolean (height, width) mask of the valid pixels, already zeroed in the
+          stack where False; they are left out of the statistics, zero in the index images and
+          transparent in RGBA.
+
+        Returns:
+        - Dictionary of uint8 images keyed by product name. Arrays are engine buffers and are
+          overwritten by the next call.
+        """
+        self._allocate(stack.shape)
+        outputs = {}
+        wanted = set(self.products)
+
+        # RGB normalized by its global maximum, as in calculate_ndvi
+        if 'RGB' in wanted or 'RGBA' in wanted:
+            rgb = self.buffers['rgb']
+            rgba = self.buffers['rgba']
+            for i, band in enumerate(RGB_BANDS):
+                rgb[..., i] = stack[band - 1]
+            if self.stretch is None:
+                rgb_max = np.max(rgb) if statistics is None else statistics['rgb_max']
+                np.divide(rgb, rgb_max, out=rgb)
+            else:
+                apply_stretch(rgb, *self.rgb_limits(file_path, stack, statistics, valid), axis=-1, out=rgb)
+            np.multiply(rgb, 255, out=rgb)
+            rgba[..., :3] = rgb
+            if 'RGB' in wanted:
+                outputs['RGB'] = rgba[..., :3]
+
+        for name in self._needed_indices():
+            index = self._normalized_difference(stack, name)
+            if 'RGBA' in wanted and name == 'NDVI':
+                # Create an alpha channel based on NDVI
+                np.less(index, 0.5, out=self.buffers['rgba'][..., 3], casting='unsafe')
+                np.multiply(self.buffers['rgba'][..., 3], 255, out=self.buffers['rgba'][..., 3])
+                if valid is not None:
+                    np.multiply(self.buffers['rgba'][..., 3], valid, out=self.buffers['rgba'][..., 3])
+            if name in wanted:
+                low, high = self._index_range(index, valid) if statistics is None else statistics[name]
+                outputs[name] = self._scale_uint8(index, name, low, high)
+                if valid is not None:
+                    outputs[name][~valid] = 0
+
+        if 'RGBA' in wanted:
+            outputs['RGBA'] = self.buffers['rgba']
+
+        return outputs
+
+def merge_statistics(first, second):
+    """
+    Combine the stretch statistics of two windows into those of their union.
+    """
+    if first is None:
+        return second
+    merged = {}
+    for key, value in first.items():
+        if key == 'rgb_max':
+            merged[key] = max(value, second[key])
+        elif key == 'rgb_histogram':
+            merged[key] = value + second[key]
+        else:
+            merged[key] = (min(value[0], second[key][0]), max(value[1], second[key][1]))
+    return merged
+
+def resolve_engine(engine, products=None, threshold=None, default_products=('RGB', 'NDVI', 'NDWI', 'RGBA')):
+    """
+    Return engine, or a new ProductEngine of products and threshold when engine is None.
+
+    products and threshold only configure a new engine, so passing either with an engine whose
+    own setting differs raises a ValueError instead of being silently ignored.
+    """
+    if engine is None:
+        return ProductEngine(products=default_products if products is None else products,
+                             threshold=False if threshold is None else threshold)
+    if products is not None and tuple(products) != engine.products:
+        raise ValueError(f"products {tuple(products)} conflict with the engine's {engine.products}; "
+                         f"set them on the engine only.")
+    if threshold is not None and threshold != engine.threshold:
+        raise ValueError(f"threshold {threshold} conflicts with the engine's {engine.threshold}; "
+                         f"set it on the engine only.")
+    return engine
+
+def calculate_products(file_path, products=None, threshold=None, display=False, metadata_list=None, engine=None):
+    """
+    Single-read replacement for calculate_ndvi writing any set of products.
+
+    Parameters:
+    - file_path: Path to the 5-band GeoTIFF.
+    - products: Products to write, each to a subfolder of the same name next to the GeoTIFF;
+      RGB, NDVI, NDWI and RGBA by default.
+    - threshold: Optional NDVI threshold, as in calculate_ndvi.
+    - display: Whether to plot the products.
+    - metadata_list: Optional list to which pixel size information is appended.
+    - engine: Optional ProductEngine to reuse buffers across files, whose products and
+      threshold are then used (see resolve_engine). Its store and preview settings choose
+      between float .npy arrays, preview images, or both, and its mask store the masking of
+      invalid pixels.
+
+    Returns:
+    - Dictionary of written file paths keyed by product name, with stored arrays keyed by
+      product name followed by '_store'.
+    """
+    engine = resolve_engine(engine, products, threshold)
+
+    base_name = os.path.basename(file_path)
+    dir_name = os.path.dirname(file_path)
+    name, ext = os.path.splitext(base_name)
+
+    with rasterio.open(file_path) as src:
+        if metadata_list is not None:
+            metadata_list.append({
+                'file': base_name,
+                'pixel_width': src.transform[0],
+                'pixel_height': -src.transform[4],
+                'width': src.width,
+                'height': src.height,
+                'crs': src.crs
+            })
+        stack = engine.read(src)
+
+    paths = {}
+
+    # Mask clouds, shadows and no data once per scene, before any product is computed
+    valid = None
+    if engine.mask is not None:
+        with stage('mask', items=1):
+            valid = engine.mask.mask(file_path, stack)
+            if metadata_list is not None:
+                metadata_list[-1]['valid_fraction'] = np.count_nonzero(valid) / valid.size
+            if not valid.any():
+                print(f"No valid pixels in {base_name}, skipped")
+                return paths
+            stack[:, ~valid] = 0
+
+    # Store the normalized differences losslessly before any stretch or threshold
+    if engine.store is not None:
+        with stage('index'):
+            differences = engine.normalized_differences(stack)
+        for product, values in differences.items():
+            if valid is not None:
+                # Invalid pixels are stored as NaN, since 0.0 is a real index value
+                values[~valid] = np.nan
+            with stage('write'):
+                paths[product + '_store'] = save_product(file_path, product, values, engine.store)
+            count('write', bytes_written=os.path.getsize(paths[product + '_store']))
+
+    if not engine.preview:
+        return paths
 
-    # Save all metadata to a single file
-    metadata_path = os.path.join(path, "metadata.txt")
-    with open(metadata_path, 'a') as f:  # Append mode
+    with stage('index'):
+        outputs = engine.compute(stack, file_path=file_path, valid=valid)
+
+    for product, image in outputs.items():
+        folder = os.path.join(dir_name, product)
+        os.makedirs(folder, exist_ok=True)
+        extension = 'png' if product == 'RGBA' else 'jpg'
+        paths[product] = os.path.join(folder, f"{product}_{name[-10:]}.{extension}")
+
+        # Save RGBA as PNG and everything else as JPEG, encoding in memory so encoding and
+        # writing are timed separately
+        mode = 'RGBA' if product == 'RGBA' else None
+        encoded = io.BytesIO()
+        with stage('encode', items=1):
+            Image.fromarray(image, mode).save(encoded, format='PNG' if product == 'RGBA' else 'JPEG')
+        with stage('write', bytes_written=encoded.getbuffer().nbytes), open(paths[product], 'wb') as f:
+            f.write(encoded.getbuffer())
+
+        if display:
+            plt.figure(figsize=(10, 10))
+            plt.imshow(image, cmap='RdYlGn' if image.ndim == 2 else None)
+            plt.title(f'{product} Image')
+            plt.axis('off')
+            plt.show()
+
+    for product in ('NDVI', 'RGBA'):
+        if product in paths:
+            print(f"{product} image saved as {os.path.basename(paths[product])}")
+
+    return paths
+
+def write_metadata(metadata_path, metadata_list):
+    # Save metadata entries to a single text file, replacing any previous contents
+    with open(metadata_path, 'w') as f:
         for metadata in metadata_list:
             f.write(f"File: {metadata['file']}\n")
             f.write(f"Pixel width: {metadata['pixel_width']} meters\n")
@@ -161,22 +539,286 @@ def process_folder(path, threshold=False):
             f.write(f"Width: {metadata['width']} pixels\n")
             f.write(f"Height: {metadata['height']} pixels\n")
             f.write(f"CRS: {metadata['crs']}\n")
+            if 'valid_fraction' in metadata:
+                f.write(f"Valid fraction: {metadata['valid_fraction']:.4f}\n")
             f.write("\n")
 
-def process_file(path, threshold=False):
+# Labels of the metadata.txt lines, with the unit following each value
+METADATA_LINES = {'File': ('file', ''), 'Pixel width': ('pixel_width', ' meters'), 'Pixel height': ('pixel_height', ' meters'),
+                  'Width': ('width', ' pixels'), 'Height': ('height', ' pixels'), 'CRS': ('crs', ''),
+                  'Valid fraction': ('valid_fraction', '')}
+
+def read_metadata(metadata_path):
+    """
+    Read the entries of a metadata.txt written by write_metadata or appended by process_folder
+    before the build manifest, as a list of dictionaries with string values.
+
+    Returns:
+    - List of entries in file order, empty when the file does not exist.
+    """
+    if not os.path.exists(metadata_path):
+        return []
+    entries, entry = [], {}
+    with open(metadata_path) as f:
+        for line in f:
+            label, _, value = line.rstrip('\n').partition(': ')
+            if label not in METADATA_LINES:
+                continue
+            key, unit = METADATA_LINES[label]
+            if key == 'file' and entry:
+                entries.append(entry)
+                entry = {}
+            entry[key] = value[:len(value) - len(unit)] if unit and value.endswith(unit) else value
+    if entry:
+        entries.append(entry)
+    for entry in entries:
+        if 'valid_fraction' in entry:
+            entry['valid_fraction'] = float(entry['valid_fraction'])
+    return entries
+
+# Build manifest kept in each site folder, recording how every scene's products were made
+MANIFEST_NAME = "manifest.json"
+
+def processing_parameters(engine, folder=None):
+    """
+    Return the parameters that determine a scene's products, in a JSON-comparable form.
+
+    With a site-scope stretch the folder's RGB limits are included, so adding or changing a
+    scene of the site makes every product of the site stale.
+    """
+    if engine.stretch is None:
+        stretch = 'max'
+    else:
+        stretch = engine.stretch.parameters()
+        if engine.stretch.scope == 'site' and folder is not None:
+            stretch['limits'] = [np.asarray(limits).tolist() for limits in engine.site_limits[folder]]
+    return {
+        'threshold': engine.threshold,
+        'band_order': dict(BAND_ORDER),
+        'indices': {name: list(bands) for name, bands in engine.indices.items()},
+        'stretch': stretch,
+        'products': list(engine.products),
+        'store': engine.store,
+        'preview': engine.preview,
+        'mask': None if engine.mask is None else engine.mask.parameters(),
+    }
+
+def file_hash(path, chunk_size=1 << 20):
+    # SHA-256 of a file's contents, read in chunks
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_manifest(folder):
+    """
+    Load the build manifest of a folder as {file name: record}, or an empty one if none exists.
+    """
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)['scenes']
+
+def save_manifest(folder, manifest):
+    # Write to a temporary file first so an interrupted run never leaves a truncated manifest
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump({'version': 1, 'scenes': manifest}, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def is_fresh(tiff_file, record, parameters):
+    """
+    Check whether the products recorded for a scene are still valid.
+
+    The size and modification time are compared first; the content hash is only computed
+    when they differ, so a re-downloaded but identical file is not reprocessed.
+    """
+    if record is None or record['parameters'] != parameters:
+        return False
+
+    folder = os.path.dirname(tiff_file)
+    if not all(os.path.exists(os.path.join(folder, product)) for product in record['products'].values()):
+        return False
+
+    stat = os.stat(tiff_file)
+    if stat.st_size != record['size']:
+        return False
+    if stat.st_mtime_ns == record['mtime_ns']:
+        return True
+    if file_hash(tiff_file) == record['sha256']:
+        record['mtime_ns'] = stat.st_mtime_ns
+        return True
+    return False
+
+# Engine of each pool worker, built once per process by _init_worker
+_worker_engine = None
+
+# Whether pool workers profile their scenes for the parent's Profiler: None, or its trace_memory
+_worker_profile = None
+
+def _init_worker(options, profile=None):
+    global _worker_engine, _worker_profile
+    _worker_engine = ProductEngine(**options)
+    _worker_profile = profile
+
+def _process_scene(tiff_file):
+    # Process one scene in a worker, returning its stage counters when the parent run is profiled
+    if _worker_profile is None:
+        return _scene_record(tiff_file) + (None,)
+    with Profiler(trace_memory=_worker_profile) as profiler:
+        result = _scene_record(tiff_file)
+    return result + (profiler.stages,)
+
+def _scene_record(tiff_file):
+    # Process one scene and return its manifest record, or the error instead of raising
     metadata_list = []
-    print(f"Processing {path}")
-    calculate_ndvi(path, threshold=threshold, metadata_list=metadata_list)
+    try:
+        stat = os.stat(tiff_file)
+        with contextlib.redirect_stdout(io.StringIO()):
+            paths = calculate_products(tiff_file, metadata_list=metadata_list, engine=_worker_engine)
+        with stage('hash', bytes_read=stat.st_size):
+            sha256 = file_hash(tiff_file)
+    except Exception as e:
+        return tiff_file, None, f"{type(e).__name__}: {e}"
 
-    # Save metadata to a single file
-    dir_name = os.path.dirname(path)
-    metadata_path = os.path.join(dir_name, "metadata.txt")
-    with open(metadata_path, 'a') as f:  # Append mode
-        for metadata in metadata_list:
-            f.write(f"File: {metadata['file']}\n")
-            f.write(f"Pixel width: {metadata['pixel_width']} meters\n")
-            f.write(f"Pixel height: {metadata['pixel_height']} meters\n")
-            f.write(f"Width: {metadata['width']} pixels\n")
-            f.write(f"Height: {metadata['height']} pixels\n")
-            f.write(f"CRS: {metadata['crs']}\n")
-            f.write("\n")
+    metadata = metadata_list[0]
+    metadata['crs'] = str(metadata['crs'])
+    folder = os.path.dirname(tiff_file)
+    record = {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': sha256,
+        'products': {product: os.path.relpath(path, folder) for product, path in paths.items()},
+        'metadata': metadata,
+    }
+    return tiff_file, record, None
+
+def _process_files(tiff_files, options, workers=1, chunksize=1, profile=None):
+    """
+    Process GeoTIFFs on a process pool, yielding (file, record, error, stages) in input order.
+
+    The pool needs this module to be importable, so import Process_TIFF rather than %run it
+    when workers is greater than 1. With profile set to a trace_memory flag, workers return
+    the stage counters of each scene; serial runs report to the active Profiler directly.
+    """
+    if workers == 1:
+        _init_worker(options)
+        yield from map(_process_scene, tiff_files)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options, profile)) as pool:
+        yield from pool.map(_process_scene, tiff_files, chunksize=chunksize)
+
+def _build(tiff_files, options, workers, chunksize, force=False, complete=True):
+    """
+    Process the stale scenes among tiff_files and update the manifest and metadata of their folders.
+
+    options are the ProductEngine keyword arguments every worker builds its engine from.
+
+    When complete is True, tiff_files lists every scene of its folders, manifest records of
+    files that no longer exist are dropped and metadata.txt is rewritten from the manifest;
+    otherwise the manifest's entries are merged into the existing metadata.txt.
+    """
+    manifests = {}
+    for tiff_file in tiff_files:
+        folder = os.path.dirname(tiff_file)
+        if folder not in manifests:
+            manifests[folder] = load_manifest(folder)
+
+    # Site-scope stretch limits are computed here once, from cached histograms, and handed to workers
+    stretch = options.get('stretch')
+    if stretch is not None and stretch.scope == 'site':
+        cache = StretchCache()
+        site_limits = {folder: stretch.limits(cache.site(folder)[[band - 1 for band in RGB_BANDS]]) for folder in manifests}
+        options = dict(options, site_limits=site_limits)
+    engine = ProductEngine(**options)
+    parameters = {folder: processing_parameters(engine, folder) for folder in manifests}
+
+    if complete:
+        present = {(os.path.dirname(f), os.path.basename(f)) for f in tiff_files}
+        for folder, manifest in manifests.items():
+            for name in [name for name in manifest if (folder, name) not in present]:
+                del manifest[name]
+
+    stale = [f for f in tiff_files if force or not is_fresh(f, manifests[os.path.dirname(f)].get(os.path.basename(f)), parameters[os.path.dirname(f)])]
+    print(f"{len(tiff_files) - len(stale)} of {len(tiff_files)} scenes up to date")
+
+    # Print per-file progress, recording successes in the manifest and collecting errors
+    errors = {}
+    total = len(stale)
+    profiler = active()
+    profile = None if profiler is None else profiler.trace_memory
+    for i, (tiff_file, record, error, stages) in enumerate(_process_files(stale, options, workers, chunksize, profile), start=1):
+        if stages:
+            profiler.merge(stages)
+        if error is None:
+            record['parameters'] = parameters[os.path.dirname(tiff_file)]
+            manifests[os.path.dirname(tiff_file)][os.path.basename(tiff_file)] = record
+            print(f"[{i}/{total}] Processed {tiff_file}")
+        else:
+            errors[tiff_file] = error
+            print(f"[{i}/{total}] Failed {tiff_file}: {error}")
+
+    # Rewrite metadata from the manifest so re-runs never duplicate entries. A partial build
+    # merges its records into the existing file instead, keeping entries of scenes it did not see.
+    for folder, manifest in manifests.items():
+        save_manifest(folder, manifest)
+        metadata_path = os.path.join(folder, "metadata.txt")
+        entries = {} if complete else {entry['file']: entry for entry in read_metadata(metadata_path)}
+        entries.update((manifest[name]['metadata']['file'], manifest[name]['metadata']) for name in manifest)
+        write_metadata(metadata_path, [entries[name] for name in sorted(entries)])
+    return errors
+
+def process_folder(path, threshold=False, workers=1, chunksize=1, force=False, store=None, preview=True, stretch=None, mask=None):
+    """
+    Write the products of every new or changed GeoTIFF in a folder and record their metadata.
+
+    Parameters:
+    - path: Folder containing the Sentinel2_YYYY-MM-DD.tif files.
+    - threshold: Optional NDVI threshold, as in calculate_ndvi.
+    - workers: Number of worker processes. 1 processes serially, None uses every core.
+    - chunksize: Number of files handed to a worker at a time.
+    - force: Whether to regenerate products that are up to date in the manifest.
+    - store: Optional dtype ('float32' or 'float16') for lossless .npy NDVI/NDWI arrays.
+    - preview: Whether to write the JPEG/PNG preview images.
+    - stretch: Optional Normalization.Stretch of the RGB products instead of the maximum stretch.
+    - mask: Optional Quality_Mask.MaskStore masking clouds, shadows and no data in every product.
+
+    Returns:
+    - Dictionary of error messages keyed by file for scenes that failed.
+    """
+    # Find all TIFF files in the input directory, sorted for a deterministic processing order
+    tiff_files = sorted(glob.glob(os.path.join(path, "*.tif")))
+    options = {'threshold': threshold, 'store': store, 'preview': preview, 'stretch': stretch, 'mask': mask}
+    return _build(tiff_files, options, workers, chunksize, force=force)
+
+def process_sites(root, pattern="Sentinel-s*", threshold=False, workers=1, chunksize=1, force=False, store=None, preview=True, stretch=None, mask=None):
+    """
+    Process every site folder under root on one shared process pool.
+
+    Parameters:
+    - root: Directory containing the site folders, e.g. Data.
+    - pattern: Glob pattern of the site folders.
+    - threshold: Optional NDVI threshold, as in calculate_ndvi.
+    - workers: Number of worker processes. 1 processes serially, None uses every core.
+    - chunksize: Number of files handed to a worker at a time.
+    - force: Whether to regenerate products that are up to date in the manifests.
+    - store: Optional dtype ('float32' or 'float16') for lossless .npy NDVI/NDWI arrays.
+    - preview: Whether to write the JPEG/PNG preview images.
+    - stretch: Optional Normalization.Stretch of the RGB products instead of the maximum stretch.
+    - mask: Optional Quality_Mask.MaskStore masking clouds, shadows and no data in every product.
+
+    Returns:
+    - Dictionary of error messages keyed by file for scenes that failed.
+    """
+    folders = sorted(f for f in glob.glob(os.path.join(root, pattern)) if os.path.isdir(f))
+    tiff_files = [tiff_file for folder in folders for tiff_file in sorted(glob.glob(os.path.join(folder, "*.tif")))]
+    options = {'threshold': threshold, 'store': store, 'preview': preview, 'stretch': stretch, 'mask': mask}
+    return _build(tiff_files, options, workers, chunksize, force=force)
+
+def process_file(path, threshold=False, force=False, store=None, preview=True, stretch=None, mask=None):
+    # Process a single scene, leaving the other manifest records of its folder untouched
+    options = {'threshold': threshold, 'store': store, 'preview': preview, 'stretch': stretch, 'mask': mask}
+    return _build([path], options, workers=1, chunksize=1, force=force, complete=False)
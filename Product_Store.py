@@ -0,0 +1,81 @@
+import os
+import numpy as np
+
+# Floating point types products can be stored as
+STORE_DTYPES = ('float32', 'float16')
+
+# Normalized differences written by default, as (band A, band B) for (A - B) / (A + B)
+DEFAULT_INDICES = {'NDVI': (4, 1), 'NDWI': (4, 5)}
+
+def product_path(file_path, product):
+    """
+    Return the path of the stored array of a product for a scene.
+
+    Products are kept as one .npy per scene next to the previews, e.g.
+    Data/Sentinel-s003/NDVI/NDVI_2021-07-21.npy, so a site's folder is a set of
+    per-date chunks that can each be memory-mapped.
+    """
+    dir_name = os.path.dirname(file_path)
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(dir_name, product, f"{product}_{name[-10:]}.npy")
+
+def save_product(file_path, product, values, dtype='float32'):
+    """
+    Save the float values of a product for a scene without any rescaling.
+
+    Parameters:
+    - file_path: Path to the scene's GeoTIFF.
+    - product: Product name, e.g. NDVI.
+    - values: 2-D array of product values.
+    - dtype: One of STORE_DTYPES. float16 halves the size and keeps about 3 significant digits.
+
+    Returns:
+    - Path of the written .npy file.
+    """
+    if dtype not in STORE_DTYPES:
+        raise ValueError(f"dtype must be one of {STORE_DTYPES}, not {dtype}.")
+    path = product_path(file_path, product)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.save(path, values.astype(dtype, copy=False))
+    return path
+
+def load_product(file_path, product, mmap=True):
+    """
+    Load the stored values of a product for a scene.
+
+    Parameters:
+    - file_path: Path to the scene's GeoTIFF.
+    - product: Product name, e.g. NDVI.
+    - mmap: Whether to memory-map the array read-only instead of reading it.
+
+    Returns:
+    - The stored array, or None if the product has not been stored.
+    """
+    path = product_path(file_path, product)
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode='r' if mmap else None)
+
+def load_index(file_path, bandA, bandB, indices=DEFAULT_INDICES):
+    """
+    Load the stored normalized difference (bandA - bandB) / (bandA + bandB) of a scene.
+
+    Parameters:
+    - file_path: Path to the scene's GeoTIFF.
+    - bandA, bandB: 1-based band numbers.
+    - indices: Dictionary of stored normalized differences {name: (bandA, bandB)}; by default
+      those Process_TIFF writes.
+
+    Returns:
+    - float32 array, negated when the store holds the index with the bands swapped, or None
+      if no matching product has been stored.
+    """
+    for name, (a, b) in indices.items():
+        if (a, b) == (bandA, bandB) or (b, a) == (bandA, bandB):
+            values = load_product(file_path, name)
+            if values is None:
+                continue
+            if (a, b) == (bandA, bandB):
+                return values.astype(np.float32, copy=False)
+            return np.negative(values, dtype=np.float32)
+    return None
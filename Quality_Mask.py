@@ -0,0 +1,141 @@
+import os
+import numpy as np
+import rasterio
+
+# Band numbers (1-based) of the quality bands exported after the five spectral bands with
+# quality_bands=True: the Scene Classification Layer and the QA60 cloud bitmask
+QUALITY_BAND_ORDER = {'scl': 6, 'qa60': 7}
+
+# Number of spectral bands preceding the quality bands
+SPECTRAL_BANDS = 5
+
+# Scene Classification Layer classes treated as invalid: no data, saturated or defective,
+# cloud shadows, medium and high probability clouds, and thin cirrus
+INVALID_SCL = (0, 1, 3, 8, 9, 10)
+
+# QA60 bits of opaque clouds (10) and cirrus (11)
+QA60_CLOUD_BITS = (1 << 10) | (1 << 11)
+
+# Folder next to a site's scenes holding their validity masks
+MASK_FOLDER = "Mask"
+
+def validity_mask(stack, invalid_scl=INVALID_SCL, use_qa60=True):
+    """
+    Return the pixels of a scene that are valid for every product and count.
+
+    A pixel is invalid where all spectral bands are zero (no data; masked pixels export as
+    zero), where its SCL class is in invalid_scl, or where QA60 flags a cloud. Scenes exported
+    without quality bands are only checked for no data.
+
+    Parameters:
+    - stack: (band, height, width) array of the scene, spectral bands first.
+    - invalid_scl: SCL classes to mask.
+    - use_qa60: Whether to also mask QA60 clouds.
+
+    Returns:
+    - Boolean (height, width) array, True where valid.
+    """
+    valid = np.any(stack[:SPECTRAL_BANDS] != 0, axis=0)
+    if len(stack) >= QUALITY_BAND_ORDER['scl']:
+        # Lookup table over the SCL classes instead of one comparison per class
+        table = np.ones(256, dtype=bool)
+        table[list(invalid_scl)] = False
+        scl = np.asarray(stack[QUALITY_BAND_ORDER['scl'] - 1]).astype(np.uint8)
+        valid &= table[scl]
+    if use_qa60 and len(stack) >= QUALITY_BAND_ORDER['qa60']:
+        qa60 = np.asarray(stack[QUALITY_BAND_ORDER['qa60'] - 1]).astype(np.uint16)
+        valid &= (qa60 & QA60_CLOUD_BITS) == 0
+    return valid
+
+def pack_mask(mask):
+    """
+    Bit-pack a boolean mask to one bit per pixel.
+    """
+    return np.packbits(np.asarray(mask, dtype=bool), axis=None)
+
+def unpack_mask(packed, shape):
+    """
+    Unpack a mask packed by pack_mask to a boolean array of the given shape.
+    """
+    return np.unpackbits(packed, count=int(np.prod(shape))).reshape(shape).astype(bool)
+
+def mask_path(file_path):
+    """
+    Return the path of a scene's validity mask, e.g. Data/Sentinel-s003/Mask/Mask_2021-07-21.npz.
+    """
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(os.path.dirname(file_path), MASK_FOLDER, f"Mask_{name[-10:]}.npz")
+
+class MaskStore:
+    """
+    Validity masks of scenes, computed once per scene and cached bit-packed next to it.
+
+    Each mask is saved with the GeoTIFF's size and modification time and the masking settings,
+    so it is recomputed only when the scene or the settings change. Masks read in this process
+    are also kept in memory.
+
+    Parameters:
+    - invalid_scl: SCL classes to mask.
+    - use_qa60: Whether to also mask QA60 clouds.
+    """
+    def __init__(self, invalid_scl=INVALID_SCL, use_qa60=True):
+        self.invalid_scl = tuple(sorted(invalid_scl))
+        self.use_qa60 = use_qa60
+        self.masks = {}
+
+    def parameters(self):
+        # JSON-comparable form for build manifests
+        return {'invalid_scl': list(self.invalid_scl), 'use_qa60': self.use_qa60}
+
+    def _key(self, file_path):
+        stat = os.stat(file_path)
+        return np.array([stat.st_size, stat.st_mtime_ns, self.use_qa60, *self.invalid_scl], dtype=np.int64)
+
+    def mask(self, file_path, stack=None, windows=None):
+        """
+        Return the boolean validity mask of a scene, from the cache when it is current.
+
+        Parameters:
+        - file_path: Path to the GeoTIFF.
+        - stack: Optional (band, height, width) values of the scene, already read, to avoid a read,
+          or a function returning them, called only when the mask is not cached.
+        - windows: Optional rasterio windows covering the scene. Without a stack, a mask that is
+          not cached is then built window by window, so only one window of all bands is held
+          in memory at a time.
+        """
+        key = self._key(file_path)
+        cached = self.masks.get(file_path)
+        if cached is not None and np.array_equal(cached[0], key):
+            return cached[1]
+
+        path = mask_path(file_path)
+        mask = None
+        if os.path.exists(path):
+            with np.load(path) as data:
+                if np.array_equal(data['key'], key):
+                    mask = unpack_mask(data['packed'], tuple(data['shape']))
+        if mask is None:
+            if callable(stack):
+                stack = stack()
+            if stack is not None:
+                mask = validity_mask(stack, self.invalid_scl, self.use_qa60)
+            else:
+                with rasterio.open(file_path) as src:
+                    if windows is None:
+                        mask = validity_mask(src.read(), self.invalid_scl, self.use_qa60)
+                    else:
+                        mask = np.empty((src.height, src.width), dtype=bool)
+                        for window in windows:
+                            mask[window.toslices()] = validity_mask(src.read(window=window), self.invalid_scl, self.use_qa60)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            np.savez(path + '.tmp.npz', key=key, shape=np.array(mask.shape), packed=pack_mask(mask))
+            os.replace(path + '.tmp.npz', path)
+        self.masks[file_path] = (key, mask)
+        return mask
+
+    def valid_fraction(self, file_path, stack=None):
+        """
+        Return the fraction of valid pixels of a scene.
+        """
+        mask = self.mask(file_path, stack)
+        return np.count_nonzero(mask) / mask.size if mask.size else 0.0
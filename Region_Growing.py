@@ -0,0 +1,553 @@
+import os
+import glob
+import math
+import heapq
+import numpy as np
+
+from Select_Bands import select_bands_array, BandService
+from Datacube import parse_date
+from Instrumentation import stage
+
+# (row, column) offsets of the 4- and 8-neighbourhoods
+NEIGHBOURHOODS = {
+    4: ((-1, 0), (1, 0), (0, -1), (0, 1)),
+    8: ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)),
+}
+
+# Working states of pixels that do not hold a region label yet
+BOUNDARY = 0
+UNLABELLED = -1
+QUEUED = -2
+OUTSIDE = -3
+
+def build_seeds(Seed1, Seed2, Seed3=None, Seed4=None):
+    """
+    Build the seed list from two to four (row, column) seeds, labelled 1 to 4 in order.
+    """
+    seeds = [(Seed1, 1), (Seed2, 2)]
+    if Seed3 is not None:
+        seeds.append((Seed3, 3))
+    if Seed4 is not None:
+        seeds.append((Seed4, 4))
+    return seeds
+
+def crop_origin(shape, crop_size):
+    """
+    Return the 0-based (top, left) pixel of the window kept by crop_center.
+
+    Julia_Segment.jl starts the window at the 1-based pixel height ÷ 2 - crop_height ÷ 2, which
+    is one less in 0-based indices.
+    """
+    height, width = shape[:2]
+    crop_height, crop_width = crop_size
+    return max(0, height // 2 - crop_height // 2 - 1), max(0, width // 2 - crop_width // 2 - 1)
+
+def crop_center(image, crop_size):
+    """
+    Crop an image around its center, as crop_center in Julia_Segment.jl.
+    """
+    top, left = crop_origin(image.shape, crop_size)
+    return image[top:top + crop_size[0], left:left + crop_size[1]]
+
+def draw_line(image, mods):
+    """
+    Draw a one-pixel line on a copy of an RGB image, as draw_line in Julia_Segment.jl.
+
+    Parameters:
+    - image: uint8 array of shape (height, width, 3), or (height, width) which is made gray RGB.
+    - mods: ((row, column), (row, column), (red, green, blue)) with colors in [0, 1].
+    """
+    if image.ndim == 2:
+        image = np.stack([image] * 3, axis=-1)
+    image = image.copy()
+    (r1, c1), (r2, c2), color = mods[0], mods[1], mods[2]
+    steps = int(max(abs(r2 - r1), abs(c2 - c1))) + 1
+    rows = np.rint(np.linspace(r1, r2, steps)).astype(int)
+    columns = np.rint(np.linspace(c1, c2, steps)).astype(int)
+    inside = (rows >= 0) & (rows < image.shape[0]) & (columns >= 0) & (columns < image.shape[1])
+    image[rows[inside], columns[inside]] = np.round(np.asarray(color[:3]) * 255).astype(image.dtype)
+    return image
+
+def dilate(mask):
+    """
+    Dilate a boolean mask by one pixel in every direction (3x3 box).
+    """
+    padded = np.pad(mask, 1)
+    height, width = mask.shape
+    dilated = np.zeros_like(mask)
+    for dy in range(3):
+        for dx in range(3):
+            dilated |= padded[dy:dy + height, dx:dx + width]
+    return dilated
+
+def seeded_region_growing(image, seeds, connectivity=8, initial=None):
+    """
+    Segment an image by seeded region growing (Adams and Bischof, 1994).
+
+    Starting from the seeds, the unlabelled pixel closest to the mean of a neighbouring region
+    is repeatedly added to that region, using a priority queue keyed by the Euclidean distance
+    over channels. A pixel equally close to two regions becomes a boundary pixel, as in
+    ImageSegmentation.jl, which Julia_Segment.jl uses.
+
+    Labels are kept in an int32 array padded by one pixel on every side and addressed by flat
+    index, so neighbours are fixed index offsets and no bounds checks are needed. The queue
+    loop reads and writes the array through a memoryview, which is faster than NumPy element
+    access, and region sums and means are lists indexed by label. The queue itself is pure
+    Python, so the cost is still a few microseconds per pixel.
+
+    Parameters:
+    - image: Array of shape (height, width) or (height, width, channels).
+    - seeds: List of ((row, column), label) with 0-based coordinates and labels >= 1. Several
+      seeds can share a label.
+    - connectivity: 4 or 8 neighbours.
+    - initial: Optional int array of shape (height, width) to warm start from. Pixels with a
+      label > 0 keep it and count towards their region's mean; growth starts from the pixels
+      next to them.
+
+    Returns:
+    - int32 array of shape (height, width) with the region label of every pixel, 0 for boundary
+      pixels.
+    """
+    if connectivity not in NEIGHBOURHOODS:
+        raise ValueError(f"connectivity must be 4 or 8, not {connectivity}.")
+    image = np.asarray(image, dtype=np.float64)
+    if image.ndim == 2:
+        image = image[:, :, np.newaxis]
+    height, width, channels = image.shape
+    stride = width + 2
+
+    padded = np.full((height + 2, stride), OUTSIDE, dtype=np.int32)
+    padded[1:-1, 1:-1] = UNLABELLED if initial is None else np.where(initial > 0, initial, UNLABELLED)
+    flat = padded.ravel()
+    # Element access through a memoryview returns Python ints and writes through to the array
+    labels = memoryview(flat)
+    values = np.zeros((height + 2, stride, channels))
+    values[1:-1, 1:-1] = image
+    values = values.reshape(-1, channels)
+    offsets = [dy * stride + dx for dy, dx in NEIGHBOURHOODS[connectivity]]
+
+    for _, label in seeds:
+        if label < 1:
+            raise ValueError(f"Seed labels must be positive integers, not {label}.")
+    top = max([label for _, label in seeds] + [int(flat.max())])
+    # Running sums, sizes and means of every region, indexed by label
+    labelled = flat > 0
+    sums = np.zeros((top + 1, channels))
+    sizes = np.bincount(flat[labelled], minlength=top + 1).tolist()
+    for c in range(channels):
+        sums[:, c] = np.bincount(flat[labelled], weights=values[labelled, c], minlength=top + 1)
+    if channels == 1:
+        # A single channel is compared as plain floats, without math.dist
+        values = values[:, 0].tolist()
+        sums = sums[:, 0].tolist()
+        means = [total / size if size else 0.0 for total, size in zip(sums, sizes)]
+    else:
+        values = [tuple(v) for v in values.tolist()]
+        sums = sums.tolist()
+        means = [[t / size for t in total] if size else None for total, size in zip(sums, sizes)]
+
+    def add(p, label):
+        labels[p] = label
+        sizes[label] += 1
+        if channels == 1:
+            sums[label] += values[p]
+            means[label] = sums[label] / sizes[label]
+        else:
+            total = sums[label]
+            for c in range(channels):
+                total[c] += values[p][c]
+            means[label] = [t / sizes[label] for t in total]
+
+    def nearest(p, labels=labels, means=means, values=values, offsets=offsets, single=channels == 1, dist=math.dist):
+        # Distance to the closest neighbouring region, and its label or BOUNDARY on a tie; the
+        # defaults make the lookups of this hot loop locals
+        best, best_label = math.inf, BOUNDARY
+        value = values[p]
+        for o in offsets:
+            label = labels[p + o]
+            if label > 0:
+                d = abs(means[label] - value) if single else dist(means[label], value)
+                if d < best:
+                    best, best_label = d, label
+                elif d == best and label != best_label:
+                    best_label = BOUNDARY
+        return best, best_label
+
+    heap = []
+    order = 0
+
+    def enqueue_neighbours(p):
+        nonlocal order
+        for o in offsets:
+            n = p + o
+            if labels[n] == UNLABELLED:
+                labels[n] = QUEUED
+                heapq.heappush(heap, (nearest(n)[0], order, n))
+                order += 1
+
+    for (row, column), label in seeds:
+        if not (0 <= row < height and 0 <= column < width):
+            raise ValueError(f"Seed ({row}, {column}) is outside the {height}x{width} image.")
+        if labels[(row + 1) * stride + column + 1] != label:
+            add((row + 1) * stride + column + 1, label)
+
+    if initial is None:
+        for (row, column), label in seeds:
+            enqueue_neighbours((row + 1) * stride + column + 1)
+    else:
+        # Queue every unlabelled pixel next to a seed or warm-start label at once
+        frontier = np.zeros(len(flat), dtype=bool)
+        for o in offsets:
+            frontier |= np.roll(flat > 0, -o)
+        for p in np.flatnonzero(frontier & (flat == UNLABELLED)).tolist():
+            labels[p] = QUEUED
+            heapq.heappush(heap, (nearest(p)[0], order, p))
+            order += 1
+
+    while heap:
+        distance, _, p = heapq.heappop(heap)
+        current, label = nearest(p)
+        if current > distance:
+            # The neighbouring means moved away since the pixel was queued
+            heapq.heappush(heap, (current, order, p))
+            order += 1
+            continue
+        if label == BOUNDARY:
+            labels[p] = BOUNDARY
+            continue
+        add(p, label)
+        enqueue_neighbours(p)
+
+    result = padded[1:-1, 1:-1]
+    # Pixels only reachable through boundary pixels are left unassigned
+    result[result < 0] = BOUNDARY
+    return np.ascontiguousarray(result)
+
+def segment_window(image, seeds, previous, margin=3, connectivity=8):
+    """
+    Regrow the seeded regions only near the region of interest of a neighbouring date.
+
+    The region grown from Seed1 on the previous date is dilated by margin pixels into a band.
+    Only the band's bounding box is segmented, warm started from the previous labels outside
+    the band, so the cost scales with the size of the region rather than of the image.
+
+    Parameters:
+    - image: Image array of shape (height, width) or (height, width, channels).
+    - seeds: List of ((row, column), label) as for seeded_region_growing.
+    - previous: int label array of the previous date, with label 1 the region of interest.
+    - margin: Number of pixels the previous region can grow by.
+    - connectivity: 4 or 8 neighbours.
+
+    Returns:
+    - int32 label array of the whole image, or None when Seed1 is not in the band and the
+      image has to be segmented in full.
+    """
+    band = previous == 1
+    for _ in range(margin):
+        band = dilate(band)
+    (seed_row, seed_column), _ = seeds[0]
+    if not band[seed_row, seed_column]:
+        return None
+
+    rows, columns = np.nonzero(band)
+    height, width = band.shape
+    top, bottom = max(rows.min() - 1, 0), min(rows.max() + 2, height)
+    left, right = max(columns.min() - 1, 0), min(columns.max() + 2, width)
+
+    window_band = band[top:bottom, left:right]
+    initial = np.where(window_band, 0, previous[top:bottom, left:right])
+    window_seeds = [((row - top, column - left), label) for (row, column), label in seeds
+                    if top <= row < bottom and left <= column < right and window_band[row - top, column - left]]
+
+    labels = previous.copy()
+    labels[top:bottom, left:right] = seeded_region_growing(image[top:bottom, left:right], window_seeds, connectivity, initial)
+    return labels
+
+class SegmentationResult:
+    """
+    Pixel count, label map and mask of the region grown from Seed1, from a single segmentation.
+    """
+    def __init__(self, labels):
+        self.labels = labels
+        self.mask = labels == 1
+        self.count = int(np.count_nonzero(self.mask))
+
+def segment_image(image, Seed1, Seed2, Seed3=None, Seed4=None, connectivity=8, crop_size=None, mods=None, water_mask=None, ndvi_threshold=None, previous=None, margin=3):
+    """
+    Segment an image once, applying the same preparation as count_pixels in Julia_Segment.jl.
+
+    Parameters:
+    - image: Image array of shape (height, width) or (height, width, channels).
+    - Seed1: (row, column) seed inside the region of interest, 0-based.
+    - Seed2, Seed3, Seed4: Seeds of the other regions; Seed3 and Seed4 are optional.
+    - connectivity: 4 or 8 neighbours.
+    - crop_size: Optional (height, width) center crop applied before segmenting.
+    - mods: Optional line drawn on the image, see draw_line.
+    - water_mask: Optional boolean array; pixels where it is False are set to zero.
+    - ndvi_threshold: Optional threshold; the image is replaced by image < ndvi_threshold.
+    - previous: Optional SegmentationResult of a neighbouring date to regrow from incrementally;
+      see segment_window.
+    - margin: Growth margin in pixels of the incremental mode.
+
+    Returns:
+    - SegmentationResult.
+    """
+    if crop_size is not None:
+        image = crop_center(image, crop_size)
+    if mods is not None:
+        image = draw_line(image, mods)
+    if water_mask is not None:
+        image = image * (water_mask[..., np.newaxis] if image.ndim == 3 else water_mask)
+    if ndvi_threshold is not None:
+        # Compare in float64 so float32 NDVI is thresholded exactly, as in Julia
+        image = image < np.float64(ndvi_threshold)
+    seeds = build_seeds(Seed1, Seed2, Seed3, Seed4)
+    with stage('segmentation', items=1):
+        labels = None
+        if previous is not None and previous.count > 0:
+            labels = segment_window(image, seeds, previous.labels, margin, connectivity)
+        if labels is None:
+            labels = seeded_region_growing(image, seeds, connectivity)
+        return SegmentationResult(labels)
+
+def segment_pixel_count(labels):
+    """
+    Return the number of pixels of every label present, as {label: count}.
+    """
+    counts = np.bincount(labels.ravel())
+    return {label: int(count) for label, count in enumerate(counts) if count}
+
+def count_pixels(image, Seed1, Seed2, Seed3=None, Seed4=None, connectivity=8, crop_size=None, water_mask=None):
+    """
+    Return the number of pixels in the region grown from Seed1, as count_pixels in Julia_Segment.jl.
+
+    See segment_image for the parameters.
+    """
+    return segment_image(image, Seed1, Seed2, Seed3, Seed4, connectivity, crop_size, water_mask=water_mask).count
+
+def segment_scene(file_path, Seed1, Seed2, Seed3=None, Seed4=None, bands=(1, 2, 3), connectivity=8, crop_size=None):
+    """
+    Segment the composite of three bands of a GeoTIFF, read straight from the file.
+
+    Returns:
+    - int32 label array; label 1 is the region grown from Seed1.
+    """
+    image = select_bands_array(file_path, *bands)
+    if crop_size is not None:
+        image = crop_center(image, crop_size)
+    return seeded_region_growing(image, build_seeds(Seed1, Seed2, Seed3, Seed4), connectivity)
+
+def _water_mask(files, ndwi_image, ndwi_threshold, crop_size, service):
+    # Water mask of segment_mask: False on dilated NDWI above the threshold, or 1.0 without one
+    if ndwi_image is None:
+        return 1.0
+    selected = [f for f in files if ndwi_image in f]
+    if len(selected) > 1:
+        raise ValueError("There are multiple files with names matching the image selected for water masking.")
+    if not selected:
+        raise FileNotFoundError("Provided raster for water mask not found.")
+    ndwi = service.select(selected[0], 5, 4, None, lossless=True)
+    water_mask = ~dilate(ndwi > ndwi_threshold)
+    if crop_size is not None:
+        water_mask = crop_center(water_mask, crop_size)
+    return water_mask
+
+def _validity(service, file, crop_size):
+    # Valid pixels of a scene cropped as its images are, or None when the service has no mask store
+    valid = service.validity(file)
+    if valid is not None and crop_size is not None:
+        valid = crop_center(valid, crop_size)
+    return valid
+
+def segment_mask(folder, Seed1, Seed2, Seed3=None, Seed4=None, ndvi_threshold=1.0, ndwi_threshold=0.65, ndwi_image=None, crop_size=None, mods=None, connectivity=8, service=None, incremental=False, margin=3, heatmap=False, min_valid=0.0):
+    """
+    Segment every scene of a site folder with the monotonic-area constraint of segment_mask in
+    Julia_Segment.jl.
+
+    Scenes are segmented from the latest to the earliest. A scene whose region is larger than
+    that of the following date is instead counted as the pixels of the last accepted mask with
+    scaled NDVI above ndvi_threshold.
+
+    Parameters:
+    - folder: Site folder of Sentinel2_YYYY-MM-DD.tif scenes.
+    - Seed1, Seed2, Seed3, Seed4: 0-based (row, column) seeds; see segment_image.
+    - ndvi_threshold: Threshold on the NDVI scaled to [0, 1]; 1.0 uses the NDVI values directly.
+    - ndwi_threshold: Threshold on the scaled NDWI of ndwi_image for the water mask.
+    - ndwi_image: Part of the file name of the scene used for the water mask, e.g. a date.
+    - crop_size, mods, connectivity: See segment_image.
+    - service: Optional Select_Bands.BandService to reuse between calls. With a mask store, only
+      valid pixels are counted.
+    - incremental: Whether to regrow each date only near the previous date's region; see
+      segment_window.
+    - margin: Growth margin in pixels of the incremental mode.
+    - heatmap: Whether to also return how many dates each pixel was counted in.
+    - min_valid: With a mask store, dates with a smaller fraction of valid pixels are left out.
+
+    Returns:
+    - List of (date, pixels) in date order, and with heatmap an int32 (height, width) array.
+    """
+    result = sweep_mask(folder, Seed1, Seed2, Seed3, Seed4, [ndvi_threshold], ndwi_threshold, ndwi_image,
+                        crop_size, mods, connectivity, service, incremental=incremental, margin=margin,
+                        return_heatmaps=heatmap, min_valid=min_valid)
+    if heatmap:
+        sweep, heatmaps = result
+        return sweep[ndvi_threshold], heatmaps[0]
+    return result[ndvi_threshold]
+
+def sweep_mask(folder, Seed1, Seed2, Seed3=None, Seed4=None, thresholds=(1.0,), ndwi_threshold=0.65, ndwi_image=None, crop_size=None, mods=None, connectivity=8, service=None, return_masks=False, incremental=False, margin=3, return_heatmaps=False, min_valid=0.0):
+    """
+    Run segment_mask for several ndvi_threshold values at once.
+
+    Only the NDVI count inside the previous mask depends on the threshold, so the band
+    selection, RGB segmentation and water mask are computed once per date. The NDVI values
+    inside each mask in use are sorted once, and the counts of all thresholds are read from
+    them with a single searchsorted, so a sweep costs about as much as one segment_mask run.
+
+    Parameters:
+    - thresholds: ndvi_threshold values; see segment_mask for the other parameters.
+    - crop_size: Required when the scenes differ in size, as masks are carried between dates.
+    - return_masks: Whether to also return the mask of every date and threshold. Masks always
+      exclude water, while the pixel counts of accepted dates do not, as in segment_mask.
+    - incremental, margin: Regrow each date's RGB segmentation only near the previous date's;
+      see segment_window. The windows come from the RGB segmentations, so they are shared by
+      all thresholds.
+    - return_heatmaps: Whether to also return, for every threshold, how many dates each pixel
+      was counted in, accumulated in one preallocated counter.
+    - min_valid: With a mask store in service, dates whose valid fraction is below min_valid are
+      left out before segmenting; on the others only valid pixels are counted, while the masks
+      carried to the next date keep their cloudy pixels.
+
+    Returns:
+    - Dictionary {threshold: list of (date, pixels) in date order}, followed with return_masks
+      by a boolean (date, threshold, height, width) array in the same date order, and with
+      return_heatmaps by an int32 (threshold, height, width) array.
+    """
+    files = sorted(glob.glob(os.path.join(folder, "*.tif")), key=parse_date, reverse=True)
+    if not files:
+        raise FileNotFoundError(f"No GeoTIFFs found in {folder}.")
+    service = BandService() if service is None else service
+    water_mask = _water_mask(files, ndwi_image, ndwi_threshold, crop_size, service)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    binarized = thresholds < 1.0
+
+    dates = []
+    counts = np.empty((len(files), len(thresholds)), dtype=np.int64)
+    # Accepted masks by date index, and the date index of the mask in use for every threshold
+    masks = {}
+    current = np.full(len(thresholds), -1)
+    stack = heatmaps = result = shape = None
+    for file in files:
+        valid = _validity(service, file, crop_size)
+        # Skip mostly cloudy or empty scenes before reading and segmenting them
+        if valid is not None and (not valid.any() or np.count_nonzero(valid) < min_valid * valid.size):
+            continue
+        d = len(dates)
+        dates.append(parse_date(file))
+        result = segment_image(service.select(file, 1, 2, 3), Seed1, Seed2, Seed3, Seed4, connectivity, crop_size, mods,
+                               previous=result if incremental else None, margin=margin)
+        if shape is None:
+            shape = result.mask.shape
+        elif result.mask.shape != shape:
+            # Masks are carried between dates, so every date must be segmented on the same grid
+            raise ValueError(f"{os.path.basename(file)} is segmented at {result.mask.shape} but other scenes of "
+                             f"{folder} at {shape}; set a crop_size no larger than the smallest scene.")
+        pixels = result.count if valid is None else int(np.count_nonzero(result.mask & valid))
+        if return_masks and stack is None:
+            stack = np.zeros((len(files), len(thresholds), *result.mask.shape), dtype=bool)
+        if return_heatmaps and heatmaps is None:
+            heatmaps = np.zeros((len(thresholds), *result.mask.shape), dtype=np.int32)
+
+        accepted = np.ones(len(thresholds), dtype=bool) if d == 0 else pixels <= counts[d - 1]
+        counts[d, accepted] = pixels
+        if accepted.any():
+            with stage('mask update'):
+                masks[d] = (result.mask * water_mask) != 0
+                current[accepted] = d
+                counted = masks[d] if valid is None else masks[d] & valid
+                if return_masks:
+                    stack[d, accepted] = counted
+                if return_heatmaps:
+                    heatmaps[accepted] += counted
+        if accepted.all():
+            continue
+
+        ndvi = service.select(file, 4, 1, None, lossless=True)
+        if crop_size is not None:
+            ndvi = crop_center(ndvi, crop_size)
+        with stage('mask update'):
+            for m in np.unique(current[~accepted]):
+                selected = ~accepted & (current == m)
+                inside = masks[m] if valid is None else masks[m] & valid
+                # Sorted NDVI inside the mask gives the count above every threshold at once
+                values = np.sort(ndvi[inside], axis=None)
+                above = len(values) - np.searchsorted(values.astype(np.float64), thresholds[selected], side='right')
+                counts[d, selected] = np.where(binarized[selected], above, np.count_nonzero(values))
+                if return_masks or return_heatmaps:
+                    above_masks = ndvi.astype(np.float64) > thresholds[selected][:, np.newaxis, np.newaxis]
+                    above_masks[~binarized[selected]] = ndvi != 0
+                    above_masks &= inside
+                    if return_masks:
+                        stack[d, selected] = above_masks
+                    if return_heatmaps:
+                        heatmaps[selected] += above_masks
+
+    if not dates:
+        raise ValueError(f"No scene in {folder} has a valid fraction of at least {min_valid}.")
+    counts = counts[:len(dates)]
+    order = np.argsort(dates)
+    sweep = {float(t): [(dates[d], int(counts[d, i])) for d in order] for i, t in enumerate(thresholds)}
+    if not return_masks and not return_heatmaps:
+        return sweep
+    returned = (sweep,)
+    if return_masks:
+        returned += (stack[:len(dates)][order],)
+    if return_heatmaps:
+        returned += (heatmaps,)
+    return returned
+
+def segment_ndvi(folder, Seed1, Seed2, Seed3=None, Seed4=None, ndvi_threshold=0.5, crop_size=None, connectivity=8, service=None, min_valid=0.0):
+    """
+    Segment every scene of a site folder on its NDVI binarized at ndvi_threshold.
+
+    Pixels with scaled NDVI below the threshold form the candidate region, as count_pixels with
+    ndvi_threshold in Julia_Segment.jl.
+
+    Returns:
+    - List of (date, pixels) in date order.
+    """
+    sweep = sweep_ndvi(folder, Seed1, Seed2, Seed3, Seed4, [ndvi_threshold], crop_size, connectivity, service, min_valid)
+    return sweep[ndvi_threshold]
+
+def sweep_ndvi(folder, Seed1, Seed2, Seed3=None, Seed4=None, thresholds=(0.5,), crop_size=None, connectivity=8, service=None, min_valid=0.0):
+    """
+    Run segment_ndvi for several ndvi_threshold values at once.
+
+    Each scene's NDVI is read once. Thresholds with no NDVI value between them binarize the
+    scene identically, so each distinct binary image is segmented only once. With a mask store
+    in service, dates whose valid fraction is below min_valid are left out and only valid
+    pixels are counted.
+
+    Returns:
+    - Dictionary {threshold: list of (date, pixels) in date order}.
+    """
+    files = sorted(glob.glob(os.path.join(folder, "*.tif")), key=parse_date)
+    service = BandService() if service is None else service
+    sweep = {float(t): [] for t in thresholds}
+    for file in files:
+        date = parse_date(file)
+        valid = _validity(service, file, crop_size)
+        if valid is not None and (not valid.any() or np.count_nonzero(valid) < min_valid * valid.size):
+            continue
+        ndvi = service.select(file, 4, 1, None, lossless=True)
+        if crop_size is not None:
+            ndvi = crop_center(ndvi, crop_size)
+        values = np.sort(ndvi, axis=None).astype(np.float64)
+        segmented = {}
+        for t in sweep:
+            # The number of values below the threshold identifies the binary image
+            key = int(np.searchsorted(values, t, side='left'))
+            if key not in segmented:
+                result = segment_image(ndvi, Seed1, Seed2, Seed3, Seed4, connectivity, ndvi_threshold=t)
+                segmented[key] = result.count if valid is None else int(np.count_nonzero(result.mask & valid))
+            sweep[t].append((date, segmented[key]))
+    return sweep
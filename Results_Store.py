@@ -0,0 +1,120 @@
+import os
+import glob
+import json
+import uuid
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Typed columns of segmentation results, a superset of the Output/Threshold_*_Results.csv columns
+RESULT_SCHEMA = pa.schema([
+    ('ID', pa.string()),
+    ('Date', pa.date32()),
+    ('Threshold', pa.float64()),
+    ('Pixels', pa.int64()),
+    ('Year', pa.int16()),
+    ('Month', pa.int8()),
+    ('Latitude', pa.float64()),
+    ('Longitude', pa.float64()),
+    ('Area_m2', pa.float64()),
+])
+
+LEDGER_NAME = "_done.jsonl"
+
+class ResultsSink:
+    """
+    Streaming Parquet sink for segmentation results.
+
+    Rows are buffered and written in batches as new Parquet files of a hive-partitioned
+    dataset (root/ID=s002/part-....parquet), sorted by Date and Threshold so row-group
+    statistics let reads skip data on those columns too. Existing files are never rewritten.
+
+    Cells written with a batch are recorded, together with the batch's files, in a ledger in
+    the dataset folder once the files are complete. Files not in the ledger are left over from
+    an interrupted batch and are removed when the sink is opened, so a restarted run can skip
+    exactly the completed cells.
+
+    Parameters:
+    - root: Dataset folder.
+    - schema: Arrow schema of the rows.
+    - partition_cols: Columns to partition by, e.g. ('ID',) or ('ID', 'Threshold').
+    - batch_rows: Number of buffered rows that triggers a write.
+    """
+    def __init__(self, root, schema=RESULT_SCHEMA, partition_cols=('ID',), batch_rows=50000):
+        self.root = root
+        self.schema = schema
+        self.partition_cols = list(partition_cols)
+        self.batch_rows = batch_rows
+        self.rows = []
+        self.cells = []
+        self.completed = set()
+        os.makedirs(root, exist_ok=True)
+        self._recover()
+
+    def _recover(self):
+        # Read the ledger and remove files of batches that never completed
+        files = set()
+        ledger_path = os.path.join(self.root, LEDGER_NAME)
+        if os.path.exists(ledger_path):
+            with open(ledger_path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        files.update(entry['files'])
+                        self.completed.update(tuple(cell) for cell in entry['cells'])
+        for path in glob.glob(os.path.join(self.root, "**", "part-*.parquet"), recursive=True):
+            if os.path.relpath(path, self.root) not in files:
+                os.remove(path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def write(self, rows, cells=()):
+        """
+        Buffer result rows, and the cells they complete, writing a batch when enough rows are buffered.
+        """
+        self.rows.extend(rows)
+        self.cells.extend(cells)
+        if len(self.rows) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows as new Parquet files and record their cells as completed.
+        """
+        if not self.rows and not self.cells:
+            return
+        written = []
+        if self.rows:
+            table = pa.Table.from_pylist(self.rows, schema=self.schema)
+            sort_keys = [(name, 'ascending') for name in ('Date', 'Threshold') if name in self.schema.names]
+            table = table.sort_by(sort_keys)
+            pq.write_to_dataset(table, self.root, partition_cols=self.partition_cols,
+                                basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+                                file_visitor=lambda written_file: written.append(os.path.relpath(written_file.path, self.root)))
+        with open(os.path.join(self.root, LEDGER_NAME), 'a') as ledger:
+            ledger.write(json.dumps({'cells': [list(cell) for cell in self.cells], 'files': written}) + '\n')
+        self.completed.update(tuple(cell) for cell in self.cells)
+        self.rows = []
+        self.cells = []
+
+def read_results(root, filters=None, columns=None, schema=RESULT_SCHEMA):
+    """
+    Read a results dataset into a DataFrame, loading only the matching partitions and row groups.
+
+    Parameters:
+    - root: Dataset folder written by ResultsSink.
+    - filters: Optional filters as a list of (column, operator, value) tuples, e.g.
+      [('ID', '=', 's002'), ('Threshold', '>=', 0.4)].
+    - columns: Optional list of columns to read.
+    - schema: Schema to read with, so files written before a column was added read it as null.
+
+    Returns:
+    - pandas DataFrame with Date as datetime64.
+    """
+    table = pq.read_table(root, filters=filters, columns=columns, schema=schema,
+                          partitioning=ds.HivePartitioning.discover(infer_dictionary=False))
+    return table.to_pandas(date_as_object=False)
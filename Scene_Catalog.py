@@ -0,0 +1,188 @@
+import os
+import re
+import glob
+import json
+import rasterio
+from rasterio.transform import Affine
+from rasterio.warp import transform as warp_transform
+
+from Datacube import parse_date
+
+# Site ID in folder names such as Data/Sentinel-s003
+SITE_PATTERN = re.compile(r'Sentinel-(s\d+)')
+
+CATALOG_NAME = "catalog.json"
+
+# Version 2 records add the geotransform and pixel area; older catalogs are re-read on refresh
+CATALOG_VERSION = 2
+
+def pixel_area(transform):
+    """
+    Return the area of one pixel of a geotransform in squared CRS units, m² for the UTM exports.
+    """
+    transform = Affine(*transform[:6])
+    return abs(transform.a * transform.e - transform.b * transform.d)
+
+class SceneCatalog:
+    """
+    Index of the downloaded GeoTIFFs under a data folder by site, acquisition date, band list,
+    scale and area of interest, with each scene's grid: CRS, geotransform, size and pixel area.
+
+    Only file headers are read, and only for files that are new or changed since the last
+    refresh, so keeping the catalog current costs one directory listing per site.
+
+    Parameters:
+    - root: Data folder containing the Sentinel-sXXX site folders.
+    - path: Catalog file. Defaults to catalog.json inside root.
+    """
+    def __init__(self, root="Data", path=None):
+        self.root = root
+        self.path = os.path.join(root, CATALOG_NAME) if path is None else path
+        self.records = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                catalog = json.load(f)
+            if catalog.get('version') == CATALOG_VERSION:
+                self.records = catalog['scenes']
+        self._by_date = None
+
+    def refresh(self, pattern="Sentinel-s*"):
+        """
+        Add new or changed GeoTIFFs to the catalog and drop records of deleted ones, then save it.
+
+        Returns:
+        - Number of files whose headers were read.
+        """
+        seen = set()
+        read = 0
+        for folder in sorted(glob.glob(os.path.join(self.root, pattern))):
+            match = SITE_PATTERN.search(os.path.basename(folder))
+            if match is None or not os.path.isdir(folder):
+                continue
+            for tiff_file in sorted(glob.glob(os.path.join(folder, "*.tif"))):
+                key = os.path.relpath(tiff_file, self.root)
+                seen.add(key)
+                mtime_ns = os.stat(tiff_file).st_mtime_ns
+                record = self.records.get(key)
+                if record is not None and record['mtime_ns'] == mtime_ns:
+                    continue
+                self.records[key] = self._read_record(tiff_file, match.group(1), mtime_ns)
+                read += 1
+
+        for key in [key for key in self.records if key not in seen]:
+            del self.records[key]
+        self._by_date = None
+        self.save()
+        return read
+
+    def _read_record(self, tiff_file, site, mtime_ns):
+        # Catalog record of one GeoTIFF from its header
+        with rasterio.open(tiff_file) as src:
+            bands = list(src.descriptions) if all(src.descriptions) else None
+            return {
+                'site': site,
+                'date': parse_date(tiff_file).isoformat(),
+                'bands': bands,
+                'scale': src.transform[0],
+                'crs': str(src.crs),
+                'bounds': list(src.bounds),
+                'transform': list(src.transform)[:6],
+                'pixel_area': pixel_area(src.transform),
+                'width': src.width,
+                'height': src.height,
+                'mtime_ns': mtime_ns,
+            }
+
+    def save(self):
+        # Write to a temporary file first so an interrupted save never truncates the catalog
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'version': CATALOG_VERSION, 'scenes': self.records}, f, indent=1, sort_keys=True)
+        os.replace(self.path + '.tmp', self.path)
+
+    def query(self, site=None, start=None, end=None, bands=None, scale=None):
+        """
+        Return the catalog records matching every given criterion, sorted by site and date.
+
+        Parameters:
+        - site: Site ID, e.g. s003.
+        - start, end: Inclusive date bounds as YYYY-MM-DD strings.
+        - bands: Required band list, e.g. ['B4', 'B3', 'B2', 'B8', 'B11'].
+        - scale: Required pixel size in meters.
+
+        Returns:
+        - List of records, each with its file path under 'file'.
+        """
+        matches = []
+        for key, record in self.records.items():
+            if site is not None and record['site'] != site:
+                continue
+            if start is not None and record['date'] < str(start):
+                continue
+            if end is not None and record['date'] > str(end):
+                continue
+            if not self._matches(record, bands, scale):
+                continue
+            matches.append(dict(record, file=os.path.join(self.root, key)))
+        return sorted(matches, key=lambda record: (record['site'], record['date']))
+
+    def _matches(self, record, bands, scale):
+        # Whether a record has the required bands and scale; records without band names match any
+        if bands is not None and record['bands'] is not None and record['bands'] != list(bands):
+            return False
+        return scale is None or abs(record['scale'] - scale) <= 1e-6
+
+    def scene(self, site, date):
+        """
+        Return the record of a site's scene on a date, with its file path under 'file', or None.
+
+        Lookups go through a (site, date) index built once, so per-row queries stay cheap.
+        """
+        if self._by_date is None:
+            self._by_date = {(record['site'], record['date']): key for key, record in self.records.items()}
+        key = self._by_date.get((site, str(date)))
+        return None if key is None else dict(self.records[key], file=os.path.join(self.root, key))
+
+    def pixel_areas(self, site):
+        """
+        Return the pixel area of every scene of a site as {'YYYY-MM-DD': area}.
+        """
+        return {record['date']: record['pixel_area'] for record in self.records.values() if record['site'] == site}
+
+    def covers(self, record, latitude, longitude, buffer_size):
+        """
+        Check whether a cataloged scene covers the buffer around a point, within one pixel.
+        """
+        (x,), (y,) = warp_transform('EPSG:4326', record['crs'], [longitude], [latitude])
+        left, bottom, right, top = record['bounds']
+        margin = buffer_size - record['scale']
+        return left <= x - margin and x + margin <= right and bottom <= y - margin and y + margin <= top
+
+    def has(self, site, date, bands=None, scale=None, latitude=None, longitude=None, buffer_size=None):
+        """
+        Check whether a scene of a site and date with the given bands, scale and area is on disk.
+        The area is only checked when latitude, longitude and buffer_size are all given. The scene
+        is looked up through the (site, date) index of scene, so checking many jobs stays cheap.
+        """
+        record = self.scene(site, date)
+        if record is None or not self._matches(record, bands, scale):
+            return False
+        if latitude is None or longitude is None or buffer_size is None:
+            return True
+        return self.covers(record, latitude, longitude, buffer_size)
+
+    def missing(self, jobs, sites, bands, scale, buffer_size):
+        """
+        Filter export jobs of Sentinel_Export.ExportOrchestrator down to scenes not yet on disk.
+
+        Parameters:
+        - jobs: Planned export jobs with 'site' and 'date'.
+        - sites: Site manifest entries with ID, Latitude and Longitude.
+        - bands, scale, buffer_size: Export settings the cataloged scenes must match.
+        """
+        locations = {site['ID']: site for site in sites}
+        remaining = []
+        for job in jobs:
+            site = locations[job['site']]
+            if not self.has(job['site'], job['date'], bands, scale, site['Latitude'], site['Longitude'], buffer_size):
+                remaining.append(job)
+        return remaining
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from Batch_Segment import load_config, auto_seed
+from Manual_Polygons import PolygonStore, scene_grid
+from Region_Growing import sweep_mask, crop_center
+
+def pack_masks(masks):
+    """
+    Bit-pack boolean masks of shape (..., height, width) to uint8 arrays of shape (..., bytes).
+    """
+    masks = np.asarray(masks, dtype=bool)
+    return np.packbits(masks.reshape(*masks.shape[:-2], -1), axis=-1)
+
+def popcount(packed):
+    """
+    Count the set bits of packed masks along their last axis.
+    """
+    return np.bitwise_count(packed).sum(axis=-1, dtype=np.int64)
+
+def confusion(predicted, reference):
+    """
+    Count true positive, false positive and false negative pixels of mask stacks.
+
+    Both stacks are bit-packed, so every count is a popcount over 8 pixels per byte, and they
+    broadcast against each other, e.g. (date, threshold, H, W) predictions against (date, 1, H,
+    W) references.
+
+    Returns:
+    - Arrays tp, fp, fn with the broadcast leading shape.
+    """
+    predicted, reference = pack_masks(predicted), pack_masks(reference)
+    tp = popcount(predicted & reference)
+    fp = popcount(predicted & ~reference)
+    fn = popcount(~predicted & reference)
+    return tp, fp, fn
+
+def metrics(tp, fp, fn):
+    """
+    Return IoU, Dice, precision, recall and relative area error from pixel counts.
+
+    Ratios with a zero denominator are NaN.
+    """
+    tp, fp, fn = (np.asarray(x, dtype=np.float64) for x in (tp, fp, fn))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'IoU': tp / (tp + fp + fn),
+            'Dice': 2 * tp / (2 * tp + fp + fn),
+            'Precision': tp / (tp + fp),
+            'Recall': tp / (tp + fn),
+            'AreaError': (fp - fn) / (tp + fn),
+        }
+
+def evaluate_site(site, store, data_dir="Data"):
+    """
+    Score the segment_mask sweep of one site against its manual outlines.
+
+    Parameters:
+    - site: Site entry of Batch_Segment.load_config, seeded with auto_seed.
+    - store: Manual_Polygons.PolygonStore.
+    - data_dir: Folder containing the Sentinel-sXXX site folders.
+
+    Returns:
+    - Tidy DataFrame with one row per (date, threshold) that has a manual outline.
+    """
+    seeds = (site['Seed1'], site['Seed2'], site.get('Seed3'), site.get('Seed4'))
+    sweep, predicted = sweep_mask(site['folder'], *seeds, thresholds=site['thresholds'],
+                                  ndwi_threshold=site.get('ndwi_threshold', 0.65), ndwi_image=site.get('ndwi_image'),
+                                  crop_size=site.get('crop_size'), mods=site.get('mods'), return_masks=True)
+    dates = [date.isoformat() for date, _ in sweep[float(site['thresholds'][0])]]
+
+    outlines = {str(store.dates[i]): i for i in np.flatnonzero(store.sites == site['ID'])}
+    matched = [k for k, date in enumerate(dates) if date in outlines]
+    if not matched:
+        return pd.DataFrame()
+
+    # Outlines are rasterized on the grid of their own scene, as scenes of a site can differ in size
+    reference = np.zeros((len(matched), 1, *predicted.shape[2:]), dtype=bool)
+    pixel_area = np.empty((len(matched), 1))
+    for n, k in enumerate(matched):
+        shape, pixel_area[n] = scene_grid(data_dir, site['ID'], dates[k])
+        mask = store.mask(outlines[dates[k]], shape)
+        reference[n, 0] = mask if site.get('crop_size') is None else crop_center(mask, site['crop_size'])
+
+    tp, fp, fn = confusion(predicted[matched], reference)
+    thresholds = np.asarray(site['thresholds'], dtype=np.float64)
+    table = pd.DataFrame({
+        'ID': site['ID'],
+        'Date': pd.to_datetime(np.repeat([dates[k] for k in matched], len(thresholds))),
+        'Threshold': np.tile(thresholds, len(matched)),
+        'TP': tp.ravel(), 'FP': fp.ravel(), 'FN': fn.ravel(),
+        'PredictedArea_m2': ((tp + fp) * pixel_area).ravel(),
+        'ManualArea_m2': ((tp + fn) * pixel_area).ravel(),
+    })
+    for name, values in metrics(tp, fp, fn).items():
+        table[name] = values.ravel()
+    return table
+
+def _evaluate_site(site, store_path, data_dir):
+    # Evaluate one site in a worker process
+    return evaluate_site(site, PolygonStore.load(store_path), data_dir)
+
+def evaluate(config_path, store_path, data_dir="Data", workers=4):
+    """
+    Score every site of a batch segmentation config at every threshold of its grid.
+
+    Parameters:
+    - config_path: Batch_Segment config, e.g. Data/segmentation_sites.json.
+    - store_path: Saved PolygonStore (.npz) of the manual outlines.
+    - data_dir: Folder containing the Sentinel-sXXX site folders.
+    - workers: Number of worker processes, one site per task.
+
+    Returns:
+    - Tidy DataFrame with ID, Date, Threshold, pixel counts, areas and metrics.
+    """
+    sites = load_config(config_path)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        auto_seed(sites, executor)
+        tables = list(executor.map(_evaluate_site, sites, [store_path] * len(sites), [data_dir] * len(sites)))
+    tables = [table for table in tables if len(table)]
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+
+def select_threshold(table, metric='IoU', by=None):
+    """
+    Return the threshold with the best mean of a metric, overall or per group.
+
+    Parameters:
+    - table: Output of evaluate or evaluate_site.
+    - metric: Column to maximize; AreaError is minimized in absolute value instead.
+    - by: Optional column, e.g. 'ID', to choose a threshold per group.
+
+    Returns:
+    - DataFrame with the chosen Threshold and its mean metric, per group when by is given.
+    """
+    table = table.assign(Score=table[metric].abs() if metric == 'AreaError' else table[metric])
+    groups = ['Threshold'] if by is None else [by, 'Threshold']
+    means = table.groupby(groups, as_index=False)['Score'].mean()
+    best = means['Score'].idxmin() if metric == 'AreaError' else means['Score'].idxmax()
+    if by is None:
+        return means.loc[[best]].rename(columns={'Score': metric}).reset_index(drop=True)
+    chosen = means.groupby(by)['Score'].idxmin() if metric == 'AreaError' else means.groupby(by)['Score'].idxmax()
+    return means.loc[chosen].rename(columns={'Score': metric}).reset_index(drop=True)
@@ -2,50 +2,162 @@ import numpy as np
 import rasterio
 from PIL import Image
 
+from Product_Store import load_index
+from Normalization import StretchCache, apply_stretch
+from Instrumentation import stage, count
+
+def scaled_index(band1, band2):
+    """
+    Return the normalized difference of two float32 bands shifted from [-1, 1] to [0, 1].
+    """
+    # Calculate the normalized difference index
+    normalized_index = (band1 - band2) / (band1 + band2 + 1e-10)  # Add small value to avoid division by zero
+
+    # Shift to range [0, 1]
+    return (normalized_index + 1) / 2
+
+def band_image(bands, three_band, limits=None):
+    """
+    Build the select_bands image from a (band, height, width) float32 array of the selected bands.
+
+    Parameters:
+    - bands: The two bands of a normalized difference, or the three bands of a composite.
+    - three_band: Whether bands holds a three-band composite.
+    - limits: Optional (low, high) per-band limits of a composite, e.g. from
+      Normalization.StretchCache.limits, replacing the stretch by the composite's maximum.
+
+    Returns:
+    - uint8 array of shape (height, width) or (height, width, 3).
+    """
+    if not three_band:
+        # Normalize to range [0, 1] for display
+        normalized_index_scaled = scaled_index(bands[0], bands[1])
+
+        # Convert to uint8
+        return (normalized_index_scaled * 255).astype(np.uint8)
+
+    if limits is not None:
+        return (apply_stretch(bands, *limits).transpose(1, 2, 0) * 255).astype(np.uint8)
+
+    # Stack the selected bands into an image
+    stacked_image = np.stack(list(bands), axis=-1)
+
+    # Normalize the image to the range [0, 1] for display
+    stacked_normalized = stacked_image / np.max(stacked_image)
+
+    # Convert to uint8
+    return (stacked_normalized * 255).astype(np.uint8)
+
+def select_bands_array(file_path, bandA, bandB, bandC):
+    """
+    Return the select_bands image of a file as a uint8 array instead of saving it.
+    """
+    bands = [bandA, bandB] if bandC is None else [bandA, bandB, bandC]
+    with stage('read'), rasterio.open(file_path) as src:
+        selected = src.read(bands, out_dtype=np.float32)
+    count('read', bytes_read=selected.nbytes)
+    return band_image(selected, bandC is not None)
+
 def select_bands(file_path, bandA, bandB, bandC, output_path):
     bands = [bandA,bandB,bandC]
-    with rasterio.open(file_path) as src:
-        # Ensure bands is treated as an iterable list
-        if not hasattr(bands, '__iter__'):
-            raise TypeError("Bands must be an iterable.")
-            
-        if bandC is None:
-            # Read the specified bands for NDVI-like calculation
-            band1 = src.read(bands[0]).astype(np.float32)
-            band2 = src.read(bands[1]).astype(np.float32)
+    # Ensure bands is treated as an iterable list
+    if not hasattr(bands, '__iter__'):
+        raise TypeError("Bands must be an iterable.")
 
-            # Calculate the normalized difference index
-            normalized_index = (band1 - band2) / (band1 + band2 + 1e-10)  # Add small value to avoid division by zero
+    if bandC is None:
+        # Create a grayscale image from the normalized difference index
+        final_image = Image.fromarray(select_bands_array(file_path, bandA, bandB, None))
 
-            # Normalize to range [0, 1] for display
-            normalized_index_scaled = (normalized_index + 1) / 2  # Shift to range [0, 1]
+    elif len(bands) == 3:
+        # Create an RGB image from the selected bands
+        final_image = Image.fromarray(select_bands_array(file_path, bandA, bandB, bandC))
 
-            # Convert to uint8
-            normalized_index_uint8 = (normalized_index_scaled * 255).astype(np.uint8)
+    else:
+        raise ValueError("Please specify either two bands for NDVI-like normalization or three bands for RGB image.")
 
-            # Create a grayscale image from the array
-            final_image = Image.fromarray(normalized_index_uint8)
+    # Save as JPEG
+    final_image.save(output_path, format='JPEG')
 
-        elif len(bands) == 3:
-            # Create a list to hold the selected bands for RGB image
-            selected_bands = [src.read(band).astype(np.float32) for band in bands]
+    return output_path
 
-            # Stack the selected bands into an image
-            stacked_image = np.stack(selected_bands, axis=-1)
+class BandService:
+    """
+    Long-lived band selection service for repeated calls from Julia through PyCall.
 
-            # Normalize the image to the range [0, 1] for display
-            stacked_normalized = stacked_image / np.max(stacked_image)
+    The module is imported once and every product is returned as a NumPy array, which PyCall
+    wraps as a PyArray without copying, so callers skip both the per-call module execution and
+    the temporary JPEG. The stack of the most recent scene is kept, so several products of the
+    same scene (e.g. RGB and NDVI) share a single read.
 
-            # Convert to uint8
-            stacked_normalized_uint8 = (stacked_normalized * 255).astype(np.uint8)
+    Lossless selections of two bands come from the float product store written by
+    process_folder(store=...) when available, and are otherwise computed from the stack.
 
-            # Create an RGB image from the array
-            final_image = Image.fromarray(stacked_normalized_uint8)
+    Parameters:
+    - stretch: Optional Normalization.Stretch of three-band composites. With site scope every
+      date of a site is stretched alike, so segmentation inputs are comparable between dates.
+    - mask: Optional Quality_Mask.MaskStore providing the valid pixels of each scene, with which
+      segmentation counts leave out clouds, shadows and no data.
+    """
+    def __init__(self, stretch=None, mask=None):
+        self.file_path = None
+        self.stack = None
+        self.stretch = stretch
+        self.cache = StretchCache()
+        self.mask = mask
 
-        else:
-            raise ValueError("Please specify either two bands for NDVI-like normalization or three bands for RGB image.")
+    def read(self, file_path):
+        """
+        Return the float32 (band, height, width) stack of a file, reading it only if it changed.
+        """
+        if file_path != self.file_path:
+            with stage('read'), rasterio.open(file_path) as src:
+                self.stack = src.read(out_dtype=np.float32)
+            count('read', bytes_read=self.stack.nbytes)
+            self.file_path = file_path
+        return self.stack
 
-        # Save as JPEG
-        final_image.save(output_path, format='JPEG')
+    def select(self, file_path, bandA, bandB, bandC, lossless=False):
+        """
+        Return the select_bands image of a file as a uint8 array.
 
-    return output_path
+        With lossless=True a two-band selection is returned as float32 values in [0, 1] instead,
+        on the same scale as the uint8 image divided by 255, so existing thresholds still apply.
+        """
+        if bandC is None and lossless:
+            stored = load_index(file_path, bandA, bandB)
+            if stored is not None:
+                # Masked pixels are stored as NaN; they scale like the zeroed bands of a computed index
+                return np.nan_to_num((stored + 1) / 2, nan=0.5)
+            stack = self.read(file_path)
+            return scaled_index(stack[bandA - 1], stack[bandB - 1])
+
+        stack = self.read(file_path)
+        if bandC is None:
+            return band_image(stack[[bandA - 1, bandB - 1]], False)
+        bands = [bandA, bandB, bandC]
+        limits = None
+        if self.stretch is not None:
+            limits = self.cache.limits(file_path, self.stretch, bands, stack)
+        return band_image(stack[[band - 1 for band in bands]], True, limits)
+
+    def validity(self, file_path):
+        """
+        Return the boolean validity mask of a file, or None without a mask store.
+
+        Masks are cached next to the scenes, so the file is only read the first time, and then
+        through read, so that the following selections of the file reuse its stack.
+        """
+        if self.mask is None:
+            return None
+        return self.mask.mask(file_path, lambda: self.read(file_path))
+
+    def select_many(self, file_path, band_sets):
+        """
+        Return the images of several (bandA, bandB, bandC) selections of one file in one call.
+        """
+        return [self.select(file_path, *band_set) for band_set in band_sets]
+
+    def clear(self):
+        # Release the cached stack
+        self.file_path = None
+        self.stack = None
@@ -4,9 +4,13 @@ import rasterio
 import numpy as np
 import matplotlib.pyplot as plt
 
+from Instrumentation import stage
+from Normalization import band_histograms, histogram_percentiles
+from Sentinel_Export import EXPORT_BANDS, QUALITY_BANDS
+
 ee.Initialize()
 
-def sentinel_imagery(latitude, longitude, years, folder_path, start_month=6, end_month=9, buffer_size=500):
+def sentinel_imagery(latitude, longitude, years, folder_path, start_month=6, end_month=9, buffer_size=500, site_id=None, catalog=None, cloud_threshold=10, quality_bands=False):
     """
     Export Sentinel-2 images with the lowest cloud cover for each week from June to September for specified years.
     
@@ -18,7 +22,15 @@ def sentinel_imagery(latitude, longitude, years, folder_path, start_month=6, end
     - end_month: Ending month of the range (inclusive).
     - buffer_size: Buffer size in meters around the point.
     - folder_path: Google Drive folder path for exports.
+    - site_id: Site ID, e.g. s003, used to look scenes up in the catalog.
+    - catalog: Optional Scene_Catalog.SceneCatalog; scenes already downloaded for the site are not exported again.
+    - cloud_threshold: Maximum scene-level CLOUDY_PIXEL_PERCENTAGE.
+    - quality_bands: Whether to also export the SCL and QA60 bands, from which
+      Quality_Mask masks clouds, shadows and no data per pixel. A higher cloud_threshold
+      then keeps more scenes without their clouds counting as area.
     """
+    bands = EXPORT_BANDS + QUALITY_BANDS if quality_bands else EXPORT_BANDS
+
     # Create a point geometry
     point = ee.Geometry.Point([longitude, latitude])
     
@@ -54,13 +66,13 @@ def sentinel_imagery(latitude, longitude, years, folder_path, start_month=6, end
         sentinel2 = ee.ImageCollection('COPERNICUS/S2_SR_HARMONIZED') \
             .filterBounds(buffered_area) \
             .filterDate(start_date, end_date) \
-            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 10))
+            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', cloud_threshold))
 
         # image.date().format("YYYY-MM-dd")
 
         # Cast the image to UInt16 to ensure consistent data types and select RGB and NIR bands
         def cast_to_uint16(image):
-            return image.select(['B4', 'B3', 'B2', 'B8', 'B11']).toUint16()
+            return image.select(bands).toUint16()
 
         # Get the images with the lowest cloud cover for each week
         weekly_images = [cast_to_uint16(img) for img in get_lowest_cloud_day(sentinel2) if img]
@@ -70,17 +82,21 @@ def sentinel_imagery(latitude, longitude, years, folder_path, start_month=6, end
             # Get the date from the image's metadata
             try:
                 image_date = ee.Date(image.get('system:time_start')).format('YYYY-MM-dd').getInfo()
+                if catalog is not None and catalog.has(site_id, image_date, bands, 10, latitude, longitude, buffer_size):
+                    print("Skipping image already downloaded with date:", image_date)
+                    continue
                 print("Exporting image with date:", image_date)
 
-                task = ee.batch.Export.image.toDrive(
-                    image=image,
-                    description=f'Sentinel2_{image_date}',
-                    scale=10,  # Sentinel-2 images have a resolution of 10 meters
-                    region=buffered_area.getInfo()['coordinates'],
-                    fileFormat='GeoTIFF',
-                    folder=folder_path
-                )
-                task.start()
+                with stage('export', items=1):
+                    task = ee.batch.Export.image.toDrive(
+                        image=image,
+                        description=f'Sentinel2_{image_date}',
+                        scale=10,  # Sentinel-2 images have a resolution of 10 meters
+                        region=buffered_area.getInfo()['coordinates'],
+                        fileFormat='GeoTIFF',
+                        folder=folder_path
+                    )
+                    task.start()
             except Exception as e:
                 print("Error retrieving image date. Likely no images below the cloud threshold.", e)
 
@@ -140,9 +156,13 @@ def normalize(image, stretch_percent):
     Returns:
     - Normalized image.
     """
-    # Compute the stretch limits
-    lower_percentile = np.percentile(image, stretch_percent)
-    upper_percentile = np.percentile(image, 100 - stretch_percent)
+    # Compute the stretch limits, from one histogram of every value for uint16 and uint8 images
+    if image.dtype in (np.uint16, np.uint8):
+        histogram = band_histograms(image.reshape(1, -1))[0]
+        lower_percentile, upper_percentile = histogram_percentiles(histogram, [stretch_percent, 100 - stretch_percent])
+    else:
+        lower_percentile = np.percentile(image, stretch_percent)
+        upper_percentile = np.percentile(image, 100 - stretch_percent)
     
     # Stretch the image to the 0-1 range
     image = np.clip((image - lower_percentile) / (upper_percentile - lower_percentile), 0, 1)
@@ -0,0 +1,370 @@
+import csv
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from Instrumentation import stage
+
+# Sentinel-2 collection and bands exported by Sentinel_Download.sentinel_imagery
+COLLECTION = 'COPERNICUS/S2_SR_HARMONIZED'
+EXPORT_BANDS = ['B4', 'B3', 'B2', 'B8', 'B11']
+
+# Optional per-pixel quality bands appended after EXPORT_BANDS: the Scene Classification Layer
+# and the QA60 cloud bitmask, read by Quality_Mask
+QUALITY_BANDS = ['SCL', 'QA60']
+
+# Earth Engine task states after which a task no longer changes
+TERMINAL_STATES = ('COMPLETED', 'FAILED', 'CANCELLED')
+
+def load_sites(path):
+    """
+    Load a site manifest CSV with ID, Latitude and Longitude columns, e.g. Data/sites.csv.
+
+    Returns:
+    - List of {'ID', 'Latitude', 'Longitude'} dictionaries in file order.
+    """
+    with open(path, newline='') as f:
+        return [{'ID': row['ID'], 'Latitude': float(row['Latitude']), 'Longitude': float(row['Longitude'])}
+                for row in csv.DictReader(f)]
+
+def with_retry(function, retries=3, backoff=2.0, sleep=time.sleep):
+    """
+    Call function, retrying with exponential backoff when it raises.
+
+    Parameters:
+    - function: Callable taking no arguments.
+    - retries: Number of retries after the first attempt.
+    - backoff: Delay in seconds before the first retry; doubled after every retry.
+    - sleep: Function used to wait, replaceable for tests.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return function()
+        except Exception:
+            if attempt == retries:
+                raise
+            sleep(backoff * 2 ** attempt)
+
+def week_starts(start_date, end_date):
+    """
+    Return the start of every 7-day window from start_date up to end_date, as in
+    Sentinel_Download.sentinel_imagery.
+    """
+    starts = []
+    start = datetime.datetime.strptime(start_date, '%Y-%m-%d')
+    end = datetime.datetime.strptime(end_date, '%Y-%m-%d')
+    while start < end:
+        starts.append(start)
+        start += datetime.timedelta(days=7)
+    return starts
+
+def weekly_least_cloudy(times, clouds, ids, start_date, end_date):
+    """
+    Select the least cloudy image of each week from collection metadata, client side.
+
+    Parameters:
+    - times: system:time_start of every image, in milliseconds.
+    - clouds: CLOUDY_PIXEL_PERCENTAGE of every image.
+    - ids: system:index of every image.
+    - start_date, end_date: Season bounds as YYYY-MM-DD strings.
+
+    Returns:
+    - List of (date string, system:index) for the weeks that have an image, in date order.
+    """
+    selected = []
+    for start in week_starts(start_date, end_date):
+        low = start.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000
+        high = low + 7 * 24 * 3600 * 1000
+        week = [i for i, t in enumerate(times) if low <= t < high]
+        if not week:
+            continue
+        best = min(week, key=lambda i: clouds[i])
+        date = datetime.datetime.fromtimestamp(times[best] / 1000, tz=datetime.timezone.utc)
+        selected.append((date.strftime('%Y-%m-%d'), ids[best]))
+    return selected
+
+class ExportOrchestrator:
+    """
+    Plan, submit and track Sentinel-2 exports for many sites and years.
+
+    Compared with calling sentinel_imagery per site, the orchestrator resolves every site's
+    weekly images and export region in one batched getInfo round-trip (or, with plan, one
+    per site and one per site-year collection), starts tasks from a bounded thread pool, and
+    polls them to completion, resubmitting failed exports with exponential backoff.
+
+    Parameters:
+    - ee_module: The Earth Engine module to use. Defaults to the initialized ee package; a
+      fake module with the same interface can be passed for offline testing.
+    - folder_root: Google Drive folder prefix; each site exports to folder_root/ID.
+    - max_workers: Maximum number of concurrent requests.
+    - retries: Retries for each request and for each failed task.
+    - backoff: Initial retry delay in seconds.
+    - cloud_threshold: Maximum scene-level CLOUDY_PIXEL_PERCENTAGE.
+    - quality_bands: Whether to also export QUALITY_BANDS for per-pixel masking, which allows
+      a higher cloud_threshold.
+    - scale: Export resolution in meters.
+    - sleep: Function used to wait, replaceable for tests.
+    - clock: Monotonic clock in seconds scheduling resubmissions, replaceable for tests along
+      with sleep.
+    """
+    def __init__(self, ee_module=None, folder_root='Sentinel', max_workers=4, retries=3, backoff=2.0, cloud_threshold=10, quality_bands=False, scale=10, sleep=time.sleep, clock=time.monotonic):
+        if ee_module is None:
+            import ee as ee_module
+            ee_module.Initialize()
+        self.ee = ee_module
+        self.folder_root = folder_root
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.cloud_threshold = cloud_threshold
+        self.bands = EXPORT_BANDS + QUALITY_BANDS if quality_bands else EXPORT_BANDS
+        self.scale = scale
+        self.sleep = sleep
+        self.clock = clock
+
+    def _retry(self, function):
+        return with_retry(function, self.retries, self.backoff, self.sleep)
+
+    def collection(self, region, start_date, end_date):
+        """
+        Return the filtered Sentinel-2 collection of a region and season.
+        """
+        ee = self.ee
+        return ee.ImageCollection(COLLECTION) \
+            .filterBounds(region) \
+            .filterDate(start_date, end_date) \
+            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', self.cloud_threshold))
+
+    def collection_metadata(self, collection):
+        """
+        Fetch the time, cloud cover and index of every image of a collection in one round-trip.
+        """
+        ee = self.ee
+        request = ee.Dictionary({
+            'times': collection.aggregate_array('system:time_start'),
+            'clouds': collection.aggregate_array('CLOUDY_PIXEL_PERCENTAGE'),
+            'ids': collection.aggregate_array('system:index'),
+        })
+        return self._retry(request.getInfo)
+
+    def _job(self, site, date, image_id, coordinates):
+        # Export job of one image of a site
+        return {
+            'site': site['ID'],
+            'date': date,
+            'image_id': f'{COLLECTION}/{image_id}',
+            'description': f'Sentinel2_{date}',
+            'folder': f"{self.folder_root}/{site['ID']}",
+            'region': coordinates,
+            'state': 'PLANNED',
+            'attempts': 0,
+            'task': None,
+            'error': None,
+            'retry_at': None,
+        }
+
+    def weekly_selection(self, collection, start_date, end_date):
+        """
+        Server-side list with the least cloudy image of each week of a season.
+
+        Each week maps to [[system:time_start], [system:index]], both empty when the week has no
+        image, so empty weeks need neither a client round-trip nor exception handling.
+        """
+        ee = self.ee
+
+        def least_cloudy(week_start):
+            start = ee.Date(week_start)
+            weekly = collection.filterDate(start, start.advance(7, 'day')).sort('CLOUDY_PIXEL_PERCENTAGE').limit(1)
+            return ee.List([weekly.aggregate_array('system:time_start'), weekly.aggregate_array('system:index')])
+
+        starts = [start.strftime('%Y-%m-%d') for start in week_starts(start_date, end_date)]
+        return ee.List(starts).map(least_cloudy)
+
+    def plan_batched(self, sites, years, start_month=6, end_month=9, buffer_size=500):
+        """
+        Return the export jobs of every site and year, resolved with a single getInfo round-trip.
+
+        The weekly least-cloudy selection of every site-year and the export region of every site
+        are combined in one ee.Dictionary, so the request count no longer grows with the number
+        of weeks, years or sites.
+        """
+        ee = self.ee
+        request = {}
+        for site in sites:
+            region = ee.Geometry.Point([site['Longitude'], site['Latitude']]).buffer(buffer_size)
+            request[f"{site['ID']}:region"] = region.coordinates()
+            for year in years:
+                start_date = f'{year}-{start_month:02d}-01'
+                end_date = f'{year}-{end_month:02d}-30'
+                request[f"{site['ID']}:{year}"] = self.weekly_selection(self.collection(region, start_date, end_date), start_date, end_date)
+
+        result = self._retry(ee.Dictionary(request).getInfo)
+
+        jobs = []
+        for site in sites:
+            coordinates = result[f"{site['ID']}:region"]
+            for year in years:
+                for times, ids in result[f"{site['ID']}:{year}"]:
+                    # Skip weeks without an image below the cloud threshold
+                    if not times:
+                        continue
+                    date = datetime.datetime.fromtimestamp(times[0] / 1000, tz=datetime.timezone.utc)
+                    jobs.append(self._job(site, date.strftime('%Y-%m-%d'), ids[0], coordinates))
+        return jobs
+
+    def plan_site(self, site, years, start_month=6, end_month=9, buffer_size=500):
+        """
+        Return the export jobs of one site: one per week with an image below the cloud threshold.
+        """
+        ee = self.ee
+        region = ee.Geometry.Point([site['Longitude'], site['Latitude']]).buffer(buffer_size)
+        coordinates = self._retry(region.getInfo)['coordinates']
+
+        jobs = []
+        for year in years:
+            start_date = f'{year}-{start_month:02d}-01'
+            end_date = f'{year}-{end_month:02d}-30'
+            metadata = self.collection_metadata(self.collection(region, start_date, end_date))
+            for date, image_id in weekly_least_cloudy(metadata['times'], metadata['clouds'], metadata['ids'], start_date, end_date):
+                jobs.append(self._job(site, date, image_id, coordinates))
+        return jobs
+
+    def plan(self, sites, years, start_month=6, end_month=9, buffer_size=500):
+        """
+        Return the export jobs of every site, planning sites concurrently.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            planned = pool.map(lambda site: self.plan_site(site, years, start_month, end_month, buffer_size), sites)
+            return [job for jobs in planned for job in jobs]
+
+    def _start(self, job):
+        # Create and start the export task of a job; a failure is recorded in the job, not raised
+        ee = self.ee
+        job['attempts'] += 1
+        job['retry_at'] = None
+        try:
+            image = ee.Image(job['image_id']).select(self.bands).toUint16()
+            task = ee.batch.Export.image.toDrive(
+                image=image,
+                description=job['description'],
+                scale=self.scale,
+                region=job['region'],
+                fileFormat='GeoTIFF',
+                folder=job['folder']
+            )
+            self._retry(task.start)
+        except Exception as e:
+            job['task'] = None
+            job['state'] = 'FAILED'
+            job['error'] = f"{type(e).__name__}: {e}"
+            print(f"Failed to start export {job['folder']}/{job['description']}: {job['error']}")
+            return job
+        job['task'] = task
+        job['state'] = 'SUBMITTED'
+        job['error'] = None
+        print(f"Started export {job['folder']}/{job['description']}")
+        return job
+
+    def submit(self, jobs):
+        """
+        Start the export task of every job, with at most max_workers requests in flight.
+
+        A job whose task cannot be started is left in state FAILED with the error under
+        'error', and the other jobs are still submitted; poll resubmits it.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(self._start, jobs))
+
+    def _status(self, job):
+        # State of a job's task, or UNKNOWN with the error once every retry of the call failed
+        try:
+            return self._retry(job['task'].status)['state'], None
+        except Exception as e:
+            return 'UNKNOWN', f"{type(e).__name__}: {e}"
+
+    def poll(self, jobs, interval=30, timeout=None):
+        """
+        Poll submitted tasks until every one is in a terminal state, resubmitting failures.
+
+        A failed job is resubmitted up to retries times, each after its own exponential backoff
+        counted from when the failure was seen, so failures wait concurrently rather than one
+        after the other. A job whose status cannot be read even after retries is left in state
+        UNKNOWN with the error, and the others are still polled.
+
+        Parameters:
+        - jobs: Jobs returned by submit.
+        - interval: Seconds between polling rounds.
+        - timeout: Optional maximum number of seconds to poll.
+
+        Returns:
+        - Dictionary counting jobs per final state.
+        """
+        started = self.clock()
+        pending = [job for job in jobs if job['task'] is not None or job['state'] == 'FAILED']
+        while pending:
+            polled = [job for job in pending if job['task'] is not None and job['retry_at'] is None]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                states = list(pool.map(self._status, polled))
+            for job, (state, error) in zip(polled, states):
+                job['state'] = state
+                if error is not None:
+                    job['error'] = error
+
+            now = self.clock()
+            still_pending = []
+            for job in pending:
+                if job['state'] == 'FAILED' and job['retry_at'] is None and job['attempts'] <= self.retries:
+                    # Back off before resubmitting a failed export
+                    job['retry_at'] = now + self.backoff * 2 ** (job['attempts'] - 1)
+                if job['retry_at'] is not None or job['state'] not in TERMINAL_STATES + ('UNKNOWN',):
+                    still_pending.append(job)
+
+            due = [job for job in still_pending if job['retry_at'] is not None and job['retry_at'] <= now]
+            for job in due:
+                print(f"Resubmitting failed export {job['folder']}/{job['description']}")
+            self.submit(due)
+
+            pending = still_pending
+            if pending:
+                if timeout is not None and now - started > timeout:
+                    break
+                # Wake up for the next polling round or the earliest resubmission, if sooner
+                waits = [job['retry_at'] - now for job in pending if job['retry_at'] is not None]
+                if all(job['retry_at'] is not None for job in pending):
+                    self.sleep(max(min(waits), 0))
+                else:
+                    self.sleep(min([interval] + waits))
+
+        summary = {}
+        for job in jobs:
+            summary[job['state']] = summary.get(job['state'], 0) + 1
+        return summary
+
+    def run(self, sites, years, start_month=6, end_month=9, buffer_size=500, wait=True, interval=30, batched=True, catalog=None):
+        """
+        Plan, submit and optionally wait for the exports of every site and year.
+
+        Parameters:
+        - batched: Whether to plan with plan_batched (one round-trip) rather than plan (one per
+          site and site-year, run concurrently).
+        - catalog: Optional Scene_Catalog.SceneCatalog; planned scenes already downloaded with
+          the same bands, scale and area are not submitted.
+
+        Returns:
+        - The list of jobs, each with its final or last polled state.
+        """
+        with stage('plan'):
+            if batched:
+                jobs = self.plan_batched(sites, years, start_month, end_month, buffer_size)
+            else:
+                jobs = self.plan(sites, years, start_month, end_month, buffer_size)
+        print(f"Planned {len(jobs)} exports for {len(sites)} sites")
+        if catalog is not None:
+            jobs = catalog.missing(jobs, sites, self.bands, self.scale, buffer_size)
+            print(f"{len(jobs)} exports not yet downloaded")
+        with stage('export', items=len(jobs)):
+            self.submit(jobs)
+        if wait:
+            with stage('poll'):
+                print(self.poll(jobs, interval=interval))
+        return jobs
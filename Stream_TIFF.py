@@ -0,0 +1,178 @@
+import os
+import glob
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from Process_TIFF import ProductEngine, merge_statistics, resolve_engine
+
+def block_windows(src, block_size=512):
+    """
+    Yield the windows covering a dataset in row-major order.
+
+    Parameters:
+    - src: Open rasterio dataset.
+    - block_size: Target window size in pixels. Tiled inputs use their own tiles when these
+      are no larger than block_size, so each window decodes whole tiles only.
+    """
+    block_height, block_width = src.block_shapes[0]
+    if not src.is_tiled or block_height > block_size or block_width > block_size:
+        block_height = block_width = block_size
+
+    for row in range(0, src.height, block_height):
+        for col in range(0, src.width, block_width):
+            yield Window(col, row, min(block_width, src.width - col), min(block_height, src.height - row))
+
+def _read_valid(src, engine, window, valid):
+    # Read a window, zeroing its invalid pixels, and return it with its part of the validity mask
+    stack = engine.read(src, window=window)
+    if valid is None:
+        return stack, None
+    valid = valid[window.toslices()]
+    stack[:, ~valid] = 0
+    return stack, valid
+
+def scan_statistics(src, engine, block_size=512, valid=None):
+    """
+    First pass over a dataset collecting the scene-wide stretch statistics window by window.
+
+    With a boolean valid mask of the whole scene, only valid pixels count.
+
+    Returns:
+    - Dictionary with the RGB maximum and the (min, max) of each normalized difference,
+      as returned by ProductEngine.statistics for a whole scene.
+    """
+    stats = None
+    for window in block_windows(src, block_size):
+        stats = merge_statistics(stats, engine.statistics(*_read_valid(src, engine, window, valid)))
+    return stats
+
+def stream_products(file_path, products=None, threshold=None, block_size=512, engine=None):
+    """
+    Write products of a large raster as tiled GeoTIFFs with peak memory bounded by the window size.
+
+    A first pass gathers the statistics the stretch needs (RGB maximum, index min/max), and a
+    second pass computes and writes each window with those scene-wide statistics, so the
+    output matches calculate_products without holding a full band in memory.
+
+    Parameters:
+    - file_path: Path to the 5-band GeoTIFF.
+    - products: Products to write, each to a subfolder of the same name next to the GeoTIFF;
+      RGB, NDVI and NDWI by default.
+    - threshold: Optional NDVI threshold, as in calculate_ndvi.
+    - block_size: Window and output tile size in pixels; must be a multiple of 16.
+    - engine: Optional ProductEngine to reuse buffers across files, whose products and
+      threshold are then used (see Process_TIFF.resolve_engine). With a mask store, invalid
+      pixels are masked as in calculate_products.
+
+    Returns:
+    - Dictionary of written file paths keyed by product name.
+    """
+    if block_size % 16 != 0:
+        raise ValueError("block_size must be a multiple of 16 for tiled GeoTIFF output.")
+    engine = resolve_engine(engine, products, threshold, default_products=('RGB', 'NDVI', 'NDWI'))
+
+    base_name = os.path.basename(file_path)
+    dir_name = os.path.dirname(file_path)
+    name, ext = os.path.splitext(base_name)
+
+    with rasterio.open(file_path) as src:
+        # The validity mask holds one byte per pixel, far less than a band, so it is kept whole;
+        # when not cached it is built window by window like the products
+        valid = None if engine.mask is None else engine.mask.mask(file_path, windows=block_windows(src, block_size))
+        stats = scan_statistics(src, engine, block_size, valid)
+
+        # Open one tiled output per product
+        profile = {
+            'driver': 'GTiff',
+            'dtype': 'uint8',
+            'width': src.width,
+            'height': src.height,
+            'crs': src.crs,
+            'transform': src.transform,
+            'tiled': True,
+            'blockxsize': block_size,
+            'blockysize': block_size,
+            'compress': 'deflate',
+        }
+        paths = {}
+        outputs = {}
+        try:
+            for product in engine.products:
+                folder = os.path.join(dir_name, product)
+                os.makedirs(folder, exist_ok=True)
+                paths[product] = os.path.join(folder, f"{product}_{name[-10:]}.tif")
+                count = {'RGB': 3, 'RGBA': 4}.get(product, 1)
+                photometric = {'RGB': 'RGB'}.get(product, 'MINISBLACK')
+                outputs[product] = rasterio.open(paths[product], 'w', count=count, photometric=photometric, **profile)
+
+            # Second pass: compute each window with the scene-wide statistics and write it
+            for window in block_windows(src, block_size):
+                stack, window_valid = _read_valid(src, engine, window, valid)
+                images = engine.compute(stack, statistics=stats, file_path=file_path, valid=window_valid)
+                for product, image in images.items():
+                    if image.ndim == 3:
+                        outputs[product].write(image.transpose(2, 0, 1), window=window)
+                    else:
+                        outputs[product].write(image, 1, window=window)
+        finally:
+            for dst in outputs.values():
+                dst.close()
+
+    print(f"Tiled products saved for {base_name}")
+    return paths
+
+def stream_folder(path, products=('RGB', 'NDVI', 'NDWI'), threshold=False, block_size=512):
+    """
+    Run stream_products on every GeoTIFF in a folder, sharing one engine.
+    """
+    engine = ProductEngine(products=products, threshold=threshold)
+    for tiff_file in sorted(glob.glob(os.path.join(path, "*.tif"))):
+        print(f"Processing {tiff_file}")
+        stream_products(tiff_file, block_size=block_size, engine=engine)
+
+def stream_select_bands(file_path, bandA, bandB, bandC, output_path, block_size=512):
+    """
+    Windowed version of Select_Bands.select_bands writing a tiled GeoTIFF instead of a JPEG.
+
+    Parameters:
+    - file_path: Path to the GeoTIFF.
+    - bandA, bandB: Bands of the normalized difference (bandA - bandB) / (bandA + bandB), or the
+      first two bands of a composite when bandC is given.
+    - bandC: Third band of a composite, or None for a normalized difference.
+    - output_path: Path of the tiled GeoTIFF to write.
+    - block_size: Window and output tile size in pixels; must be a multiple of 16.
+    """
+    if block_size % 16 != 0:
+        raise ValueError("block_size must be a multiple of 16 for tiled GeoTIFF output.")
+    bands = [bandA, bandB] if bandC is None else [bandA, bandB, bandC]
+
+    with rasterio.open(file_path) as src:
+        # The composite is scaled by its global maximum, gathered in a cheap first pass
+        if bandC is not None:
+            band_max = max(src.read(bands, window=window).max() for window in block_windows(src, block_size))
+
+        profile = {
+            'driver': 'GTiff',
+            'dtype': 'uint8',
+            'width': src.width,
+            'height': src.height,
+            'count': 1 if bandC is None else 3,
+            'crs': src.crs,
+            'transform': src.transform,
+            'tiled': True,
+            'blockxsize': block_size,
+            'blockysize': block_size,
+            'compress': 'deflate',
+        }
+        with rasterio.open(output_path, 'w', **profile) as dst:
+            for window in block_windows(src, block_size):
+                selected = src.read(bands, window=window).astype(np.float32)
+                if bandC is None:
+                    # Normalized difference shifted from [-1, 1] to [0, 255]
+                    normalized_index = (selected[0] - selected[1]) / (selected[0] + selected[1] + 1e-10)
+                    dst.write(((normalized_index + 1) / 2 * 255).astype(np.uint8), 1, window=window)
+                else:
+                    dst.write((selected / band_max * 255).astype(np.uint8), window=window)
+
+    return output_path
@@ -0,0 +1,329 @@
+import os
+import glob
+import numpy as np
+import pandas as pd
+
+from Datacube import DATE_PATTERN
+from Manual_Polygons import SITE_PATTERN
+
+# Site latitudes used as a predictor in Threshold_Analysis.R
+LATITUDES = {'s002': 68.632100, 's003': 68.356460, 's004': 67.947201, 's015': 68.889200, 's019': 68.948500}
+
+# Area of a 10 m Sentinel-2 pixel in km², for results written without Area_m2
+PIXEL_AREA_KM2 = 100 / 1000000
+
+def load_manual(output_dir="Output"):
+    """
+    Load the Manual_Segmentation_sXXX.csv areas, normalized as in Threshold_Analysis.R.
+
+    Returns:
+    - DataFrame with ID, Date, ManualArea, year, month, MaxArea, NormalizedArea and Latitude,
+      one row per site and date.
+    """
+    tables = []
+    for path in sorted(glob.glob(os.path.join(output_dir, "Manual_Segmentation_s*.csv"))):
+        table = pd.read_csv(path)
+        names = table['File Name'].str.replace('\\', '/', regex=False)
+        site = SITE_PATTERN.search(os.path.basename(path)).group(1)
+        table['ID'] = names.str.extract(r'Sentinel-(s\d{3})', expand=False).fillna(site)
+        table['Date'] = pd.to_datetime(names.map(lambda name: DATE_PATTERN.search(os.path.basename(name)).group(1)))
+        tables.append(table.rename(columns={'Estimated Area': 'ManualArea'})[['ID', 'Date', 'ManualArea']])
+
+    manual = pd.concat(tables, ignore_index=True).drop_duplicates(['ID', 'Date'])
+    manual['year'] = manual['Date'].dt.year
+    manual['month'] = manual['Date'].dt.month
+    manual['MaxArea'] = manual.groupby('ID')['ManualArea'].transform('max')
+    manual['NormalizedArea'] = manual['ManualArea'] / manual['MaxArea']
+    manual['Latitude'] = manual['ID'].map(LATITUDES)
+    return manual.reset_index(drop=True)
+
+def load_results(path):
+    """
+    Load a threshold segmentation results CSV or Results_Store dataset with Area in km².
+
+    Area comes from the georeferenced Area_m2 column where results have it, and from the
+    nominal 10 m pixel otherwise.
+    """
+    if path.endswith('.csv'):
+        table = pd.read_csv(path, parse_dates=['Date'])
+    else:
+        from Results_Store import read_results
+        table = read_results(path)
+    nominal = table['Pixels'] * PIXEL_AREA_KM2
+    table['Area'] = table['Area_m2'] / 1e6 if 'Area_m2' in table else nominal
+    table['Area'] = table['Area'].fillna(nominal)
+    return table
+
+def combine(results, manual):
+    """
+    Join threshold results with the manual areas of the same site and date.
+    """
+    return results.merge(manual[['ID', 'Date', 'ManualArea']], on=['ID', 'Date'])
+
+def growth_rates(table, value='Area', by=None):
+    """
+    Fit a least-squares line of area against day of year for every group at once.
+
+    The slope and intercept of each group follow from its sums of x, y, x² and xy, all
+    accumulated with one bincount per sum over the group codes, so there is no Python loop
+    over groups.
+
+    Parameters:
+    - table: Results with Date and the value column, e.g. from load_results or load_manual.
+    - value: Column to regress, e.g. 'Area' or 'ManualArea'.
+    - by: Grouping columns; defaults to ID, Threshold when present, and year, i.e. one
+      seasonal rate per site, threshold and summer.
+
+    Returns:
+    - DataFrame with the group keys, the number of dates n, Rate (value per day), Intercept
+      and R2. Groups with fewer than two distinct dates have a NaN rate.
+    """
+    dates = pd.to_datetime(table['Date'])
+    if by is None:
+        by = ['ID'] + (['Threshold'] if 'Threshold' in table else [])
+        table = table.assign(year=dates.dt.year)
+        by.append('year')
+    by = list(by)
+
+    grouped = table.groupby(by, sort=True)
+    codes = grouped.ngroup().to_numpy()
+    keys = grouped.size().index
+    groups = len(keys)
+    x = dates.dt.dayofyear.to_numpy(dtype=np.float64)
+    y = table[value].to_numpy(dtype=np.float64)
+
+    n = np.bincount(codes, minlength=groups).astype(np.float64)
+    sx, sy = np.bincount(codes, x, groups), np.bincount(codes, y, groups)
+    sxx, sxy, syy = np.bincount(codes, x * x, groups), np.bincount(codes, x * y, groups), np.bincount(codes, y * y, groups)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vxx = sxx - sx * sx / n
+        vxy = sxy - sx * sy / n
+        vyy = syy - sy * sy / n
+        rate = np.where(vxx > 0, vxy / vxx, np.nan)
+        intercept = (sy - rate * sx) / n
+        r2 = np.where(vyy > 0, rate * vxy / vyy, np.nan)
+
+    rates = keys.to_frame(index=False)
+    rates['n'] = n.astype(np.int64)
+    rates['Rate'] = rate
+    rates['Intercept'] = intercept
+    rates['R2'] = r2
+    return rates
+
+def net_growth(table, value='Area', by=('ID',)):
+    """
+    Growth from the first date to the largest area, and its yearly rate, as the Rate and
+    Growth of Threshold_Analysis.R but with the group's own span of years.
+    """
+    table = table.sort_values('Date')
+    grouped = table.groupby(list(by))
+    growth = (grouped[value].max() - grouped[value].first()).rename('Growth')
+    years = (grouped['Date'].max().dt.year - grouped['Date'].min().dt.year).rename('Years')
+    result = pd.concat([growth, years], axis=1).reset_index()
+    result['Rate'] = result['Growth'] / result['Years'].where(result['Years'] > 0)
+    return result
+
+def polynomial_features(table, columns=('month', 'year'), degree=2, extra=('Latitude',)):
+    """
+    Return predictor columns with powers up to degree, named month, month2, ... as in
+    Threshold_Analysis.R, followed by the extra columns.
+    """
+    features = pd.DataFrame(index=table.index)
+    for column in columns:
+        values = table[column].to_numpy(dtype=np.float64)
+        for power in range(1, degree + 1):
+            features[column if power == 1 else f"{column}{power}"] = values ** power
+    for column in extra:
+        features[column] = table[column].to_numpy(dtype=np.float64)
+    return features
+
+def _factor(X, y):
+    # Triangular factor R of the standardized predictors with the centered response as last
+    # column, so R'R is their Gram matrix. It is computed by QR rather than from the Gram matrix,
+    # whose condition number is squared; raw powers of year make that matter.
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    Z = np.column_stack([X - X.mean(axis=0), y - y.mean()])
+    scale = np.sqrt((Z * Z).sum(axis=0))
+    scale[scale == 0] = 1
+    R = np.linalg.qr(Z / scale, mode='r')
+    return R, scale[-1] ** 2
+
+class _Subset:
+    # Regression of the response on a subset of predictors, kept as the triangular factor of the
+    # predictors reordered so the subset comes first. Moving one predictor in or out of the
+    # subset is a series of adjacent column swaps, each restored to triangular form by a Givens
+    # rotation of two rows, so it costs O(p²) without touching the data.
+    def __init__(self, R):
+        self.R = R.copy()
+        self.p = len(R) - 1
+        self.order = list(range(self.p))
+        self.size = 0
+
+    def _swap(self, j):
+        # Swap columns j and j + 1 and rotate rows j and j + 1 back to triangular form
+        R = self.R
+        R[:, [j, j + 1]] = R[:, [j + 1, j]]
+        a, b = R[j, j], R[j + 1, j]
+        radius = np.hypot(a, b)
+        if radius > 0:
+            c, s = a / radius, b / radius
+            R[[j, j + 1], j:] = np.array([[c, s], [-s, c]]) @ R[[j, j + 1], j:]
+            R[j + 1, j] = 0.0
+        self.order[j], self.order[j + 1] = self.order[j + 1], self.order[j]
+
+    def toggle(self, variable):
+        position = self.order.index(variable)
+        if position >= self.size:
+            for j in range(position - 1, self.size - 1, -1):
+                self._swap(j)
+            self.size += 1
+        else:
+            for j in range(position, self.size - 1):
+                self._swap(j)
+            self.size -= 1
+
+    def rss(self):
+        # Residual sum of squares of the standardized response
+        residual = self.R[self.size:, self.p]
+        return residual @ residual
+
+    def changes(self):
+        # RSS change of toggling every predictor, by predictor index
+        R, size, p = self.R, self.size, self.p
+        change = np.zeros(p)
+        trailing, residual = R[size:, size:p], R[size:, p]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # Adding a column lowers the RSS by the square of the residual's projection on it
+            added = -(trailing.T @ residual) ** 2 / (trailing * trailing).sum(axis=0)
+        change[self.order[size:]] = np.nan_to_num(added, nan=0.0)
+        if size:
+            # Removing one raises it by its coefficient squared over its inverse-Gram diagonal
+            inverse = np.linalg.solve(R[:size, :size], np.eye(size))
+            coefficients = inverse @ R[:size, p]
+            change[self.order[:size]] = coefficients ** 2 / (inverse * inverse).sum(axis=1)
+        return change
+
+def _bic(rss, tss, n, size):
+    # BIC relative to the intercept-only model; its minimum is that of the usual BIC
+    return n * np.log(rss / tss) + size * np.log(n)
+
+def best_subset(X, y, max_size=None):
+    """
+    Exhaustive best-subset regression with an intercept, as regsubsets(method="exhaustive").
+
+    The predictors are reduced once to the triangular factor of their Gram matrix, and subsets
+    are visited in Gray-code order, so every subset differs from the previous one by a single
+    predictor and its residual sum of squares follows from O(p²) Givens updates of the factor,
+    as in leaps, instead of a new fit over all rows.
+
+    Parameters:
+    - X: DataFrame of predictors, e.g. from polynomial_features.
+    - y: Response values.
+    - max_size: Largest subset size to report; all sizes by default.
+
+    Returns:
+    - DataFrame with the best subset of every size: size, predictors, RSS, R2, AdjR2 and BIC.
+    """
+    names = list(X.columns)
+    p, n = len(names), len(X)
+    R, tss = _factor(X, y)
+    max_size = p if max_size is None else min(max_size, p)
+
+    best_rss = np.full(p + 1, np.inf)
+    best_sets = [0] * (p + 1)
+    model = _Subset(R)
+    subset = 0
+    for step in range(1, 2 ** p):
+        k = (step & -step).bit_length() - 1
+        subset ^= 1 << k
+        model.toggle(k)
+        if model.size <= max_size:
+            rss = model.rss()
+            if rss < best_rss[model.size]:
+                best_rss[model.size], best_sets[model.size] = rss, subset
+
+    rows = []
+    for size in range(1, max_size + 1):
+        # Rescale the RSS of the standardized response
+        rss = best_rss[size] * tss
+        rows.append({'size': size, 'predictors': tuple(names[j] for j in range(p) if best_sets[size] >> j & 1),
+                     'RSS': rss, 'R2': 1 - rss / tss, 'AdjR2': 1 - (rss / (n - size - 1)) / (tss / (n - 1)),
+                     'BIC': _bic(rss, tss, n, size)})
+    return pd.DataFrame(rows)
+
+def stepwise(X, y, direction='both', max_steps=None):
+    """
+    Stepwise BIC selection with an intercept, starting from the intercept-only model.
+
+    The change in residual sum of squares of adding or removing every predictor is read off the
+    triangular factor of the current model at once, so each step scores all candidates without
+    a fit and then applies one O(p²) update.
+
+    Parameters:
+    - X: DataFrame of predictors.
+    - y: Response values.
+    - direction: 'forward', 'backward' (starting from all predictors) or 'both'.
+
+    Returns:
+    - Tuple of the selected predictor names and the model's BIC.
+    """
+    if direction not in ('forward', 'backward', 'both'):
+        raise ValueError(f"direction must be 'forward', 'backward' or 'both', not {direction}.")
+    names = list(X.columns)
+    p, n = len(names), len(X)
+    R, tss = _factor(X, y)
+    model = _Subset(R)
+    selected = np.zeros(p, dtype=bool)
+    if direction == 'backward':
+        for j in range(p):
+            model.toggle(j)
+        selected[:] = True
+
+    bic = _bic(model.rss() * tss, tss, n, model.size)
+    for _ in range(max_steps or 2 * p * p):
+        candidate = (model.rss() + model.changes()) * tss
+        sizes = model.size + np.where(selected, -1, 1)
+        allowed = selected if direction == 'backward' else ~selected if direction == 'forward' else np.ones(p, dtype=bool)
+        with np.errstate(divide='ignore'):
+            scores = np.where(allowed & (candidate > 0), _bic(np.maximum(candidate, 0), tss, n, sizes), np.inf)
+        j = int(np.argmin(scores))
+        if scores[j] >= bic:
+            break
+        model.toggle(j)
+        selected[j] = not selected[j]
+        bic = scores[j]
+    return tuple(name for name, keep in zip(names, selected) if keep), bic
+
+def fit_model(table, predictors, response='NormalizedArea'):
+    """
+    Fit the least-squares model of a response on the given predictor columns with an intercept.
+
+    Returns:
+    - Series of coefficients, with the intercept first, and the fitted values.
+    """
+    X = np.column_stack([np.ones(len(table))] + [table[name].to_numpy(dtype=np.float64) for name in predictors])
+    coefficients, *_ = np.linalg.lstsq(X, table[response].to_numpy(dtype=np.float64), rcond=None)
+    return pd.Series(coefficients, index=['(Intercept)', *predictors]), X @ coefficients
+
+def threshold_rmse(validation, value='Area', reference='ManualArea'):
+    """
+    Root mean square error of segmented against manual areas per site and threshold.
+
+    Returns:
+    - DataFrame with ID, Threshold, n and RMSE, and the threshold with the lowest RMSE per site.
+    """
+    validation = validation.assign(Squared=(validation[value] - validation[reference]) ** 2)
+    rmse = validation.groupby(['ID', 'Threshold'], as_index=False).agg(n=('Squared', 'size'), RMSE=('Squared', 'mean'))
+    rmse['RMSE'] = np.sqrt(rmse['RMSE'])
+    return rmse, rmse.loc[rmse.groupby('ID')['RMSE'].idxmin()].reset_index(drop=True)
+
+if __name__ == "__main__":
+    root = os.path.dirname(os.path.abspath(__file__))
+    manual = load_manual(os.path.join(root, "Output"))
+    features = polynomial_features(manual)
+    subsets = best_subset(features, manual['NormalizedArea'])
+    print(subsets)
+    predictors = subsets.loc[subsets['BIC'].idxmin(), 'predictors']
+    print(fit_model(features.assign(NormalizedArea=manual['NormalizedArea']), predictors)[0])
@@ -0,0 +1,142 @@
+import os
+import glob
+import numpy as np
+import rasterio
+from scipy import ndimage
+
+from Datacube import parse_date
+from Select_Bands import band_image
+from Scene_Catalog import pixel_area
+from Instrumentation import stage, count
+
+# Luminance weights of skimage.color.rgb2gray, used by skio.imread(..., as_gray=True)
+GRAY_WEIGHTS = np.array([0.2125, 0.7154, 0.0721])
+
+def as_gray(images):
+    """
+    Convert uint8 RGB images of shape (..., height, width, 3) to gray values in [0, 1].
+    """
+    return (np.asarray(images, dtype=np.float64) / 255) @ GRAY_WEIGHTS
+
+def otsu_thresholds(stack, nbins=256):
+    """
+    Return the Otsu threshold of every image of a (date, height, width) stack.
+
+    The histograms of all images are built with one bincount over image-offset bin indices,
+    and the between-class variance of every candidate threshold is evaluated for all images
+    at once, following skimage.filters.threshold_otsu.
+    """
+    stack = np.asarray(stack, dtype=np.float64)
+    count = len(stack)
+    flat = stack.reshape(count, -1)
+    low, high = flat.min(axis=1), flat.max(axis=1)
+    width = np.where(high > low, (high - low) / nbins, 1.0)
+
+    bins = np.clip(((flat - low[:, np.newaxis]) / width[:, np.newaxis]).astype(np.int64), 0, nbins - 1)
+    bins += np.arange(count)[:, np.newaxis] * nbins
+    hist = np.bincount(bins.ravel(), minlength=count * nbins).reshape(count, nbins).astype(np.float64)
+    centers = low[:, np.newaxis] + width[:, np.newaxis] * (np.arange(nbins) + 0.5)
+
+    weight1 = np.cumsum(hist, axis=1)
+    weight2 = np.cumsum(hist[:, ::-1], axis=1)[:, ::-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean1 = np.cumsum(hist * centers, axis=1) / weight1
+        mean2 = (np.cumsum((hist * centers)[:, ::-1], axis=1) / weight2[:, ::-1])[:, ::-1]
+    variance = weight1[:, :-1] * weight2[:, 1:] * (mean1[:, :-1] - mean2[:, 1:]) ** 2
+    best = np.argmax(np.nan_to_num(variance), axis=1)
+    # Constant images have no split; their threshold is their value
+    return np.where(high > low, centers[np.arange(count), best], low)
+
+def component_areas(masks, min_size=0, connectivity=2):
+    """
+    Label the connected components of every mask of a (date, height, width) stack at once.
+
+    One scipy.ndimage.label call labels the whole stack with a structuring element that never
+    connects different dates, component sizes come from a single bincount, and components
+    smaller than min_size are dropped through a per-label lookup table.
+
+    Parameters:
+    - masks: Boolean (date, height, width) stack.
+    - min_size: Minimum component size in pixels.
+    - connectivity: 1 for 4-connected or 2 for 8-connected components, as in skimage.measure.label.
+
+    Returns:
+    - Filtered masks, the kept pixel area of every date, and the kept component count of every date.
+    """
+    masks = np.asarray(masks, dtype=bool)
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = ndimage.generate_binary_structure(2, connectivity)
+    labels, count = ndimage.label(masks, structure=structure)
+
+    sizes = np.bincount(labels.ravel(), minlength=count + 1)
+    keep = sizes >= max(min_size, 1)
+    keep[0] = False
+    kept = keep[labels]
+
+    # Date of every label; each label lies within one date
+    label_dates = np.zeros(count + 1, dtype=np.int64)
+    label_dates[labels.ravel()] = np.repeat(np.arange(len(masks)), masks[0].size)
+    components = np.bincount(label_dates[1:][keep[1:]], minlength=len(masks))
+    return kept, kept.sum(axis=(1, 2)), components
+
+def segment_stack(images, method='otsu', mean_factor=1.25, min_size=0, connectivity=2):
+    """
+    Threshold-segment a stack of gray images, as generate_segmentation in PythonSegmentation.ipynb.
+
+    Parameters:
+    - images: (date, height, width) gray stack, e.g. from as_gray.
+    - method: 'otsu' for each image's own Otsu threshold, or 'mean' for mean_factor times
+      each image's mean.
+    - mean_factor: Multiple of the mean used by the 'mean' method.
+    - min_size, connectivity: See component_areas.
+
+    Returns:
+    - Dictionary with per-date 'thresholds', 'areas' and 'components', and the filtered 'masks'.
+    """
+    images = np.asarray(images, dtype=np.float64)
+    if method == 'otsu':
+        thresholds = otsu_thresholds(images)
+    elif method == 'mean':
+        thresholds = images.reshape(len(images), -1).mean(axis=1) * mean_factor
+    else:
+        raise ValueError(f"method must be 'otsu' or 'mean', not {method}.")
+    masks = images > thresholds[:, np.newaxis, np.newaxis]
+    masks, areas, components = component_areas(masks, min_size, connectivity)
+    return {'thresholds': thresholds, 'areas': areas, 'components': components, 'masks': masks}
+
+def _read_composite(file_path):
+    # RGB composite of a scene, as Select_Bands.select_bands_array, and its pixel area from the same open
+    with stage('read'), rasterio.open(file_path) as src:
+        selected = src.read([1, 2, 3], out_dtype=np.float32)
+        area = pixel_area(src.transform)
+    count('read', bytes_read=selected.nbytes)
+    return band_image(selected, True), area
+
+def segment_folder(folder, method='otsu', mean_factor=1.25, min_size=0, connectivity=2):
+    """
+    Threshold-segment the RGB composite of every scene of a site folder, one stack per scene size.
+
+    Each scene is thresholded on its own, so scenes of a site that differ by a row or column
+    are stacked with the scenes of the same size rather than cropped.
+
+    Returns:
+    - List of {'Date', 'Gray_Threshold', 'Pixels', 'Area_m2', 'Components'} dictionaries in
+      date order, with the gray-level threshold of each scene, unrelated to the NDVI
+      'Threshold' of Batch_Segment results, and areas from each scene's geotransform.
+    """
+    files = sorted(glob.glob(os.path.join(folder, "*.tif")), key=parse_date)
+    if not files:
+        raise FileNotFoundError(f"No GeoTIFFs found in {folder}.")
+    images, areas = zip(*[_read_composite(file) for file in files])
+    groups = {}
+    for t, image in enumerate(images):
+        groups.setdefault(image.shape, []).append(t)
+
+    rows = [None] * len(files)
+    for indices in groups.values():
+        result = segment_stack(as_gray(np.stack([images[t] for t in indices])), method, mean_factor, min_size, connectivity)
+        for n, t in enumerate(indices):
+            rows[t] = {'Date': parse_date(files[t]), 'Gray_Threshold': float(result['thresholds'][n]),
+                       'Pixels': int(result['areas'][n]), 'Area_m2': int(result['areas'][n]) * areas[t],
+                       'Components': int(result['components'][n])}
+    return rows